@@ -0,0 +1,187 @@
+"""
+Pool de navigateur partagé par tous les crawlers d'un même processus.
+
+- BrowserPool: un seul Chromium par processus (les handlers scrapy-playwright de chaque
+  crawler s'y connectent en CDP) et un plafond global de pages ouvertes simultanément,
+  partagé par tous les crawlers (run_parallel_spiders.py en lance trois dans le même reactor).
+- ContextSlots: par crawler, un nombre borné de contextes navigateur recyclés après
+  N navigations pour limiter la dérive mémoire de Chromium.
+"""
+
+import logging
+import socket
+import time
+
+from scrapy.utils.defer import deferred_from_coro
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+logger = logging.getLogger(__name__)
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class BrowserPool:
+    """Chromium unique et plafond global de pages pour le processus courant."""
+
+    _instance = None
+
+    def __init__(self, settings):
+        self.launch_options = dict(settings.getdict('PLAYWRIGHT_LAUNCH_OPTIONS'))
+        self.max_pages = settings.getint('BROWSER_POOL_MAX_PAGES', 8)
+        self.port = settings.getint('BROWSER_POOL_CDP_PORT', 0) or _free_port()
+        self.cdp_url = f'http://127.0.0.1:{self.port}'
+        self.semaphore = defer.DeferredSemaphore(self.max_pages)
+
+        self.users = 0
+        self.pages_in_use = 0
+        self.busy_seconds = 0.0
+        self.started_at = None
+        self._launching = None
+        self._launch_result = None
+        self._launch_waiters = []
+        self._playwright = None
+        self.browser = None
+
+    @classmethod
+    def instance(cls, settings):
+        """Pool du processus, créé par le premier crawler qui en a besoin."""
+        if cls._instance is None:
+            cls._instance = cls(settings)
+        return cls._instance
+
+    def acquire(self):
+        """Enregistre un crawler utilisateur et lance Chromium si nécessaire."""
+        self.users += 1
+        if self._launching is None:
+            self._launching = deferred_from_coro(self._launch())
+            self._launching.addBoth(self._launched)
+        if self._launch_result is not None:
+            return defer.fail(self._launch_result) if isinstance(self._launch_result, Failure) else defer.succeed(None)
+        waiter = defer.Deferred()
+        self._launch_waiters.append(waiter)
+        return waiter
+
+    def _launched(self, result):
+        self._launch_result = result if isinstance(result, Failure) else True
+        waiters, self._launch_waiters = self._launch_waiters, []
+        for waiter in waiters:
+            if isinstance(result, Failure):
+                waiter.errback(result)
+            else:
+                waiter.callback(None)
+
+    async def _launch(self):
+        from playwright.async_api import async_playwright
+
+        args = list(self.launch_options.pop('args', []))
+        args.append(f'--remote-debugging-port={self.port}')
+        self._playwright = await async_playwright().start()
+        self.browser = await self._playwright.chromium.launch(args=args, **self.launch_options)
+        self.started_at = time.monotonic()
+        logger.info(f"Pool navigateur: Chromium lancé ({self.cdp_url}), {self.max_pages} pages max")
+
+    def release(self):
+        """Libère un crawler; le dernier ferme Chromium."""
+        self.users -= 1
+        if self.users > 0 or self.browser is None:
+            return defer.succeed(None)
+        BrowserPool._instance = None
+        return deferred_from_coro(self._close())
+
+    async def _close(self):
+        await self.browser.close()
+        await self._playwright.stop()
+        logger.info("Pool navigateur: Chromium arrêté")
+
+    def run(self, download, stats):
+        """
+        Exécute `download()` (qui retourne un Deferred) dans une place du pool.
+        Le temps d'attente d'une place et l'utilisation du pool sont reportés dans les stats.
+        """
+        queued_at = time.monotonic()
+
+        def _start(_):
+            waited_ms = int((time.monotonic() - queued_at) * 1000)
+            stats.inc_value('browser_pool/queue_wait_ms_total', waited_ms)
+            stats.max_value('browser_pool/queue_wait_ms_max', waited_ms)
+            stats.inc_value('browser_pool/pages')
+            self.pages_in_use += 1
+            stats.max_value('browser_pool/pages_in_use_max', self.pages_in_use)
+            started_at = time.monotonic()
+            d = defer.maybeDeferred(download)
+            d.addBoth(_finish, started_at)
+            return d
+
+        def _finish(result, started_at):
+            self.pages_in_use -= 1
+            self.busy_seconds += time.monotonic() - started_at
+            stats.set_value('browser_pool/utilization_pct', self.utilization())
+            return result
+
+        d = self.semaphore.acquire()
+        d.addCallback(_start)
+        d.addBoth(lambda result: (self.semaphore.release(), result)[1])
+        return d
+
+    def utilization(self):
+        """Part (en %) de la capacité en pages réellement occupée depuis le lancement."""
+        if not self.started_at:
+            return 0
+        capacity = self.max_pages * (time.monotonic() - self.started_at)
+        return round(100 * self.busy_seconds / capacity, 1) if capacity else 0
+
+
+class ContextSlots:
+    """
+    Contextes navigateur d'un crawler: un ensemble borné de contextes nommés,
+    chacun remplacé par un nouveau après `recycle_after` navigations.
+    """
+
+    def __init__(self, size, recycle_after):
+        self.size = max(1, size)
+        self.recycle_after = recycle_after
+        self.generations = [0] * self.size
+        self.navigations = [0] * self.size
+        self.in_flight = {}
+        self.retiring = set()
+        self.closable = []
+
+    def name(self, slot):
+        return f'pool-{slot}-{self.generations[slot]}'
+
+    def assign(self):
+        """Choisit le contexte le moins chargé et compte une navigation."""
+        slot = min(range(self.size), key=lambda index: self.in_flight.get(self.name(index), 0))
+        if self.recycle_after and self.navigations[slot] >= self.recycle_after:
+            self._retire(self.name(slot))
+            self.generations[slot] += 1
+            self.navigations[slot] = 0
+        name = self.name(slot)
+        self.navigations[slot] += 1
+        self.in_flight[name] = self.in_flight.get(name, 0) + 1
+        return name
+
+    def release(self, name):
+        """Libère une page du contexte; un contexte retiré sans page ouverte devient fermable."""
+        self.in_flight[name] = self.in_flight.get(name, 1) - 1
+        if self.in_flight[name] <= 0:
+            del self.in_flight[name]
+            if name in self.retiring:
+                self.retiring.discard(name)
+                self.closable.append(name)
+
+    def pop_closable(self):
+        """Contextes retirés à fermer maintenant."""
+        closable, self.closable = self.closable, []
+        return closable
+
+    def _retire(self, name):
+        if self.in_flight.get(name):
+            self.retiring.add(name)
+        else:
+            self.closable.append(name)
@@ -0,0 +1,209 @@
+"""
+Plan de crawl partagé par les spiders: l'ensemble des combinaisons
+(catégorie, localisation) à parcourir et la fenêtre des combinaisons actives.
+
+Chaque combinaison correspond à une chaîne de pages de listing. Le plan ne
+construit pas les requêtes lui-même: il indique au spider quelles combinaisons
+démarrer, et le spider l'informe de chaque page de listing traitée (page_done): une
+chaîne est terminée quand plus aucune de ses pages n'est en attente. Quand la première
+page donne le nombre de pages, les suivantes sont demandées d'un coup (listing_pages).
+
+L'ordre des combinaisons est tiré d'une graine (argument `plan_seed`, setting
+CRAWL_PLAN_SEED, ou graine aléatoire enregistrée dans la frontière): un plan repris après
+un arrêt garde le même ordre. L'avancement (combinaisons terminées, page courante des
+chaînes en cours) est persisté par la frontière (frontier.py). Le rendement des crawls
+passés (yields.py) fait passer les combinaisons productives en premier et écarte les
+combinaisons vides pendant leur délai de backoff.
+"""
+
+import random
+import re
+from collections import deque
+
+from scrapy import signals
+
+from develly_scraper.frontier import CrawlFrontier
+from develly_scraper.yields import YieldTable
+
+
+def last_page_number(response, links_xpath, page_regex):
+    """Plus grand numéro de page des liens de pagination d'un listing (None si aucun)."""
+    pattern = re.compile(page_regex)
+    pages = [int(match.group(1)) for href in response.xpath(links_xpath).getall()
+             for match in [pattern.search(href)] if match]
+    return max(pages) if pages else None
+
+
+def listing_pages(current_page, last_page, has_next, max_pages):
+    """
+    Pages de listing à demander après `current_page` et page « de tête » parmi elles.
+
+    Dernière page connue: jusqu'à `max_pages` pages d'un coup, dont la dernière est toujours
+    la tête: la pagination affichée n'est souvent qu'une fenêtre (« 1 2 3 4 5 … Suivant »), la
+    tête la relit et la chaîne ne s'arrête que sur une page qui n'annonce plus de suite.
+    Sinon (ou max_pages=0), découverte séquentielle: la page suivante seule, si le listing en
+    annonce une. Retourne (pages, tête ou None).
+    """
+    if last_page and max_pages and last_page > current_page:
+        end = min(last_page, current_page + max_pages)
+        return list(range(current_page + 1, end + 1)), end
+    if has_next:
+        return [current_page + 1], current_page + 1
+    return [], None
+
+
+class CrawlPlan:
+    """
+    Plan (catégorie × localisation) avec une fenêtre glissante de combinaisons actives.
+
+    Avec max_concurrent=1, le comportement est celui de l'ancienne chaîne série
+    (toutes les localisations d'une catégorie, puis la catégorie suivante).
+    Avec max_concurrent=0, toutes les combinaisons sont lancées dès le départ.
+    """
+
+    def __init__(self, categories, locations, max_concurrent=1, seed=None, frontier=None, yields=None):
+        if seed is not None:
+            # Ordre déterministe pour une graine donnée (remplace le random.shuffle des spiders)
+            rng = random.Random(seed)
+            categories, locations = list(categories), list(locations)
+            rng.shuffle(categories)
+            rng.shuffle(locations)
+        self.order_seed = seed
+        self.combinations = [(category, location) for category in categories for location in locations]
+        # Rendement historique décroissant, combinaisons vides en backoff écartées
+        self.ordered, self.skipped, self.priorities = (yields or YieldTable()).prioritize(self.combinations)
+        self.max_concurrent = max(0, int(max_concurrent or 0))
+        self.frontier = frontier
+        self.done = set(frontier.done) if frontier else set()
+        # Prochaine page de listing des chaînes reprises (1 par défaut)
+        self.pages = dict(frontier.pages) if frontier else {}
+        # Les chaînes interrompues en cours de route repartent en premier
+        resumed = [key for key in self.combinations if key in self.pages and key not in self.done]
+        self.pending = deque(resumed + [key for key in self.ordered
+                                        if key not in self.pages and key not in self.done])
+        self.in_flight = set()
+        # Pages de listing demandées et pas encore traitées, par chaîne
+        self.outstanding = {}
+
+    @classmethod
+    def from_spider(cls, spider, categories, locations):
+        """
+        Construit le plan à partir des settings du spider.
+        L'argument de spider `plan_concurrency` est prioritaire sur le setting
+        CRAWL_PLAN_CONCURRENCY (qui peut lui-même être fixé par spider via custom_settings).
+        """
+        max_concurrent = getattr(spider, 'plan_concurrency', None)
+        if max_concurrent is None:
+            max_concurrent = spider.settings.getint('CRAWL_PLAN_CONCURRENCY', 1)
+
+        combinations = [(category, location) for category in categories for location in locations]
+        # Lue à l'ouverture du spider par YieldRecorder (table vide s'il est désactivé)
+        yields = getattr(spider, 'yield_table', None) or YieldTable()
+        if str(getattr(spider, 'distributed', spider.settings.getbool('CRAWL_DISTRIBUTED'))).lower() in ('1', 'true', 'yes'):
+            # Combinaisons partagées entre workers via MongoDB (import local: leases dépend de ce module)
+            from develly_scraper.leases import LeasedCrawlPlan
+            return LeasedCrawlPlan.create(spider, categories, locations, max_concurrent, yields)
+
+        frontier = CrawlFrontier.from_spider(spider, combinations)
+        seed = frontier.load() if frontier else None
+        if seed is None:
+            seed = getattr(spider, 'plan_seed', None) or spider.settings.get('CRAWL_PLAN_SEED')
+            seed = int(seed) if seed is not None else random.randrange(2 ** 32)
+        if frontier:
+            frontier.start(seed, len(combinations))
+            spider.crawler.signals.connect(frontier.close, signal=signals.spider_closed)
+
+        plan = cls(categories, locations, max_concurrent=max_concurrent, seed=seed, frontier=frontier,
+                   yields=yields)
+        if frontier and frontier.resumed:
+            spider.logger.info(f"Crawl plan resumed from {frontier.path}: {len(plan.done)} combinations done, "
+                               f"{len(plan.pages)} in progress")
+        plan.log_yields(spider, yields)
+        return plan
+
+    def log_yields(self, spider, yields):
+        if yields.records:
+            spider.logger.info(f"Crawl plan prioritised from {len(yields.records)} known yields: "
+                               f"{len(self.skipped)} empty combinations skipped until their next probe")
+        spider.crawler.stats.set_value('yield/combinations_skipped', len(self.skipped))
+
+    def __len__(self):
+        return len(self.combinations)
+
+    @property
+    def finished(self):
+        return not self.pending and not self.in_flight
+
+    def priority(self, category, location):
+        """Priorité Scrapy des requêtes de listing d'une combinaison (0 à 100, selon son rendement)."""
+        return self.priorities.get((category, location), 0)
+
+    def start_page(self, category, location):
+        """Page de listing par laquelle (re)commencer la chaîne."""
+        return self.pages.get((category, location), 1)
+
+    def checkpoint(self, category, location, page):
+        """
+        Enregistre la prochaine page de listing d'une chaîne en cours.
+        Retourne False si la chaîne ne doit pas continuer (bail perdu, voir leases.py).
+        """
+        key = (category, location)
+        if key in self.in_flight:
+            self.pages[key] = page
+            if self.frontier:
+                self.frontier.record(key, 'page', page)
+        return True
+
+    def page_done(self, category, location, page, next_pages=()):
+        """
+        Une page de listing a été traitée (ou a échoué) et a demandé `next_pages`.
+        Retourne True quand la chaîne est terminée: plus aucune page en attente, ou chaîne
+        perdue (voir checkpoint); le spider appelle alors complete().
+        """
+        key = (category, location)
+        if key not in self.in_flight:
+            return True
+        outstanding = self.outstanding.setdefault(key, set())
+        outstanding.update(next_pages)
+        outstanding.discard(page)
+        if not outstanding:
+            del self.outstanding[key]
+            return True
+        # Reprise à la plus petite page encore en attente
+        return not self.checkpoint(category, location, min(outstanding))
+
+    def seed(self):
+        """Réserve et retourne les combinaisons à lancer au démarrage."""
+        size = self.max_concurrent or len(self.pending)
+        seeded = []
+        while self.pending and len(self.in_flight) < size:
+            seeded.append(self._claim())
+        return seeded
+
+    def complete(self, category, location):
+        """
+        Marque une combinaison comme terminée et libère sa place dans la fenêtre.
+        Retourne la liste des combinaisons à lancer pour la remplacer (vide si le plan est épuisé).
+        """
+        key = (category, location)
+        if key in self.in_flight:
+            self.in_flight.discard(key)
+            self.done.add(key)
+            self.pages.pop(key, None)
+            self.outstanding.pop(key, None)
+            if self.frontier:
+                self.frontier.record(key, 'done')
+        elif key in self.done:
+            # Fin déjà signalée (ex: errback après une page vide), ne pas libérer deux fois
+            return []
+        seeded = self.seed()
+        if self.finished and self.frontier:
+            self.frontier.finish()
+        return seeded
+
+    def _claim(self):
+        key = self.pending.popleft()
+        self.in_flight.add(key)
+        if self.frontier:
+            self.frontier.record(key, 'claimed', self.start_page(*key))
+        return key
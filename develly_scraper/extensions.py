@@ -0,0 +1,313 @@
+"""
+Extensions Scrapy du projet.
+
+AdaptiveConcurrency: contrôle AIMD (augmentation additive, diminution multiplicative) de
+la concurrence et du délai de chaque slot de téléchargement, à la place d'AutoThrottle.
+
+- Deux voies par domaine: les requêtes `playwright` passent par un slot `<domaine>|browser`,
+  les requêtes HTTP pures par le slot habituel du domaine; chaque voie a ses propres bornes.
+  Les profils du mode listing seul ont leur voie `enrichment` (slot `<domaine>|enrichment`,
+  voir ListingFastModeMiddleware).
+- Toutes les AIMD_WINDOW réponses d'un slot, la fenêtre est évaluée:
+  erreurs (429, 5xx, échecs de téléchargement) au-delà de AIMD_ERROR_THRESHOLD ->
+  concurrence × AIMD_DECREASE_FACTOR (et délai doublé sur 429);
+  p95 de latence au-dessus de la cible de la voie -> concurrence - 1;
+  un 429 déclenche l'évaluation immédiatement;
+  sinon concurrence + 1 jusqu'au plafond, et le délai redescend vers sa base.
+- Plafonds par spider (AIMD_LIMITS[spider.name], complétés par AIMD_LIMITS["default"]).
+- Décisions courantes exposées dans les stats: aimd/<slot>/concurrency, delay, p95_ms,
+  error_rate, decision, et compteurs increase/decrease/hold.
+
+YieldRecorder: rendement de chaque combinaison (catégorie, localisation) du plan, enregistré
+dans crawl_yields à la fermeture du spider pour prioriser les crawls suivants (yields.py).
+"""
+
+import logging
+from collections import defaultdict
+from urllib.parse import urlparse
+
+from itemadapter import ItemAdapter
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Response
+from twisted.internet import threads
+
+from develly_scraper.mongo import get_client, release_client
+from develly_scraper.yields import YieldTable, record_yields
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMITS = {
+    'browser': {'min': 1, 'start': 2, 'max': 4},
+    'http': {'min': 1, 'start': 2, 'max': 8},
+    'enrichment': {'min': 1, 'start': 1, 'max': 2},
+}
+
+
+class SlotController:
+    """État AIMD d'un slot de téléchargement."""
+
+    def __init__(self, lane, limits, base_delay, max_delay, p95_target, error_threshold):
+        self.lane = lane
+        self.min = limits['min']
+        self.max = limits['max']
+        self.concurrency = float(min(max(limits['start'], self.min), self.max))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.delay = base_delay
+        self.p95_target = p95_target
+        self.error_threshold = error_threshold
+        self.samples = 0
+        self.latencies = []
+        self.errors = defaultdict(int)
+        self.decision = 'start'
+        self.p95 = None
+        self.error_rate = 0.0
+
+    def record(self, latency=None, error=None):
+        self.samples += 1
+        if error:
+            self.errors[error] += 1
+        if latency is not None:
+            self.latencies.append(latency)
+
+    def adjust(self, decrease_factor):
+        """Évalue la fenêtre écoulée et retourne la décision ('increase', 'decrease', 'hold')."""
+        total = self.samples
+        self.error_rate = sum(self.errors.values()) / total if total else 0.0
+        ordered = sorted(self.latencies)
+        self.p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else None
+
+        if self.error_rate > self.error_threshold:
+            self.concurrency = max(self.min, self.concurrency * decrease_factor)
+            if self.errors.get('429'):
+                # Le serveur demande explicitement de ralentir
+                self.delay = min(self.max_delay, max(self.delay * 2, self.base_delay or 0.5))
+            decision, reason = 'decrease', 'errors'
+        elif self.p95 is not None and self.p95 > self.p95_target:
+            self.concurrency = max(self.min, self.concurrency - 1)
+            decision, reason = 'decrease', 'latency'
+        elif self.concurrency < self.max or self.delay > self.base_delay:
+            self.concurrency = min(self.max, self.concurrency + 1)
+            self.delay = max(self.base_delay, self.delay * 0.75)
+            decision, reason = 'increase', 'healthy'
+        else:
+            decision, reason = 'hold', 'ceiling'
+
+        self.decision = f"{decision}:{reason}"
+        self.samples = 0
+        self.latencies = []
+        self.errors = defaultdict(int)
+        return decision
+
+
+class AdaptiveConcurrency:
+    """Pilote AIMD des slots du downloader (voir le docstring du module)."""
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('AIMD_ENABLED'):
+            raise NotConfigured
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.window = settings.getint('AIMD_WINDOW', 20)
+        self.error_threshold = settings.getfloat('AIMD_ERROR_THRESHOLD', 0.05)
+        self.decrease_factor = settings.getfloat('AIMD_DECREASE_FACTOR', 0.5)
+        self.base_delays = settings.getdict('AIMD_BASE_DELAY', {'browser': 0.5, 'http': 0.25})
+        self.max_delay = settings.getfloat('AIMD_MAX_DELAY', 60.0)
+        self.p95_targets = settings.getdict('AIMD_P95_TARGET', {'browser': 15.0, 'http': 3.0})
+        self.limits_setting = settings.getdict('AIMD_LIMITS')
+        self.error_codes = {int(code) for code in settings.getlist('AIMD_ERROR_CODES', [429, 500, 502, 503, 504])}
+        self.debug = settings.getbool('AIMD_DEBUG', False)
+        # clé de slot -> SlotController
+        self.controllers = {}
+
+        crawler.signals.connect(self.request_scheduled, signal=signals.request_scheduled)
+        crawler.signals.connect(self.request_reached_downloader, signal=signals.request_reached_downloader)
+        crawler.signals.connect(self.response_downloaded, signal=signals.response_downloaded)
+        crawler.signals.connect(self.request_left_downloader, signal=signals.request_left_downloader)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def limits_for(self, spider, lane):
+        """Bornes de concurrence d'une voie: réglages du spider, puis "default", puis valeurs par défaut."""
+        limits = dict(DEFAULT_LIMITS[lane])
+        limits.update(self.limits_setting.get('default', {}).get(lane, {}))
+        limits.update(self.limits_setting.get(spider.name, {}).get(lane, {}))
+        return limits
+
+    @staticmethod
+    def lane_for(request):
+        if request.meta.get('enrichment'):
+            return 'enrichment'
+        return 'browser' if request.meta.get('playwright') else 'http'
+
+    def request_scheduled(self, request, spider):
+        # Les pages rendues ont leur propre slot: leur latence ne freine pas le HTTP pur
+        # (le slot de la voie enrichment est fixé par ListingFastModeMiddleware)
+        if self.lane_for(request) == 'browser' and 'download_slot' not in request.meta:
+            request.meta['download_slot'] = f"{urlparse(request.url).hostname}|browser"
+
+    def _slot(self, request):
+        key = request.meta.get('download_slot')
+        slot = self.crawler.engine.downloader.slots.get(key) if key else None
+        return key, slot
+
+    def request_reached_downloader(self, request, spider):
+        key, slot = self._slot(request)
+        if slot is None or key in self.controllers:
+            return
+        lane = self.lane_for(request)
+        controller = SlotController(
+            lane, self.limits_for(spider, lane),
+            float(self.base_delays.get(lane, 0.0)), self.max_delay,
+            float(self.p95_targets.get(lane, 10.0)), self.error_threshold,
+        )
+        self.controllers[key] = controller
+        self._apply(key, slot, controller)
+
+    def response_downloaded(self, response, request, spider):
+        request.meta['aimd_recorded'] = True
+        controller = self.controllers.get(request.meta.get('download_slot'))
+        if controller is None:
+            return
+        error = str(response.status) if response.status in self.error_codes else None
+        controller.record(latency=request.meta.get('download_latency'), error=error)
+
+    def request_left_downloader(self, request, spider):
+        key, slot = self._slot(request)
+        controller = self.controllers.get(key)
+        if controller is None:
+            return
+        if not request.meta.pop('aimd_recorded', False):
+            # Sortie du downloader sans réponse: timeout, connexion refusée...
+            controller.record(error='exception')
+        # Un 429 est évalué sans attendre la fin de la fenêtre
+        if controller.samples >= self.window or controller.errors.get('429'):
+            decision = controller.adjust(self.decrease_factor)
+            self.stats.inc_value(f'aimd/{key}/{decision}')
+            if slot is not None:
+                self._apply(key, slot, controller)
+
+    def _apply(self, key, slot, controller):
+        slot.concurrency = max(1, int(controller.concurrency))
+        slot.delay = controller.delay
+        prefix = f'aimd/{key}'
+        self.stats.set_value(f'{prefix}/concurrency', slot.concurrency)
+        self.stats.set_value(f'{prefix}/delay', round(controller.delay, 3))
+        self.stats.set_value(f'{prefix}/decision', controller.decision)
+        self.stats.set_value(f'{prefix}/error_rate', round(controller.error_rate, 3))
+        if controller.p95 is not None:
+            self.stats.set_value(f'{prefix}/p95_ms', int(controller.p95 * 1000))
+        log = logger.info if self.debug else logger.debug
+        log(f"AIMD {key}: {controller.decision}, concurrence {slot.concurrency}, "
+            f"délai {controller.delay:.2f}s, p95 {controller.p95}, erreurs {controller.error_rate:.1%}")
+
+
+class YieldRecorder:
+    """
+    Lit la table des rendements du spider à son ouverture (`spider.yield_table`, utilisée
+    par CrawlPlan.from_spider; le moteur attend la lecture avant les premières requêtes).
+    Compte, par combinaison du plan (meta `category_tag`), les pages, les items, les
+    freelancers et le temps de navigateur, puis met à jour crawl_yields pour les chaînes
+    terminées. Stats: yield/items, browser_seconds, items_per_browser_minute,
+    combinations_productive, combinations_empty.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('CRAWL_YIELD_ENABLED'):
+            raise NotConfigured
+        self.stats = crawler.stats
+        self.mongo_uri = settings.get('MONGO_URI')
+        self.mongo_db = settings.get('MONGO_DATABASE')
+        self.backoff = settings.getint('CRAWL_YIELD_BACKOFF', 86400)
+        self.max_backoff = settings.getint('CRAWL_YIELD_MAX_BACKOFF', 30 * 86400)
+        # combinaison -> compteurs du crawl
+        self.results = defaultdict(lambda: {'freelancers': 0, 'items': 0, 'pages': 0, 'browser_seconds': 0.0})
+
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.response_received, signal=signals.response_received)
+        crawler.signals.connect(self.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def spider_opened(self, spider):
+        d = threads.deferToThread(self._load, spider.name)
+        d.addCallback(lambda table: setattr(spider, 'yield_table', table))
+        d.addErrback(lambda failure: spider.logger.warning(
+            f"Rendements historiques indisponibles, plan non priorisé: {failure.value!r}"))
+        return d
+
+    def _load(self, spider_name):
+        db = get_client(self.mongo_uri)[self.mongo_db]
+        try:
+            return YieldTable.fetch(db, spider_name)
+        finally:
+            release_client(self.mongo_uri)
+
+    @staticmethod
+    def _key(tag):
+        return (tag['category'], tag['location']) if tag else None
+
+    def response_received(self, response, request, spider):
+        key = self._key(request.meta.get('category_tag'))
+        if key is None:
+            return
+        result = self.results[key]
+        result['pages'] += 1
+        result['browser_seconds'] += request.meta.get('browser_seconds', 0.0)
+
+    def item_scraped(self, item, response, spider):
+        # Items d'un errback: `response` est la Failure, la meta est celle de sa requête
+        if isinstance(response, Response):
+            meta = response.meta
+        else:
+            request = getattr(response, 'request', None)
+            meta = request.meta if request is not None else {}
+        key = self._key(meta.get('category_tag'))
+        if key is not None:
+            self.results[key]['items'] += 1
+        adapter = ItemAdapter(item)
+        if adapter.get('_type') != 'freelancer' or meta.get('enrichment'):
+            # Profil enrichi (mode listing seul): déjà compté par sa carte
+            return
+        # Un profil trouvé par plusieurs combinaisons compte pour chacune
+        keys = {self._key(tag) for tag in adapter.get('category_tags') or []} or {key}
+        for tag_key in keys - {None}:
+            self.results[tag_key]['freelancers'] += 1
+
+    def spider_closed(self, spider, reason):
+        plan = getattr(spider, 'crawl_plan', None)
+        if plan is None:
+            return None
+        # Une chaîne interrompue n'a pas un rendement représentatif
+        results = {key: self.results[key] for key in plan.done}
+        items = sum(result['items'] for result in self.results.values())
+        browser_seconds = sum(result['browser_seconds'] for result in self.results.values())
+        self.stats.set_value('yield/items', items)
+        self.stats.set_value('yield/browser_seconds', round(browser_seconds, 1))
+        if browser_seconds:
+            self.stats.set_value('yield/items_per_browser_minute', round(items / (browser_seconds / 60), 2))
+        self.stats.set_value('yield/combinations_productive',
+                             sum(1 for result in results.values() if result['freelancers']))
+        self.stats.set_value('yield/combinations_empty',
+                             sum(1 for result in results.values() if not result['freelancers']))
+        if not results:
+            return None
+        d = threads.deferToThread(self._record, spider.name, results)
+        d.addCallback(lambda count: spider.logger.info(f"Rendement de {count} combinaisons enregistré"))
+        d.addErrback(lambda failure: spider.logger.error(f"Enregistrement des rendements en échec: {failure.value!r}"))
+        return d
+
+    def _record(self, spider_name, results):
+        db = get_client(self.mongo_uri)[self.mongo_db]
+        try:
+            return record_yields(db, spider_name, results, self.backoff, self.max_backoff)
+        finally:
+            release_client(self.mongo_uri)
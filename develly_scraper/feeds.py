@@ -0,0 +1,123 @@
+"""
+Écriture des exports JSONL des spiders.
+
+Un FeedWriter garde un seul fichier ouvert (bufferisé) par spider au lieu d'ouvrir et
+fermer le fichier à chaque item. Le flux est découpé en segments (rotation par taille
+et/ou par durée), éventuellement compressés (gzip, ou zstd si le module `zstandard`
+est installé). Un segment est écrit sous un nom `.part` puis renommé atomiquement
+une fois terminé: un fichier sans `.part` est toujours complet.
+"""
+
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+
+class FeedWriter:
+    """Flux JSONL bufferisé, segmenté et compressé."""
+
+    def __init__(self, path, compression=None, max_bytes=64 * 1024 * 1024, max_seconds=3600,
+                 fsync='rotate', fsync_interval=30, buffer_size=1024 * 1024):
+        if compression not in EXTENSIONS:
+            raise ValueError(f"Compression inconnue: {compression} (attendu: gzip, zstd ou None)")
+        # 'output/freelancer_all.json' -> segments 'output/freelancer_all.<horodatage>-0001.jsonl'
+        self.base_path = os.path.splitext(path)[0]
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.fsync = fsync  # 'never', 'rotate' ou 'interval'
+        self.fsync_interval = fsync_interval
+        self.buffer_size = buffer_size
+
+        self.sequence = 0
+        self.raw = None
+        self.stream = None
+        self.segment_path = None
+        self.segment_bytes = 0
+        self.segment_opened_at = None
+        self.last_fsync = None
+        self.items_written = 0
+
+    @classmethod
+    def from_settings(cls, settings, path):
+        return cls(
+            path,
+            compression=settings.get('FEED_WRITER_COMPRESSION'),
+            max_bytes=settings.getint('FEED_WRITER_MAX_BYTES', 64 * 1024 * 1024),
+            max_seconds=settings.getint('FEED_WRITER_MAX_SECONDS', 3600),
+            fsync=settings.get('FEED_WRITER_FSYNC', 'rotate'),
+            fsync_interval=settings.getint('FEED_WRITER_FSYNC_INTERVAL', 30),
+            buffer_size=settings.getint('FEED_WRITER_BUFFER_SIZE', 1024 * 1024),
+        )
+
+    def write(self, item):
+        """Ajoute un item (dict) au segment courant."""
+        if self.stream is None:
+            self._open_segment()
+
+        line = (json.dumps(item, ensure_ascii=False, default=str) + "\n").encode('utf-8')
+        self.stream.write(line)
+        self.segment_bytes += len(line)
+        self.items_written += 1
+
+        now = time.monotonic()
+        if self.fsync == 'interval' and now - self.last_fsync >= self.fsync_interval:
+            self._sync()
+        if ((self.max_bytes and self.segment_bytes >= self.max_bytes)
+                or (self.max_seconds and now - self.segment_opened_at >= self.max_seconds)):
+            self.rotate()
+
+    def rotate(self):
+        """Termine le segment courant; le suivant sera ouvert au prochain item."""
+        if self.stream is None:
+            return
+        self.stream.close()
+        if self.stream is not self.raw:
+            self.raw.close()
+        final_path = self.segment_path[:-len('.part')]
+        if self.fsync != 'never':
+            # Rouvrir pour fsync: le fichier est fermé mais ses pages peuvent être encore en cache
+            fd = os.open(self.segment_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        os.replace(self.segment_path, final_path)
+        logger.info(f"Segment de feed finalisé: {final_path} ({self.segment_bytes} octets non compressés)")
+        self.stream = self.raw = self.segment_path = None
+
+    def close(self):
+        self.rotate()
+
+    def _open_segment(self):
+        self.sequence += 1
+        directory = os.path.dirname(self.base_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        self.segment_path = f"{self.base_path}.{stamp}-{self.sequence:04d}.jsonl{EXTENSIONS[self.compression]}.part"
+
+        self.raw = open(self.segment_path, 'wb', buffering=self.buffer_size)
+        if self.compression == 'gzip':
+            self.stream = gzip.GzipFile(fileobj=self.raw, mode='wb')
+        elif self.compression == 'zstd':
+            import zstandard
+            self.stream = zstandard.ZstdCompressor().stream_writer(self.raw, closefd=False)
+        else:
+            self.stream = self.raw
+
+        self.segment_bytes = 0
+        self.segment_opened_at = self.last_fsync = time.monotonic()
+
+    def _sync(self):
+        self.stream.flush()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        self.last_fsync = time.monotonic()
@@ -0,0 +1,127 @@
+"""
+Frontière persistante du plan de crawl: reprise d'un crawl interrompu (crash, déploiement).
+
+L'avancement d'un plan (voir crawl_plan.py) est consigné dans un journal JSON Lines en
+ajout seul, un fichier par spider et par plan:
+
+    {"seed": 1234, "combinations": 250}          <- en-tête: graine de l'ordre du plan
+    {"k": ["php", "FR"], "s": "claimed", "p": 1}  <- combinaison démarrée
+    {"k": ["php", "FR"], "s": "page", "p": 4}     <- prochaine page de listing à parcourir
+    {"k": ["php", "FR"], "s": "done"}             <- chaîne terminée
+
+Au redémarrage, le journal est relu puis compacté: les combinaisons terminées sont sautées,
+celles en cours reprennent à leur dernière page enregistrée, avec le même ordre (même graine).
+Le journal est supprimé quand le plan est épuisé; le crawl suivant repart de zéro.
+"""
+
+import hashlib
+import json
+import os
+
+STATUSES = ('claimed', 'page', 'done')
+
+
+def plan_signature(combinations):
+    """Identifiant du plan, indépendant de l'ordre des combinaisons."""
+    payload = json.dumps(sorted(json.dumps(list(key)) for key in combinations))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:12]
+
+
+class CrawlFrontier:
+    """Journal d'avancement d'un plan de crawl."""
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self.seed = None
+        # combinaison -> prochaine page (combinaisons démarrées et non terminées)
+        self.pages = {}
+        self.done = set()
+        self.handle = None
+
+    @classmethod
+    def from_spider(cls, spider, combinations):
+        """Frontière du plan du spider, ou None si désactivée (setting ou `-a resume=0` pour repartir de zéro)."""
+        settings = spider.settings
+        if not settings.getbool('CRAWL_FRONTIER_ENABLED', True):
+            return None
+        directory = settings.get('CRAWL_FRONTIER_DIR', 'output/frontier')
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{spider.name}-{plan_signature(combinations)}.jsonl")
+        frontier = cls(path, fsync=settings.getbool('CRAWL_FRONTIER_FSYNC', False))
+        if str(getattr(spider, 'resume', '1')).lower() in ('0', 'false', 'no'):
+            frontier.discard()
+        return frontier
+
+    @property
+    def resumed(self):
+        return self.seed is not None
+
+    def load(self):
+        """Relit le journal existant; retourne la graine enregistrée (None si nouveau plan)."""
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # Dernière ligne tronquée par un arrêt brutal
+                    continue
+                if 'seed' in event:
+                    self.seed = event['seed']
+                    continue
+                key = tuple(event['k'])
+                if event['s'] == 'done':
+                    self.done.add(key)
+                    self.pages.pop(key, None)
+                elif key not in self.done:
+                    self.pages[key] = event.get('p') or 1
+        return self.seed
+
+    def start(self, seed, size):
+        """Réécrit le journal (en-tête + état compacté) et l'ouvre en ajout."""
+        self.seed = seed
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"seed": seed, "combinations": size}) + "\n")
+            for key in self.done:
+                f.write(json.dumps({"k": list(key), "s": "done"}) + "\n")
+            for key, page in self.pages.items():
+                f.write(json.dumps({"k": list(key), "s": "page", "p": page}) + "\n")
+        os.replace(tmp_path, self.path)
+        self.handle = open(self.path, 'a', encoding='utf-8')
+
+    def record(self, key, status, page=None):
+        if status not in STATUSES:
+            raise ValueError(f"Statut de frontière inconnu: {status}")
+        if status == 'done':
+            self.done.add(key)
+            self.pages.pop(key, None)
+        else:
+            self.pages[key] = page or 1
+        if self.handle is None:
+            return
+        event = {"k": list(key), "s": status}
+        if page is not None:
+            event["p"] = page
+        self.handle.write(json.dumps(event) + "\n")
+        self.handle.flush()
+        if self.fsync:
+            os.fsync(self.handle.fileno())
+
+    def finish(self):
+        """Plan épuisé: le journal n'a plus d'utilité."""
+        self.close()
+        self.discard()
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
@@ -0,0 +1,212 @@
+"""
+Gestionnaire de téléchargement hybride: HTTP classique d'abord, Chromium seulement en secours.
+
+Les requêtes marquées `playwright: True` sont d'abord téléchargées par le handler HTTP de
+Scrapy. Si les sélecteurs attendus pour le type de page (PLAYWRIGHT_READY_SELECTORS) sont
+présents dans le HTML brut, la réponse est utilisée telle quelle; sinon la requête est rejouée
+dans Chromium via scrapy-playwright.
+
+Des statistiques par motif d'URL permettent d'envoyer directement au navigateur les pages
+qui ont toujours besoin du rendu. Le handler Playwright n'est créé qu'à la première requête
+qui en a besoin: un spider en HTTP pur ne démarre jamais Chromium.
+
+Avec BROWSER_POOL_ENABLED, les pages rendues passent par le pool de navigateur du processus
+(voir browser_pool.py): Chromium partagé, contextes recyclés et plafond global de pages.
+"""
+
+import logging
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from scrapy.http import HtmlResponse
+from scrapy.utils.defer import deferred_from_coro
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+from develly_scraper.browser_pool import BrowserPool, ContextSlots
+
+logger = logging.getLogger(__name__)
+
+
+class HybridDownloadHandler:
+    lazy = False
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        settings = crawler.settings
+        # 'hybrid': HTTP d'abord puis navigateur; 'browser': navigateur pour toutes les requêtes playwright
+        self.mode = settings.get('HYBRID_FETCH_MODE', 'hybrid')
+        self.selectors = settings.getdict('PLAYWRIGHT_READY_SELECTORS')
+        self.min_samples = settings.getint('HYBRID_FETCH_MIN_SAMPLES', 10)
+        self.min_http_ratio = settings.getfloat('HYBRID_FETCH_MIN_HTTP_RATIO', 0.2)
+
+        self.http_handler = HTTP11DownloadHandler.from_crawler(crawler)
+        self.browser_handler = None
+        # Lancement de Playwright en cours ou réussi; remis à None si le lancement échoue
+        self._browser_start = None
+        self._browser_started = False
+        self._browser_waiters = []
+
+        # Pool de navigateur partagé par les crawlers du processus
+        self.pool = None
+        self.pool_enabled = settings.getbool('BROWSER_POOL_ENABLED', True)
+        self.context_slots = ContextSlots(
+            settings.getint('BROWSER_POOL_CONTEXTS', 2),
+            settings.getint('BROWSER_POOL_RECYCLE_AFTER', 100),
+        )
+
+        # Résultats du HTTP brut par motif d'URL
+        self.patterns = defaultdict(lambda: {'http_ok': 0, 'http_miss': 0})
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def download_request(self, request, spider):
+        if not request.meta.get('playwright'):
+            return self.http_handler.download_request(request, spider)
+
+        selector = self.selectors.get(spider.name, {}).get(request.meta.get('page_type'))
+        pattern = self.url_pattern(request)
+        if (self.mode != 'hybrid' or not selector or request.meta.get('playwright_force')
+                or self.needs_browser(pattern)):
+            self.stats.inc_value('hybrid/browser_direct')
+            return self._download_with_browser(request, spider)
+
+        d = self.http_handler.download_request(request, spider)
+        d.addCallbacks(
+            self._check_http_response, self._http_failed,
+            callbackArgs=(request, spider, selector, pattern),
+            errbackArgs=(request, spider, pattern),
+        )
+        return d
+
+    @staticmethod
+    def url_pattern(request):
+        """Motif d'une URL: hôte + premier segment du chemin + type de page."""
+        parsed = urlparse(request.url)
+        segments = [segment for segment in parsed.path.split('/') if segment]
+        first_segment = segments[0] if segments else ''
+        return f"{parsed.netloc}/{first_segment}#{request.meta.get('page_type', '')}"
+
+    def needs_browser(self, pattern):
+        """Un motif qui ne passe presque jamais en HTTP brut va directement au navigateur."""
+        counts = self.patterns[pattern]
+        total = counts['http_ok'] + counts['http_miss']
+        return total >= self.min_samples and counts['http_ok'] / total < self.min_http_ratio
+
+    def _check_http_response(self, response, request, spider, selector, pattern):
+        if isinstance(response, HtmlResponse) and response.status == 200 and response.css(selector):
+            self._record(pattern, 'http_ok')
+            return response
+        self._record(pattern, 'http_miss')
+        return self._download_with_browser(request, spider)
+
+    def _http_failed(self, failure, request, spider, pattern):
+        logger.debug(f"HTTP brut en échec pour {request.url}, passage au navigateur: {failure.value!r}")
+        self._record(pattern, 'http_miss')
+        return self._download_with_browser(request, spider)
+
+    def _record(self, pattern, outcome):
+        self.patterns[pattern][outcome] += 1
+        self.stats.inc_value(f'hybrid/{outcome}')
+        self.stats.inc_value(f'hybrid/patterns/{pattern}/{outcome}')
+
+    def _download_with_browser(self, request, spider):
+        self.stats.inc_value('hybrid/browser_requests')
+        d = self._when_browser_started()
+        if self.pool is not None:
+            d.addCallback(lambda _: self.pool.run(lambda: self._timed(self._pooled_download(request, spider), request),
+                                                  self.stats))
+        else:
+            d.addCallback(lambda _: self._timed(self.browser_handler.download_request(request, spider), request))
+        return d
+
+    def _timed(self, d, request):
+        """Temps passé dans le navigateur, par requête (request.meta['browser_seconds']) et au total."""
+        started = time.monotonic()
+
+        def record(result):
+            elapsed = time.monotonic() - started
+            request.meta['browser_seconds'] = request.meta.get('browser_seconds', 0.0) + elapsed
+            self.stats.inc_value('hybrid/browser_seconds', elapsed)
+            return result
+
+        return d.addBoth(record)
+
+    def _pooled_download(self, request, spider):
+        # Contexte attribué par le pool, sauf si le spider en impose un
+        if request.meta.get('pool_context') or not request.meta.get('playwright_context'):
+            request.meta['playwright_context'] = self.context_slots.assign()
+            request.meta['pool_context'] = True
+        context_name = request.meta['playwright_context']
+        d = self.browser_handler.download_request(request, spider)
+        d.addBoth(self._release_context, context_name)
+        return d
+
+    def _release_context(self, result, context_name):
+        self.context_slots.release(context_name)
+        for name in self.context_slots.pop_closable():
+            wrapper = getattr(self.browser_handler, 'context_wrappers', {}).get(name)
+            if wrapper is not None:
+                self.stats.inc_value('browser_pool/contexts_recycled')
+                deferred_from_coro(wrapper.context.close()).addErrback(
+                    lambda failure, name=name: logger.warning(f"Fermeture du contexte {name} impossible: {failure.value!r}"))
+        return result
+
+    def _start_browser_handler(self):
+        # Import tardif: Playwright n'est chargé que si un spider en a besoin
+        from scrapy_playwright.handler import ScrapyPlaywrightDownloadHandler
+
+        logger.info("Démarrage du handler Playwright (première page à rendre)")
+        self.browser_handler = ScrapyPlaywrightDownloadHandler.from_crawler(self.crawler)
+        if self.pool_enabled:
+            self.pool = BrowserPool.instance(self.crawler.settings)
+            d = self.pool.acquire()
+            # Connexion CDP au Chromium du pool au lieu d'un navigateur propre au crawler
+            d.addCallback(lambda _: setattr(self.browser_handler.config, 'cdp_url', self.pool.cdp_url))
+        else:
+            d = defer.succeed(None)
+        # Le signal engine_started est déjà passé: lancer Playwright explicitement
+        d.addCallback(lambda _: deferred_from_coro(self.browser_handler._launch()))
+        self._browser_start = d
+        d.addBoth(self._browser_handler_started)
+
+    def _browser_handler_started(self, result):
+        waiters, self._browser_waiters = self._browser_waiters, []
+        if isinstance(result, Failure):
+            # Les requêtes en attente échouent avec l'erreur réelle; la suivante relancera Playwright
+            logger.error(f"Démarrage de Playwright en échec: {result.value!r}")
+            self._browser_start = None
+            self.browser_handler = None
+            if self.pool is not None:
+                self.pool.release()
+                self.pool = None
+            for waiter in waiters:
+                waiter.errback(result)
+            return None
+        self._browser_started = True
+        for waiter in waiters:
+            waiter.callback(None)
+        return None
+
+    def _when_browser_started(self):
+        if self._browser_started:
+            return defer.succeed(None)
+        # Attente enregistrée avant le lancement: un échec immédiat la déclenche aussi
+        waiter = defer.Deferred()
+        self._browser_waiters.append(waiter)
+        if self._browser_start is None:
+            self._start_browser_handler()
+        return waiter
+
+    @defer.inlineCallbacks
+    def close(self):
+        yield self.http_handler.close()
+        if self.browser_handler is not None:
+            yield self.browser_handler.close()
+        if self.pool is not None:
+            yield self.pool.release()
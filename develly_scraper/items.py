@@ -40,23 +40,32 @@ class FreelancerItem(scrapy.Item):
     country_id = scrapy.Field()
     created_at = scrapy.Field()
     is_verified = scrapy.Field()
+    category_tags = scrapy.Field()
+    _id = scrapy.Field()
 
 
 class ReviewItem(scrapy.Item):
     """Item pour les avis/reviews des freelancers"""
     freelancer_id = scrapy.Field()
+    freelancer_ref = scrapy.Field()
+    freelancer_url = scrapy.Field()
     author = scrapy.Field()
     rating = scrapy.Field()
     picture = scrapy.Field()
     text = scrapy.Field()
     title = scrapy.Field()
     created_at = scrapy.Field()
+    review_date = scrapy.Field()
+    content_key = scrapy.Field()
 
 
 class ServiceItem(scrapy.Item):
     """Item pour les services proposés par un freelancer"""
     freelancer_id = scrapy.Field()
+    freelancer_ref = scrapy.Field()
+    freelancer_url = scrapy.Field()
     title = scrapy.Field()
     description = scrapy.Field()
     price = scrapy.Field() 
     duration = scrapy.Field()
+    content_key = scrapy.Field()
@@ -0,0 +1,378 @@
+"""
+Crawl distribué: plusieurs workers (processus, machines) se partagent un même plan.
+
+Les combinaisons (catégorie, localisation) du plan sont stockées dans MongoDB
+(collection `crawl_leases`, un document par combinaison). Chaque worker lance le même
+spider avec `-a distributed=1`: il réserve des combinaisons par un bail (lease) à durée
+limitée, le renouvelle périodiquement (heartbeat) et le rend à la fin de la chaîne.
+
+- Worker mort: son bail expire (CRAWL_LEASE_TTL) et la combinaison est reprise par un
+  autre worker à la dernière page enregistrée.
+- Arrêt propre: les baux en cours sont rendus immédiatement.
+- Combinaison en échec répété: plus réservée après CRAWL_LEASE_MAX_ATTEMPTS baux. Seuls
+  comptent les baux repris après expiration (worker mort) ou les chaînes orphelines à
+  répétition; un bail rendu proprement (arrêt, première chaîne orpheline) n'est pas compté.
+
+La graine de l'ordre du plan est fixée par le premier worker (collection `crawl_plans`);
+le débit de chaque worker est publié dans `crawl_workers` (voir `maintenance.py workers`).
+Les opérations de bail (réservation, page, fin, heartbeat) passent dans l'ordre par un
+thread d'écriture dédié (MongoWriter): le reactor n'attend jamais MongoDB, et l'état local
+du plan (chaînes en cours, pages) n'est modifié que dans le thread du reactor, à la
+réception des résultats. Seule la lecture de la graine du plan, au démarrage, est synchrone.
+"""
+
+import json
+import os
+import random
+import socket
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+from twisted.internet import task
+
+from develly_scraper.crawl_plan import CrawlPlan
+from develly_scraper.frontier import plan_signature
+from develly_scraper.mongo import MongoWriter, get_client, release_client
+
+DUPLICATE_KEY = 11000
+
+
+class LeasedCrawlPlan(CrawlPlan):
+    """CrawlPlan dont les combinaisons sont réservées dans MongoDB plutôt que dans une file locale."""
+
+    def __init__(self, categories, locations, max_concurrent=1, seed=None, db=None, plan_id=None,
+                 worker_id=None, lease_ttl=300, max_attempts=3, stats=None, logger=None, yields=None):
+        super().__init__(categories, locations, max_concurrent=max_concurrent, seed=seed, yields=yields)
+        # La file est dans MongoDB
+        self.pending = deque()
+        self.db = db
+        self.plan_id = plan_id
+        self.worker_id = worker_id
+        self.lease_ttl = timedelta(seconds=lease_ttl)
+        self.max_attempts = max_attempts
+        self.stats = stats
+        self.logger = logger
+        self.spider = None
+        self.writer = None
+        self.exhausted = False
+        self.closing = False
+        # Réservations envoyées au thread d'écriture, sans réponse encore
+        self.claiming = 0
+        # Combinaisons non terminées dans MongoDB (None: pas encore compté)
+        self.remaining = None
+        # Combinaisons déjà rendues une fois comme orphelines par ce worker
+        self.orphaned = set()
+        self.heartbeat = None
+        self.started_at = datetime.utcnow()
+        self.completed = 0
+
+    @classmethod
+    def create(cls, spider, categories, locations, max_concurrent, yields=None):
+        settings = spider.settings
+        mongo_uri = settings.get('MONGO_URI')
+        db = get_client(mongo_uri)[settings.get('MONGO_DATABASE')]
+        combinations = [(category, location) for category in categories for location in locations]
+        plan_id = f"{spider.name}-{plan_signature(combinations)}"
+
+        # Le premier worker fixe la graine; les suivants la relisent
+        seed = getattr(spider, 'plan_seed', None) or settings.get('CRAWL_PLAN_SEED')
+        seed = int(seed) if seed is not None else random.randrange(2 ** 32)
+        plan_doc = db.crawl_plans.find_one_and_update(
+            {"_id": plan_id},
+            {"$setOnInsert": {"spider": spider.name, "seed": seed, "combinations": len(combinations),
+                              "created_at": datetime.utcnow()}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+
+        worker_id = getattr(spider, 'worker_id', None) or \
+            f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        plan = cls(
+            categories, locations,
+            # 0 (tout lancer) n'a pas de sens quand les combinaisons sont partagées
+            max_concurrent=max_concurrent or 1,
+            seed=plan_doc['seed'],
+            db=db,
+            plan_id=plan_id,
+            worker_id=worker_id,
+            lease_ttl=settings.getint('CRAWL_LEASE_TTL', 300),
+            max_attempts=settings.getint('CRAWL_LEASE_MAX_ATTEMPTS', 3),
+            stats=spider.crawler.stats,
+            logger=spider.logger,
+            yields=yields,
+        )
+        plan.spider = spider
+        # File non bornée: une opération par chaîne ou page de listing, exécutées dans l'ordre
+        plan.writer = MongoWriter(max_queue=0, name=f'lease-writer-{spider.name}')
+        # Avant toute réservation (même file)
+        plan._submit(plan._populate)
+        plan._submit(plan._register_worker, spider.name)
+        if yields is not None:
+            plan.log_yields(spider, yields)
+
+        plan.heartbeat = task.LoopingCall(plan._beat)
+        plan.heartbeat.start(settings.getint('CRAWL_LEASE_HEARTBEAT', 60), now=False)
+        spider.crawler.signals.connect(plan.spider_idle, signal=signals.spider_idle)
+        spider.crawler.signals.connect(plan.spider_closed, signal=signals.spider_closed)
+        spider.logger.info(f"Distributed crawl plan {plan_id} as worker {worker_id}")
+        return plan
+
+    def _submit(self, func, *args):
+        """Opération MongoDB sur le thread d'écriture; le Deferred se déclenche dans le reactor."""
+        d = self.writer.submit(func, *args)
+        d.addErrback(self._failed, getattr(func, '__name__', func))
+        return d
+
+    def _failed(self, failure, operation):
+        self.logger.error(f"Lease operation {operation} failed: {failure.value!r}")
+        return None
+
+    def _lease_id(self, key):
+        return f"{self.plan_id}:{json.dumps(list(key))}"
+
+    def _populate(self):
+        """
+        Crée les combinaisons absentes (idempotent, plusieurs workers peuvent démarrer ensemble).
+        L'ordre est celui du premier worker: rendement historique, puis graine; les
+        combinaisons vides en backoff ne sont pas inscrites.
+        """
+        leases = self.db.crawl_leases
+        leases.create_index([("plan", 1), ("status", 1), ("order", 1)])
+        operations = [
+            UpdateOne(
+                {"_id": self._lease_id(key)},
+                {"$setOnInsert": {"plan": self.plan_id, "key": list(key), "order": order,
+                                  "status": "pending", "page": 1, "attempts": 0}},
+                upsert=True
+            )
+            for order, key in enumerate(self.ordered)
+        ]
+        if not operations:
+            return
+        try:
+            leases.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Upserts concurrents sur le même _id: le document existe, c'est le but
+            if any(error.get('code') != DUPLICATE_KEY for error in e.details.get('writeErrors', [])):
+                raise
+
+    def _register_worker(self, spider_name):
+        self.db.crawl_workers.update_one(
+            {"_id": self.worker_id},
+            {"$set": {"plan": self.plan_id, "spider": spider_name, "host": socket.gethostname(),
+                      "pid": os.getpid(), "status": "running", "started_at": self.started_at,
+                      "heartbeat_at": self.started_at}},
+            upsert=True
+        )
+
+    def _inc_stat(self, key, count=1):
+        if self.stats:
+            self.stats.inc_value(f'leases/{key}', count)
+
+    @property
+    def finished(self):
+        return self.exhausted and not self.in_flight and not self.claiming
+
+    def _fill(self):
+        """Demande assez de réservations pour remplir la fenêtre; les chaînes obtenues sont lancées à réception."""
+        while (not self.exhausted and not self.closing
+               and len(self.in_flight) + self.claiming < self.max_concurrent):
+            self.claiming += 1
+            d = self.writer.submit(self._claim_lease)
+            d.addCallbacks(self._claimed, self._claim_failed)
+
+    def _claim_lease(self):
+        """Thread d'écriture: réserve la prochaine combinaison libre ou dont le bail a expiré (None s'il n'y en a plus)."""
+        now = datetime.utcnow()
+        return self.db.crawl_leases.find_one_and_update(
+            {"plan": self.plan_id, "attempts": {"$lt": self.max_attempts},
+             "$or": [{"status": "pending"}, {"status": "leased", "lease_until": {"$lt": now}}]},
+            {"$set": {"status": "leased", "worker": self.worker_id, "lease_until": now + self.lease_ttl,
+                      "leased_at": now},
+             "$inc": {"attempts": 1}},
+            sort=[("order", 1)], return_document=ReturnDocument.AFTER
+        )
+
+    def _claimed(self, lease):
+        self.claiming -= 1
+        if lease is None:
+            self.exhausted = True
+            return
+        if self.closing:
+            # Rendu par _shutdown, qui passe après dans la file
+            return
+        key = tuple(lease['key'])
+        self.in_flight.add(key)
+        self.pages[key] = lease.get('page') or 1
+        self._inc_stat('claimed')
+        if lease['attempts'] > 1:
+            self._inc_stat('reclaimed')
+        category, location = key
+        self.spider.crawler.engine.crawl(
+            self.spider._listing_request(category, location, self.start_page(category, location)))
+
+    def _claim_failed(self, failure):
+        self.claiming -= 1
+        self.logger.error(f"Lease claim failed: {failure.value!r}")
+
+    def seed(self):
+        # Les chaînes réservées sont lancées par _claimed, pas par le spider
+        self._fill()
+        return []
+
+    def checkpoint(self, category, location, page):
+        """
+        Enregistre la page et prolonge le bail. La perte du bail (repris par un autre worker)
+        n'est connue qu'à la réponse de MongoDB: la chaîne est alors abandonnée (voir _checkpointed).
+        """
+        key = (category, location)
+        if key not in self.in_flight:
+            return False
+        self.pages[key] = page
+        d = self._submit(self._save_page, key, page)
+        d.addCallback(self._checkpointed, key)
+        return True
+
+    def _save_page(self, key, page):
+        result = self.db.crawl_leases.update_one(
+            {"_id": self._lease_id(key), "worker": self.worker_id, "status": "leased"},
+            {"$set": {"page": page, "lease_until": datetime.utcnow() + self.lease_ttl}}
+        )
+        return result.matched_count
+
+    def _checkpointed(self, matched, key):
+        # None: opération en échec (déjà journalisée), le bail n'est pas réputé perdu
+        if matched != 0 or key not in self.in_flight:
+            return
+        self.in_flight.discard(key)
+        self.pages.pop(key, None)
+        self.outstanding.pop(key, None)
+        self._inc_stat('lost')
+        self.logger.warning(f"Lease lost for {key}, chain abandoned to its new owner")
+        self._fill()
+
+    def complete(self, category, location):
+        key = (category, location)
+        if key in self.in_flight:
+            self.in_flight.discard(key)
+            self.pages.pop(key, None)
+            self.outstanding.pop(key, None)
+            self.done.add(key)
+            self.completed += 1
+            self._submit(self._mark_done, key)
+            self._inc_stat('completed')
+        elif key in self.done:
+            return []
+        self._fill()
+        return []
+
+    def _mark_done(self, key):
+        self.db.crawl_leases.update_one(
+            {"_id": self._lease_id(key), "worker": self.worker_id},
+            {"$set": {"status": "done", "done_at": datetime.utcnow()}, "$unset": {"lease_until": ""}}
+        )
+
+    def _count_remaining(self):
+        """Combinaisons non terminées encore réservables (baux d'autres workers compris)."""
+        return self.db.crawl_leases.count_documents(
+            {"plan": self.plan_id, "status": {"$in": ["pending", "leased"]},
+             "attempts": {"$lt": self.max_attempts}}
+        )
+
+    def _set_remaining(self, remaining):
+        if remaining is not None:
+            self.remaining = remaining
+
+    def spider_idle(self, spider):
+        """
+        Plus aucune requête: les chaînes encore marquées en cours sont orphelines (requête
+        filtrée ou perdue) et sont rendues; puis on réserve de nouvelles combinaisons, ou on
+        attend l'expiration des baux des autres workers tant que le plan n'est pas terminé.
+        Le décompte des combinaisons restantes est rafraîchi à chaque passage (spider_idle
+        revient toutes les quelques secondes): la décision utilise le dernier connu.
+        """
+        for key in list(self.in_flight):
+            self._release(key)
+        self.exhausted = False
+        self._fill()
+        self._submit(self._count_remaining).addCallback(self._set_remaining)
+        if self.in_flight or self.claiming or self.remaining is None or self.remaining:
+            raise DontCloseSpider
+
+    def _release(self, key):
+        """
+        Rend une combinaison orpheline (reprise à sa dernière page). La première fois, la
+        tentative est décomptée; une chaîne qui redevient orpheline (requête toujours filtrée,
+        par exemple) compte comme un échec, pour ne pas boucler indéfiniment.
+        """
+        clean = key not in self.orphaned
+        self.orphaned.add(key)
+        self.in_flight.discard(key)
+        self.outstanding.pop(key, None)
+        self._submit(self._release_lease, key, self.pages.pop(key, 1), clean)
+        self._inc_stat('released')
+
+    def _release_lease(self, key, page, clean):
+        update = {"$set": {"status": "pending", "page": page}, "$unset": {"worker": "", "lease_until": ""}}
+        if clean:
+            update["$inc"] = {"attempts": -1}
+        self.db.crawl_leases.update_one(
+            {"_id": self._lease_id(key), "worker": self.worker_id, "status": "leased"}, update)
+
+    def _beat(self):
+        counters = {
+            "items": self.stats.get_value('item_scraped_count', 0),
+            "pages": self.stats.get_value('response_received_count', 0),
+            "combinations_done": self.completed,
+            "in_flight": len(self.in_flight),
+        }
+        d = self._submit(self._renew, [self._lease_id(key) for key in self.in_flight], counters)
+        d.addCallback(self._set_remaining)
+        return d
+
+    def _renew(self, lease_ids, counters):
+        now = datetime.utcnow()
+        if lease_ids:
+            self.db.crawl_leases.update_many(
+                {"_id": {"$in": lease_ids}, "worker": self.worker_id, "status": "leased"},
+                {"$set": {"lease_until": now + self.lease_ttl}}
+            )
+        minutes = max((now - self.started_at).total_seconds() / 60, 1e-6)
+        self.db.crawl_workers.update_one(
+            {"_id": self.worker_id},
+            {"$set": {**counters, "heartbeat_at": now,
+                      "items_per_minute": round(counters['items'] / minutes, 2),
+                      "pages_per_minute": round(counters['pages'] / minutes, 2)}}
+        )
+        return self._count_remaining()
+
+    def spider_closed(self, spider, reason):
+        self.closing = True
+        if self.heartbeat and self.heartbeat.running:
+            self.heartbeat.stop()
+        self._beat()
+        self._submit(self._shutdown, reason)
+        d = self.writer.stop()
+        d.addBoth(lambda _: release_client(spider.settings.get('MONGO_URI')))
+        return d
+
+    def _shutdown(self, reason):
+        """
+        Thread d'écriture, après toutes les opérations en file: rend les baux de ce worker
+        (réservations arrivées pendant l'arrêt comprises) à leur dernière page enregistrée.
+        Un arrêt propre n'est pas un échec: la tentative est décomptée.
+        """
+        released = self.db.crawl_leases.update_many(
+            {"plan": self.plan_id, "worker": self.worker_id, "status": "leased"},
+            {"$set": {"status": "pending"}, "$unset": {"worker": "", "lease_until": ""},
+             "$inc": {"attempts": -1}}
+        )
+        self.db.crawl_workers.update_one(
+            {"_id": self.worker_id},
+            {"$set": {"status": "finished", "finished_at": datetime.utcnow(), "reason": reason,
+                      "released": released.modified_count}}
+        )
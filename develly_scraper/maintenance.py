@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""
+Commandes de maintenance de la base MongoDB.
+Usage: python -m develly_scraper.maintenance <commande> [options]
+Commandes:
+  backfill-freelancer-refs   Résoudre les freelancer_id (URLs de profil) des reviews et services
+                             existants en freelancer_ref (ObjectId du freelancer)
+  backfill-content-keys      Calculer le content_key des reviews et services existants,
+                             supprimer les doublons et créer l'index unique
+  workers                    Avancement des plans distribués et débit de chaque worker
+"""
+
+import argparse
+
+from bson.objectid import ObjectId
+from pymongo import DeleteMany, MongoClient, UpdateMany, UpdateOne
+from scrapy.utils.project import get_project_settings
+
+from develly_scraper.pipelines import CONTENT_KEY_FIELDS, content_key
+
+REF_COLLECTIONS = ('reviews', 'services')
+
+
+def _chunks(values, size):
+    chunk = []
+    for value in values:
+        chunk.append(value)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def backfill_freelancer_refs(db, batch_size=500, dry_run=False):
+    """
+    Ajoute freelancer_ref / freelancer_url aux reviews et services qui n'en ont pas.
+    `freelancer_id` peut contenir l'URL du profil (anciens imports) ou déjà l'_id du freelancer.
+    Retourne {collection: (documents mis à jour, valeurs non résolues)}; avec dry_run, le
+    premier nombre est celui des valeurs résolubles.
+    """
+    db.reviews.create_index("freelancer_ref")
+    db.services.create_index("freelancer_ref")
+
+    results = {}
+    for collection in REF_COLLECTIONS:
+        # Valeurs distinctes en flux ($group plutôt que distinct, limité à 16 Mo)
+        values = (group['_id'] for group in db[collection].aggregate([
+            {"$match": {"freelancer_ref": {"$exists": False}, "freelancer_id": {"$nin": [None, ""]}}},
+            {"$group": {"_id": "$freelancer_id"}},
+        ], allowDiskUse=True))
+        updated, unresolved = 0, 0
+
+        for chunk in _chunks(values, batch_size):
+            ids = [ObjectId(value) for value in chunk if isinstance(value, str) and ObjectId.is_valid(value)]
+            urls = [value for value in chunk if not (isinstance(value, str) and ObjectId.is_valid(value))]
+            freelancers = db.freelancers.find(
+                {"$or": [{"_id": {"$in": ids}}, {"url": {"$in": urls}}]}, {"url": 1})
+            by_value = {}
+            for freelancer in freelancers:
+                by_value[str(freelancer['_id'])] = freelancer
+                if freelancer.get('url'):
+                    by_value[freelancer['url']] = freelancer
+
+            operations = []
+            for value in chunk:
+                freelancer = by_value.get(str(value))
+                if freelancer is None:
+                    unresolved += 1
+                    continue
+                operations.append(UpdateMany(
+                    {"freelancer_id": value, "freelancer_ref": {"$exists": False}},
+                    {"$set": {
+                        "freelancer_ref": freelancer['_id'],
+                        "freelancer_url": freelancer.get('url'),
+                        "freelancer_id": str(freelancer['_id']),
+                    }}
+                ))
+            if operations and not dry_run:
+                updated += db[collection].bulk_write(operations, ordered=False).modified_count
+            elif dry_run:
+                updated += len(operations)
+
+        results[collection] = (updated, unresolved)
+    return results
+
+
+def backfill_content_keys(db, batch_size=1000, dry_run=False):
+    """
+    Renseigne content_key sur les reviews et services qui n'en ont pas, supprime les doublons
+    (le plus ancien document est conservé) puis crée l'index unique utilisé par MongoDBPipeline.
+    Retourne {collection: (documents complétés, doublons supprimés)}.
+    """
+    results = {}
+    for collection, fields in CONTENT_KEY_FIELDS.items():
+        projection = dict.fromkeys(('freelancer_url', 'freelancer_ref', 'freelancer_id') + fields, 1)
+        documents = db[collection].find({"content_key": {"$exists": False}}, projection)
+        keyed = 0
+        for chunk in _chunks(documents, batch_size):
+            operations = [
+                UpdateOne({"_id": document['_id']}, {"$set": {"content_key": content_key(collection, document)}})
+                for document in chunk
+            ]
+            if not dry_run:
+                db[collection].bulk_write(operations, ordered=False)
+            keyed += len(operations)
+
+        # Doublons: même content_key, on garde le plus petit _id (le premier inséré)
+        duplicates = db[collection].aggregate([
+            {"$match": {"content_key": {"$type": "string"}}},
+            {"$group": {"_id": "$content_key", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+        ], allowDiskUse=True)
+        removed = 0
+        for chunk in _chunks(duplicates, batch_size):
+            extra_ids = [_id for group in chunk for _id in sorted(group['ids'])[1:]]
+            if not dry_run:
+                removed += db[collection].bulk_write([DeleteMany({"_id": {"$in": extra_ids}})]).deleted_count
+            else:
+                removed += len(extra_ids)
+
+        if not dry_run:
+            db[collection].create_index(
+                "content_key", unique=True,
+                partialFilterExpression={"content_key": {"$type": "string"}}
+            )
+        results[collection] = (keyed, removed)
+    return results
+
+
+def crawl_workers(db, plan=None):
+    """
+    Avancement des plans distribués (combinaisons par statut) et workers associés, triés
+    par débit. Retourne [(plan, {statut: nombre}, [workers])].
+    """
+    match = {"_id": plan} if plan else {}
+    results = []
+    for plan_doc in db.crawl_plans.find(match).sort("created_at", -1):
+        progress = {
+            group['_id']: group['count'] for group in db.crawl_leases.aggregate([
+                {"$match": {"plan": plan_doc['_id']}},
+                {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+            ])
+        }
+        workers = list(db.crawl_workers.find({"plan": plan_doc['_id']}).sort("items_per_minute", -1))
+        results.append((plan_doc, progress, workers))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintenance de la base MongoDB du scraper')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    backfill = subparsers.add_parser('backfill-freelancer-refs',
+                                     help='Résoudre les freelancer_id des reviews et services en ObjectId')
+    backfill.add_argument('--batch-size', type=int, default=500, help='Valeurs résolues par requête')
+    backfill.add_argument('--dry-run', action='store_true', help="Compter sans écrire")
+
+    content_keys = subparsers.add_parser('backfill-content-keys',
+                                         help='Dédupliquer les reviews et services existants par content_key')
+    content_keys.add_argument('--batch-size', type=int, default=1000, help='Documents par bulk_write')
+    content_keys.add_argument('--dry-run', action='store_true', help="Compter sans écrire")
+
+    workers = subparsers.add_parser('workers', help='Débit des workers des plans distribués')
+    workers.add_argument('--plan', help='Identifiant du plan (<spider>-<signature>), tous par défaut')
+
+    args = parser.parse_args()
+    settings = get_project_settings()
+    client = MongoClient(settings.get('MONGO_URI'))
+    db = client[settings.get('MONGO_DATABASE')]
+
+    try:
+        if args.command == 'backfill-freelancer-refs':
+            results = backfill_freelancer_refs(db, args.batch_size, args.dry_run)
+            for collection, (updated, unresolved) in results.items():
+                label = "valeurs résolubles" if args.dry_run else "documents mis à jour"
+                print(f"{collection}: {updated} {label}, {unresolved} freelancers introuvables")
+        elif args.command == 'backfill-content-keys':
+            results = backfill_content_keys(db, args.batch_size, args.dry_run)
+            for collection, (keyed, removed) in results.items():
+                print(f"{collection}: {keyed} content_key calculés, {removed} doublons supprimés"
+                      + (" (simulation)" if args.dry_run else ""))
+        elif args.command == 'workers':
+            for plan_doc, progress, plan_workers in crawl_workers(db, args.plan):
+                counts = ", ".join(f"{status}: {count}" for status, count in sorted(progress.items()))
+                print(f"{plan_doc['_id']} ({plan_doc['combinations']} combinaisons) - {counts}")
+                for worker in plan_workers:
+                    print(f"  {worker['_id']} [{worker.get('status')}] "
+                          f"{worker.get('items', 0)} items ({worker.get('items_per_minute', 0)}/min), "
+                          f"{worker.get('pages', 0)} pages ({worker.get('pages_per_minute', 0)}/min), "
+                          f"{worker.get('combinations_done', 0)} combinaisons, "
+                          f"dernier heartbeat {worker.get('heartbeat_at')}")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,47 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import calendar
+import json
+import os
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
 from scrapy import signals
+from scrapy.http import Request
+from scrapy_playwright.page import PageMethod
+from twisted.internet import threads
+
+from develly_scraper.mongo import get_client, release_client
+from develly_scraper.seen import SeenSet
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
 
+# Attente d'un sélecteur côté navigateur, bornée par un timeout.
+# Le script se résout toujours (prêt ou non) pour ne jamais faire échouer le téléchargement
+# sur une page vide, et retourne le temps écoulé depuis le début de la navigation.
+READY_SCRIPT = """
+([selector, timeout]) => new Promise((resolve) => {
+    const started = performance.now();
+    const check = () => {
+        const now = performance.now();
+        if (document.querySelector(selector)) {
+            resolve({ready: true, ready_ms: now, waited_ms: now - started});
+        } else if (now - started >= timeout) {
+            resolve({ready: false, ready_ms: now, waited_ms: now - started});
+        } else {
+            setTimeout(check, 100);
+        }
+    };
+    check();
+})
+"""
+
+
 class DevellyScraperSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
     # scrapy acts as if the spider middleware does not modify the
@@ -101,3 +136,481 @@ class DevellyScraperDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class PageReadinessMiddleware:
+    """
+    Remplace les attentes fixes (wait_for_timeout) des requêtes Playwright par une attente
+    sur un sélecteur propre au type de page (meta `page_type`: listing, profile...).
+
+    Le temps de disponibilité de chaque page est mesuré et le timeout appliqué s'adapte
+    au p95 observé sur les PLAYWRIGHT_READY_WINDOW dernières pages, borné par
+    PLAYWRIGHT_READY_MIN_TIMEOUT et PLAYWRIGHT_READY_TIMEOUT. Les pages non prêtes à temps
+    n'entrent pas dans le p95 (leur attente est plafonnée par le timeout: le p95 ne pourrait
+    que monter vers la borne haute); elles sont comptées à part, et au-delà de
+    PLAYWRIGHT_READY_MAX_TIMEOUT_RATE de la fenêtre, la borne haute est appliquée. La fenêtre
+    glissante fait redescendre le timeout après une période lente.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.stats = crawler.stats
+        self.selectors = settings.getdict('PLAYWRIGHT_READY_SELECTORS')
+        self.max_timeout = settings.getint('PLAYWRIGHT_READY_TIMEOUT', 10000)
+        self.min_timeout = settings.getint('PLAYWRIGHT_READY_MIN_TIMEOUT', 1000)
+        self.adaptive = settings.getbool('PLAYWRIGHT_READY_ADAPTIVE', True)
+        self.p95_factor = settings.getfloat('PLAYWRIGHT_READY_P95_FACTOR', 1.5)
+        self.min_samples = settings.getint('PLAYWRIGHT_READY_MIN_SAMPLES', 20)
+        self.max_timeout_rate = settings.getfloat('PLAYWRIGHT_READY_MAX_TIMEOUT_RATE', 0.05)
+        window = settings.getint('PLAYWRIGHT_READY_WINDOW', 200)
+        # Dernières pages par type de page: attente (ms) si prête à temps, None sinon
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_request(self, request, spider):
+        # Les méthodes de page explicites de la requête restent prioritaires
+        if not request.meta.get('playwright') or request.meta.get('playwright_page_methods'):
+            return None
+
+        page_type = request.meta.get('page_type')
+        selector = self.selectors.get(spider.name, {}).get(page_type)
+        if not selector:
+            return None
+
+        timeout = self.timeout_for(page_type)
+        request.meta['playwright_page_methods'] = [PageMethod('evaluate', READY_SCRIPT, [selector, timeout])]
+        request.meta['ready_timeout'] = timeout
+        return None
+
+    def process_response(self, request, response, spider):
+        page_type = request.meta.get('page_type')
+        for page_method in request.meta.get('playwright_page_methods') or []:
+            if not isinstance(page_method, PageMethod) or page_method.args[:1] != (READY_SCRIPT,):
+                continue
+            result = getattr(page_method, 'result', None)
+            if isinstance(result, dict):
+                self._record(page_type, result)
+        return response
+
+    def timeout_for(self, page_type):
+        """Timeout courant pour un type de page: p95 observé × facteur, borné par les settings."""
+        window = self.samples[page_type]
+        ready = sorted(waited for waited in window if waited is not None)
+        if not self.adaptive or len(ready) < self.min_samples:
+            return self.max_timeout
+        if (len(window) - len(ready)) / len(window) > self.max_timeout_rate:
+            # Trop de pages non prêtes à temps: le timeout courant est trop court
+            return self.max_timeout
+        p95 = ready[min(len(ready) - 1, int(len(ready) * 0.95))]
+        return int(min(self.max_timeout, max(self.min_timeout, p95 * self.p95_factor)))
+
+    def _record(self, page_type, result):
+        prefix = f'readiness/{page_type}'
+        if result.get('ready'):
+            self.samples[page_type].append(result.get('waited_ms', 0))
+            self.stats.inc_value(f'{prefix}/ready')
+            self.stats.max_value(f'{prefix}/max_ready_ms', int(result.get('ready_ms', 0)))
+        else:
+            self.samples[page_type].append(None)
+            self.stats.inc_value(f'{prefix}/not_ready')
+        self.stats.set_value(f'{prefix}/timeout_ms', self.timeout_for(page_type))
+
+
+class ResourceBlockingMiddleware:
+    """
+    Interception des sous-requêtes Playwright: les ressources inutiles au parsing
+    (images, polices, médias, trackers tiers) sont annulées dans le navigateur.
+
+    Règles par spider dans PLAYWRIGHT_BLOCKED_RESOURCES (clé "default" pour tous les spiders),
+    par type de ressource et/ou par domaine. La meta `block_resources: False` désactive le
+    blocage pour une requête. Les requêtes annulées et les octets économisés (estimés par type)
+    sont reportés dans les stats.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.stats = crawler.stats
+        self.rules = settings.getdict('PLAYWRIGHT_BLOCKED_RESOURCES')
+        self.bytes_estimate = settings.getdict('PLAYWRIGHT_BLOCKED_BYTES_ESTIMATE')
+        self.spider_rules = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        return s
+
+    def spider_opened(self, spider):
+        # Les règles du spider complètent/remplacent les règles par défaut
+        rules = {**self.rules.get('default', {}), **self.rules.get(spider.name, {})}
+        self.spider_rules = {
+            'resource_types': set(rules.get('resource_types', [])),
+            'domains': tuple(domain.lower() for domain in rules.get('domains', [])),
+        }
+
+    def process_request(self, request, spider):
+        if not request.meta.get('playwright') or request.meta.get('block_resources') is False:
+            return None
+        if self.spider_rules.get('resource_types') or self.spider_rules.get('domains'):
+            request.meta.setdefault('playwright_page_init_callback', self.init_page)
+        return None
+
+    async def init_page(self, page, request):
+        # Playwright essaie d'abord la route enregistrée en dernier. scrapy-playwright pose sa route
+        # interne après ce callback: elle passe avant celle-ci et lui cède la main par
+        # route.fallback(). Il en va de même pour toute route ajoutée ensuite (page_methods,
+        # spider): elle doit appeler route.fallback() pour que le blocage s'applique.
+        await page.route('**/*', self._route)
+
+    async def _route(self, route, pw_request):
+        resource_type = pw_request.resource_type
+        if self._is_blocked(resource_type, pw_request.url):
+            self.stats.inc_value('resource_blocking/requests_saved')
+            self.stats.inc_value(f'resource_blocking/requests_saved/{resource_type}')
+            self.stats.inc_value('resource_blocking/bytes_saved_estimate', self.bytes_estimate.get(resource_type, 0))
+            await route.abort()
+        else:
+            await route.fallback()
+
+    def _is_blocked(self, resource_type, url):
+        if resource_type in self.spider_rules['resource_types']:
+            return True
+        domains = self.spider_rules['domains']
+        if domains:
+            host = (urlparse(url).hostname or '').lower()
+            return any(host == domain or host.endswith('.' + domain) for domain in domains)
+        return False
+
+
+class IncrementalRecrawlMiddleware:
+    """
+    Recrawl incrémental: les requêtes de profil (meta `page_type: profile`) dont l'URL a été
+    collectée il y a moins de INCREMENTAL_MAX_AGE secondes sont abandonnées (mode `skip`) ou
+    reléguées derrière les autres requêtes (mode `deprioritize`).
+
+    L'index de fraîcheur (url -> date de dernière collecte) est préchargé à l'ouverture du
+    spider, depuis MongoDB (last_seen_at des freelancers) ou depuis un fichier JSON local
+    (INCREMENTAL_SOURCE), mis à jour à la fermeture. Avec INCREMENTAL_SOURCE = "seen", c'est
+    un SeenSet (filtre de Bloom persistant, voir seen.py) par spider qui est interrogé: rien
+    n'est préchargé et l'empreinte mémoire reste de l'ordre de quelques octets par URL. Pour un profil abandonné, les champs de
+    la carte de listing (meta `listing_fields`: note, nombre d'avis, taux horaire...) sont
+    émis comme item partiel (`_partial`), écrit sans toucher au reste du document.
+
+    Activé par INCREMENTAL_RECRAWL_ENABLED ou par spider: -a incremental=1. La meta
+    `incremental_force: True` force la collecte d'un profil.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.stats = crawler.stats
+        self.enabled = settings.getbool('INCREMENTAL_RECRAWL_ENABLED', False)
+        self.max_age = settings.getint('INCREMENTAL_MAX_AGE', 7 * 24 * 3600)
+        self.mode = settings.get('INCREMENTAL_MODE', 'skip')
+        self.priority_offset = settings.getint('INCREMENTAL_PRIORITY_OFFSET', -100)
+        # 'mongo' ou chemin d'un fichier JSON {url: timestamp}
+        self.source = settings.get('INCREMENTAL_SOURCE', 'mongo')
+        self.mongo_uri = settings.get('MONGO_URI', 'mongodb://localhost:27017')
+        self.mongo_db = settings.get('MONGO_DATABASE', 'develly_scraper')
+        # url -> timestamp de la dernière collecte complète
+        self.fresh = {}
+        self.seen = None
+        # Profils collectés pendant ce crawl (pour le fichier local)
+        self.scraped = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def spider_opened(self, spider):
+        option = getattr(spider, 'incremental', None)
+        if option is not None:
+            self.enabled = str(option).lower() in ('1', 'true', 'yes')
+        if not self.enabled:
+            return None
+        if self.source == 'seen':
+            self.seen = SeenSet.from_settings(spider.settings, spider.name, max_age=self.max_age)
+            self._report_seen_stats()
+            spider.logger.info(f"Recrawl incrémental ({self.mode}): filtre {spider.name}, "
+                               f"{self.seen.stats()['entries']} URLs connues")
+            return None
+        # Le moteur attend ce Deferred avant de planifier les premières requêtes
+        d = threads.deferToThread(self._load)
+        d.addCallback(self._loaded, spider)
+        d.addErrback(lambda failure: spider.logger.error(
+            f"Index de fraîcheur non chargé, recrawl complet: {failure.value!r}"))
+        return d
+
+    def _load(self):
+        if self.source != 'mongo':
+            if not os.path.exists(self.source):
+                return {}
+            with open(self.source, 'r', encoding='utf-8') as f:
+                return json.load(f)
+
+        cutoff = datetime.utcnow() - timedelta(seconds=self.max_age)
+        client = get_client(self.mongo_uri)
+        try:
+            cursor = client[self.mongo_db]['freelancers'].find(
+                {"last_seen_at": {"$gte": cutoff}}, {"url": 1, "last_seen_at": 1, "_id": 0})
+            return {doc['url']: calendar.timegm(doc['last_seen_at'].utctimetuple())
+                    for doc in cursor if doc.get('url')}
+        finally:
+            release_client(self.mongo_uri)
+
+    def _loaded(self, fresh, spider):
+        self.fresh = fresh
+        self.stats.set_value('incremental/index_size', len(fresh))
+        spider.logger.info(f"Recrawl incrémental ({self.mode}): {len(fresh)} profils connus, "
+                           f"âge max {self.max_age}s")
+
+    def spider_closed(self, spider):
+        if self.seen is not None:
+            self._report_seen_stats()
+            self.seen.close()
+            return None
+        if not self.enabled or self.source == 'mongo' or not self.scraped:
+            return None
+        return threads.deferToThread(self._save)
+
+    def _report_seen_stats(self):
+        stats = self.seen.stats()
+        self.stats.set_value('incremental/seen/entries', stats['entries'])
+        self.stats.set_value('incremental/seen/memory_bytes', stats['memory_bytes'])
+        self.stats.set_value('incremental/seen/false_positive_rate', round(stats['false_positive_rate'], 6))
+
+    def _save(self):
+        # Écriture atomique du fichier local fusionné avec les profils de ce crawl
+        index = {**self.fresh, **self.scraped}
+        directory = os.path.dirname(self.source)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.source}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.source)
+
+    def is_fresh(self, url):
+        if self.seen is not None:
+            return url in self.seen
+        scraped_at = self.fresh.get(url)
+        return scraped_at is not None and time.time() - scraped_at < self.max_age
+
+    def process_spider_input(self, response, spider):
+        if self.enabled and response.meta.get('page_type') == 'profile' and response.status == 200:
+            url = (response.meta.get('listing_fields') or {}).get('url', response.url)
+            if self.seen is not None:
+                self.seen.add(url)
+            else:
+                self.scraped[url] = time.time()
+        return None
+
+    def process_spider_output(self, response, result, spider):
+        for entry in result:
+            if (self.enabled and isinstance(entry, Request) and entry.meta.get('page_type') == 'profile'
+                    and not entry.meta.get('incremental_force')):
+                listing_fields = entry.meta.get('listing_fields') or {}
+                if self.is_fresh(listing_fields.get('url', entry.url)):
+                    if self.mode == 'deprioritize':
+                        self.stats.inc_value('incremental/deprioritized')
+                        yield entry.replace(priority=entry.priority + self.priority_offset)
+                    else:
+                        self.stats.inc_value('incremental/skipped')
+                        if listing_fields:
+                            self.stats.inc_value('incremental/partial_items')
+                            partial = {'_type': 'freelancer', '_partial': True, **listing_fields}
+                            if entry.meta.get('category_tag'):
+                                partial['category_tags'] = [entry.meta['category_tag']]
+                            yield partial
+                    continue
+                self.stats.inc_value('incremental/fetched')
+            yield entry
+
+
+def listing_fast_mode(spider):
+    """Mode listing seul actif pour ce spider (-a fast=1, sinon LISTING_FAST_MODE)."""
+    option = getattr(spider, 'fast', None)
+    if option is not None:
+        return str(option).lower() in ('1', 'true', 'yes')
+    return spider.settings.getbool('LISTING_FAST_MODE', False)
+
+
+class ProfileDedupMiddleware:
+    """
+    Registre des profils du crawl en cours, par URL: un freelancer présent dans plusieurs
+    catégories/pays n'est collecté qu'une fois.
+
+    Chaque requête de profil porte son contexte de listing (meta `category_tag`:
+    {"category", "location"}). La première occurrence d'une URL est téléchargée; les suivantes
+    sont abandonnées et leur tag est ajouté à l'item du profil (`category_tags`), ou émis
+    seul (`_tags`) si l'item est déjà passé. Le pipeline fusionne les tags par $addToSet.
+    Si le profil ne donne pas d'item (téléchargement en échec, page sans freelancer), les
+    tags accumulés sont émis seuls. En mode listing seul, la carte porte déjà le premier tag:
+    les suivants sont émis seuls tout de suite, que le profil soit enrichi ou non.
+
+    Placé après IncrementalRecrawlMiddleware (ordre plus petit): les profils déjà abandonnés
+    comme frais n'entrent pas dans le registre.
+    """
+
+    def __init__(self, crawler):
+        self.stats = crawler.stats
+        self.fast_mode = False
+        # url -> {'tags': [...], 'emitted': bool}
+        self.registry = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        return s
+
+    def spider_opened(self, spider):
+        self.fast_mode = listing_fast_mode(spider)
+
+    @staticmethod
+    def _profile_url(meta, url):
+        return (meta.get('listing_fields') or {}).get('url', url)
+
+    def process_spider_output(self, response, result, spider):
+        for entry in result:
+            if isinstance(entry, Request) and entry.meta.get('page_type') == 'profile':
+                entry = self._register(entry)
+            elif is_item(entry):
+                entry = self._tag_item(entry)
+            if entry is not None:
+                yield entry
+        if response.meta.get('page_type') == 'profile':
+            # Profil téléchargé sans item (page vide, erreur de parsing)
+            item = self._release(self._profile_url(response.meta, response.url))
+            if item is not None:
+                yield item
+
+    def _register(self, request):
+        """La requête si c'est la première occurrence du profil, sinon None ou un item de tag."""
+        url = self._profile_url(request.meta, request.url)
+        tag = request.meta.get('category_tag')
+        profile = self.registry.get(url)
+        if profile is None:
+            # En mode listing seul, la carte émise avec la requête vaut item du profil
+            self.registry[url] = {'tags': [tag] if tag else [], 'emitted': self.fast_mode}
+            self.stats.inc_value('profile_dedup/fetched')
+            original_errback = request.errback
+            request = request.replace(errback=self._profile_failed)
+            request.meta['dedup_errback'] = original_errback
+            return request
+
+        self.stats.inc_value('profile_dedup/merged')
+        if tag and tag not in profile['tags']:
+            profile['tags'].append(tag)
+            if profile['emitted']:
+                # L'item du profil est déjà parti: tag seul, fusionné par le pipeline
+                self.stats.inc_value('profile_dedup/tag_items')
+                return {'_type': 'freelancer', '_tags': True, 'url': url, 'category_tags': [tag]}
+        return None
+
+    def _profile_failed(self, failure):
+        """Errback des profils: les tags accumulés ne doivent pas se perdre avec la requête."""
+        request = failure.request
+        original_errback = request.meta.get('dedup_errback')
+        if original_errback is not None:
+            yield from original_errback(failure) or ()
+        item = self._release(self._profile_url(request.meta, request.url))
+        if item is not None:
+            yield item
+
+    def _release(self, url):
+        """Item `_tags` des tags d'un profil qui n'a pas émis son item (None s'il n'y en a pas)."""
+        profile = self.registry.get(url)
+        if profile is None or profile['emitted']:
+            return None
+        profile['emitted'] = True
+        if not profile['tags']:
+            return None
+        self.stats.inc_value('profile_dedup/released_tags')
+        return {'_type': 'freelancer', '_tags': True, 'url': url, 'category_tags': list(profile['tags'])}
+
+    def _tag_item(self, item):
+        # L'item du profil (même URL) reçoit tous les tags accumulés jusque-là
+        adapter = ItemAdapter(item)
+        profile = self.registry.get(adapter.get('url'))
+        if profile is not None and not profile['emitted'] and not adapter.get('_partial'):
+            adapter['category_tags'] = list(profile['tags'])
+            profile['emitted'] = True
+        return item
+
+
+class ListingFastModeMiddleware:
+    """
+    Mode listing seul: chaque carte de listing est écrite tout de suite comme freelancer, et
+    le profil complet est collecté plus tard, en enrichissement.
+
+    Pour chaque requête de profil (meta `page_type: profile`), un item carte (`_partial` +
+    `_card`) est émis à partir des meta `listing_fields` et `listing_card`: le pipeline crée
+    le document s'il n'existe pas et ne met à jour que les champs de la carte sinon. La requête
+    passe ensuite dans la voie d'enrichissement: priorité abaissée de PROFILE_ENRICHMENT_PRIORITY
+    (derrière toutes les pages de listing), slot de téléchargement `<domaine>|enrichment` aux
+    bornes propres (voie "enrichment" de AIMD_LIMITS), au plus PROFILE_ENRICHMENT_BUDGET
+    profils par crawl; au-delà, la carte seule est gardée.
+
+    Placé après ProfileDedupMiddleware (ordre plus petit): une carte par profil du crawl.
+    Activé par LISTING_FAST_MODE ou par spider: -a fast=1 (-a enrichment_budget=N).
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.stats = crawler.stats
+        self.enabled = settings.getbool('LISTING_FAST_MODE', False)
+        self.priority_offset = settings.getint('PROFILE_ENRICHMENT_PRIORITY', -1000)
+        budget = settings.get('PROFILE_ENRICHMENT_BUDGET')
+        # None: pas de limite; 0: cartes seulement
+        self.budget = int(budget) if budget is not None else None
+        self.scheduled = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        return s
+
+    def spider_opened(self, spider):
+        self.enabled = listing_fast_mode(spider)
+        budget = getattr(spider, 'enrichment_budget', None)
+        if budget is not None:
+            self.budget = int(budget)
+        if self.enabled:
+            spider.logger.info(f"Mode listing seul: profils enrichis en basse priorité, "
+                               f"budget {self.budget if self.budget is not None else 'illimité'}")
+
+    def process_spider_output(self, response, result, spider):
+        for entry in result:
+            if (self.enabled and isinstance(entry, Request) and entry.meta.get('page_type') == 'profile'
+                    and not entry.meta.get('enrichment')):
+                card = self._card_item(entry)
+                if card is not None:
+                    self.stats.inc_value('enrichment/cards')
+                    yield card
+                if self.budget is not None and self.scheduled >= self.budget:
+                    self.stats.inc_value('enrichment/over_budget')
+                    continue
+                self.scheduled += 1
+                self.stats.inc_value('enrichment/scheduled')
+                entry = entry.replace(priority=entry.priority + self.priority_offset)
+                entry.meta['enrichment'] = True
+                entry.meta.setdefault('download_slot', f"{urlparse(entry.url).hostname}|enrichment")
+            yield entry
+
+    @staticmethod
+    def _card_item(request):
+        listing_fields = request.meta.get('listing_fields') or {}
+        if not listing_fields.get('url'):
+            return None
+        item = {'_type': 'freelancer', '_partial': True, '_card': request.meta.get('listing_card') or {},
+                **listing_fields}
+        if request.meta.get('category_tag'):
+            item['category_tags'] = [request.meta['category_tag']]
+        return item
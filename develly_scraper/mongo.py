@@ -0,0 +1,92 @@
+"""
+Accès MongoDB non bloquant pour le reactor.
+
+- get_client / release_client: un MongoClient (et donc un pool de connexions) par URI,
+  partagé par tous les crawlers du processus (run_parallel_spiders.py).
+- MongoWriter: thread d'écriture dédié alimenté par une file bornée. Chaque tâche soumise
+  retourne un Deferred déclenché dans le reactor quand elle est terminée.
+"""
+
+import logging
+import queue
+import threading
+
+from pymongo import MongoClient
+from twisted.internet import defer, reactor, threads
+from twisted.python.failure import Failure
+
+logger = logging.getLogger(__name__)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(mongo_uri):
+    """Client partagé pour une URI (compteur de références)."""
+    with _clients_lock:
+        client, users = _clients.get(mongo_uri, (None, 0))
+        if client is None:
+            client = MongoClient(mongo_uri)
+        _clients[mongo_uri] = (client, users + 1)
+        return client
+
+
+def release_client(mongo_uri):
+    """Libère une référence; le dernier utilisateur ferme le client."""
+    with _clients_lock:
+        client, users = _clients.get(mongo_uri, (None, 0))
+        if client is None:
+            return
+        if users <= 1:
+            del _clients[mongo_uri]
+            client.close()
+        else:
+            _clients[mongo_uri] = (client, users - 1)
+
+
+class MongoWriter:
+    """
+    Thread d'écriture dédié avec une file bornée.
+
+    submit() lève queue.Full quand la file est pleine: c'est à l'appelant d'appliquer
+    la contre-pression (voir MongoDBPipeline).
+    """
+
+    def __init__(self, max_queue=10, name='mongo-writer'):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    @property
+    def full(self):
+        return self.queue.full()
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def submit(self, func, *args, **kwargs):
+        """Planifie func(*args, **kwargs) sur le thread d'écriture; retourne un Deferred."""
+        d = defer.Deferred()
+        self.queue.put_nowait((func, args, kwargs, d))
+        return d
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            func, args, kwargs, d = job
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                reactor.callFromThread(d.errback, Failure())
+            else:
+                reactor.callFromThread(d.callback, result)
+
+    def stop(self):
+        """Termine les tâches en file puis arrête le thread (Deferred)."""
+        return threads.deferToThread(self._stop)
+
+    def _stop(self):
+        self.queue.put(None)
+        self.thread.join()
@@ -6,11 +6,66 @@
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
-from datetime import datetime
-from pymongo import MongoClient
+from collections import OrderedDict, defaultdict, deque
+from datetime import datetime, timedelta
+import hashlib
+import json
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from twisted.internet import defer, reactor, task, threads
 import os
 from bson.objectid import ObjectId
 
+from develly_scraper.mongo import MongoWriter, get_client, release_client
+
+
+def collection_for(adapter):
+    """Déterminer la collection en fonction du type d'item"""
+    if '_type' in adapter:
+        # Si le champ _type est spécifié, l'utiliser directement
+        return adapter['_type'] + 's'  # Ajouter un 's' pour le pluriel (ex: 'freelancer' -> 'freelancers')
+    elif 'reviews_count' in adapter:  # C'est un freelancer
+        return 'freelancers'
+    elif 'freelancer_id' in adapter and 'author' in adapter:  # C'est une review
+        return 'reviews'
+    elif 'freelancer_id' in adapter and 'price' in adapter:  # C'est un service
+        return 'services'
+    return 'items'
+
+
+# Champs qui identifient une review ou un service d'un crawl à l'autre (ils n'ont pas d'url propre)
+CONTENT_KEY_FIELDS = {
+    # review_date n'est renseignée que pour les dates absolues (pas les "3 months ago" de Freelancer)
+    'reviews': ('source', 'author', 'review_date', 'text'),
+    'services': ('source', 'title', 'url'),
+}
+
+
+def content_key(collection, document):
+    """Empreinte stable d'une review ou d'un service: source, freelancer et contenu."""
+    # L'URL du profil ne change pas quand la référence est résolue (voir FreelancerReferencePipeline)
+    freelancer = document.get('freelancer_url') or document.get('freelancer_ref') or document.get('freelancer_id')
+    values = [str(freelancer or '')]
+    for field in CONTENT_KEY_FIELDS[collection]:
+        value = document.get(field)
+        values.append(' '.join(value.split()) if isinstance(value, str) else value)
+    payload = json.dumps([collection] + values, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+# Champs jamais écrits par une mise à jour partielle (carte de listing d'un profil frais)
+PARTIAL_EXCLUDED = {'_type', '_partial', '_tags', '_card', '_id', 'url', 'created_at', 'updated_at', 'category_tags'}
+
+# Champs exclus de l'empreinte: identifiants, dates de collecte et contexte de recherche
+FINGERPRINT_EXCLUDED = {'_id', 'created_at', 'updated_at', 'last_seen_at', 'fingerprint', 'url_of_search'}
+
+
+def fingerprint(document):
+    """Empreinte des champs significatifs d'un document (détecte les écritures inutiles)."""
+    meaningful = {key: value for key, value in document.items() if key not in FINGERPRINT_EXCLUDED}
+    payload = json.dumps(meaningful, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
 
 class DevellyScraperPipeline:
     def process_item(self, item, spider):
@@ -44,99 +99,464 @@ class TextCleaningPipeline:
         return item
 
 
+class FreelancerReferencePipeline:
+    """
+    Pipeline qui résout le freelancer des reviews et services.
+
+    Les spiders renseignent `freelancer_id` avec l'URL du profil. Ce pipeline la remplace par
+    l'_id du freelancer (en chaîne, pour l'API) et ajoute `freelancer_ref` (ObjectId, indexé)
+    et `freelancer_url`. La correspondance URL -> _id est gardée en mémoire; une URL inconnue
+    est cherchée une fois via l'index unique sur `url`, hors du thread du reactor. Si le
+    freelancer n'existe pas encore, un _id lui est réservé: MongoDBPipeline l'utilise à
+    l'insertion du freelancer (les reviews arrivent avant leur freelancer). Les items de la
+    collection freelancers (profil, carte, tags seuls) sont résolus de la même façon: quel
+    que soit l'upsert qui crée le document, il porte l'_id des reviews et services.
+    """
+    
+    ref_collections = ('reviews', 'services')
+    
+    def __init__(self, mongo_uri, mongo_db, cache_size=100000):
+        self.mongo_uri = mongo_uri
+        self.mongo_db = mongo_db
+        self.cache_size = cache_size
+        # url -> ObjectId, dans l'ordre d'utilisation (LRU)
+        self.refs = OrderedDict()
+        # url -> Deferreds en attente d'une recherche déjà lancée
+        self.lookups = {}
+    
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            mongo_uri=crawler.settings.get('MONGO_URI', 'mongodb://localhost:27017'),
+            mongo_db=crawler.settings.get('MONGO_DATABASE', 'develly_scraper'),
+            cache_size=crawler.settings.getint('FREELANCER_REF_CACHE_SIZE', 100000),
+        )
+    
+    def open_spider(self, spider):
+        self.client = get_client(self.mongo_uri)
+        self.db = self.client[self.mongo_db]
+        threads.deferToThread(self._setup).addErrback(
+            lambda failure: spider.logger.error(f"Index freelancer_ref non créé: {failure.value!r}"))
+    
+    def close_spider(self, spider):
+        release_client(self.mongo_uri)
+    
+    def _setup(self):
+        for collection in self.ref_collections:
+            self.db[collection].create_index("freelancer_ref")
+    
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        collection = collection_for(adapter)
+        
+        if collection == 'freelancers':
+            # Toutes les écritures d'un profil (item complet, carte, tags seuls) prennent le même
+            # _id: celui déjà réservé par une review ou un service, sinon celui du document
+            # existant, sinon un _id réservé ici. Une recherche en cours pour l'URL est partagée.
+            url = adapter.get('url')
+            if not url:
+                return item
+            ref = self._cached(url)
+            if ref is not None:
+                adapter['_id'] = ref
+                return item
+            d = self._resolve(url, spider)
+            d.addCallback(lambda ref: self._set_id(adapter, ref, item))
+            return d
+        
+        if collection not in self.ref_collections:
+            return item
+        url = adapter.get('freelancer_id')
+        if not url or not isinstance(url, str) or ObjectId.is_valid(url):
+            return item
+        
+        ref = self._cached(url)
+        if ref is not None:
+            return self._set_reference(adapter, url, ref, item)
+        d = self._resolve(url, spider)
+        d.addCallback(lambda ref: self._set_reference(adapter, url, ref, item))
+        return d
+    
+    def _cached(self, url):
+        ref = self.refs.get(url)
+        if ref is not None:
+            self.refs.move_to_end(url)
+        return ref
+    
+    @staticmethod
+    def _set_id(adapter, ref, item):
+        if ref is not None:
+            adapter['_id'] = ref
+        return item
+    
+    def _set_reference(self, adapter, url, ref, item):
+        if ref is None:
+            # Recherche en échec: l'URL est conservée, le backfill la résoudra plus tard
+            return item
+        adapter['freelancer_ref'] = ref
+        adapter['freelancer_url'] = url
+        adapter['freelancer_id'] = str(ref)
+        return item
+    
+    def _resolve(self, url, spider):
+        """Deferred de l'_id du freelancer; une seule recherche par URL à la fois."""
+        waiter = defer.Deferred()
+        if url in self.lookups:
+            self.lookups[url].append(waiter)
+            return waiter
+        self.lookups[url] = [waiter]
+        d = threads.deferToThread(self._lookup, url)
+        d.addErrback(self._lookup_failed, url, spider)
+        d.addCallback(self._resolved, url)
+        return waiter
+    
+    def _lookup(self, url):
+        freelancer = self.db['freelancers'].find_one({"url": url}, {"_id": 1})
+        return freelancer['_id'] if freelancer else ObjectId()
+    
+    def _lookup_failed(self, failure, url, spider):
+        spider.logger.warning(f"Résolution du freelancer {url} impossible: {failure.value!r}")
+        return None
+    
+    def _resolved(self, ref, url):
+        if ref is not None:
+            self.refs[url] = ref
+            if len(self.refs) > self.cache_size:
+                self.refs.popitem(last=False)
+        for waiter in self.lookups.pop(url, []):
+            waiter.callback(ref)
+
+
 class MongoDBPipeline:
-    """Pipeline pour enregistrer les items dans MongoDB."""
+    """
+    Pipeline pour enregistrer les items dans MongoDB.
+
+    Les items sont mis en tampon par collection puis écrits par lots avec un bulk_write
+    non ordonné: upserts par url, par content_key pour les reviews et services (relancer un
+    crawl ne les duplique pas), insertions sinon. Un lot est envoyé quand il atteint
+    MONGO_BATCH_SIZE items, toutes les MONGO_BATCH_INTERVAL secondes, et à la fermeture du spider.
+
+    Chaque document porte une empreinte de ses champs significatifs: avant d'écrire un lot,
+    les empreintes stockées sont lues en une requête et les documents inchangés ne sont pas
+    réécrits (seul last_seen_at est rafraîchi, au plus une fois par MONGO_LAST_SEEN_RESOLUTION).
+
+    Aucun appel pymongo n'est fait dans le thread du reactor: les lots passent par un thread
+    d'écriture dédié (MongoWriter) et un client partagé par tous les crawlers du processus.
+    Quand la file du thread est pleine, le moteur est mis en pause jusqu'à ce qu'elle se vide.
+    """
     
     collection_name = 'freelancers'
     
-    def __init__(self, mongo_uri, mongo_db):
+    def __init__(self, mongo_uri, mongo_db, batch_size=100, batch_interval=5.0,
+                 writer_queue_size=10, last_seen_resolution=3600, crawler=None):
         self.mongo_uri = mongo_uri
         self.mongo_db = mongo_db
+        self.batch_size = max(1, batch_size)
+        self.batch_interval = batch_interval
+        self.writer_queue_size = max(1, writer_queue_size)
+        self.last_seen_resolution = timedelta(seconds=last_seen_resolution)
+        self.crawler = crawler
+        self.stats = crawler.stats if crawler else None
+        # Documents (ou opérations: sources, mises à jour partielles) en attente par collection, par clé d'upsert
+        self.buffers = defaultdict(dict)
+        # Lots prêts mais refusés par une file d'écriture pleine
+        self.backlog = deque()
+        self.paused = False
+        self.sources_cache = {}
     
     @classmethod
     def from_crawler(cls, crawler):
         return cls(
             mongo_uri=crawler.settings.get('MONGO_URI', 'mongodb://localhost:27017'),
-            mongo_db=crawler.settings.get('MONGO_DATABASE', 'develly_scraper')
+            mongo_db=crawler.settings.get('MONGO_DATABASE', 'develly_scraper'),
+            batch_size=crawler.settings.getint('MONGO_BATCH_SIZE', 100),
+            batch_interval=crawler.settings.getfloat('MONGO_BATCH_INTERVAL', 5.0),
+            writer_queue_size=crawler.settings.getint('MONGO_WRITER_QUEUE_SIZE', 10),
+            last_seen_resolution=crawler.settings.getint('MONGO_LAST_SEEN_RESOLUTION', 3600),
+            crawler=crawler
         )
     
     def open_spider(self, spider):
-        self.client = MongoClient(self.mongo_uri)
+        self.client = get_client(self.mongo_uri)
         self.db = self.client[self.mongo_db]
-        # Créer l'index unique pour éviter les doublons
-        self.db[self.collection_name].create_index("url", unique=True)
+        self.writer = MongoWriter(max_queue=self.writer_queue_size, name=f'mongo-writer-{spider.name}')
+        # Vidage périodique des tampons
+        self.flush_loop = task.LoopingCall(self.flush_all, spider)
+        if self.batch_interval > 0:
+            self.flush_loop.start(self.batch_interval, now=False)
+        # Index et cache des sources préparés sur le thread d'écriture. Le moteur attend ce
+        # Deferred: aucun item n'est traité avant que le cache des sources soit chargé (sinon
+        # _source_id réserverait un _id pour une source existante)
+        d = self.writer.submit(self._setup)
+        d.addErrback(lambda failure: spider.logger.error(f"Initialisation MongoDB en échec: {failure.value!r}"))
+        return d
     
+    @defer.inlineCallbacks
     def close_spider(self, spider):
-        self.client.close()
+        if self.flush_loop.running:
+            self.flush_loop.stop()
+        self.flush_all(spider)
+        # Vider le reliquat refusé par la file (le thread consomme pendant ce temps)
+        while self.backlog:
+            self._drain_backlog(spider)
+            if self.backlog:
+                yield task.deferLater(reactor, 0.1, lambda: None)
+        yield self.writer.stop()
+        release_client(self.mongo_uri)
+    
+    def _setup(self):
+        for source in self.db['sources'].find({}, {"name": 1}):
+            self.sources_cache[source['name']] = str(source['_id'])
+        # Créer l'index unique pour éviter les doublons
+        self.db[self.collection_name].create_index("url", unique=True)
+        # Index partiel: les documents antérieurs sans content_key n'y figurent pas
+        # (voir `python -m develly_scraper.maintenance backfill-content-keys`)
+        for collection in CONTENT_KEY_FIELDS:
+            self.db[collection].create_index(
+                "content_key", unique=True,
+                partialFilterExpression={"content_key": {"$type": "string"}}
+            )
     
     def process_item(self, item, spider):
         adapter = ItemAdapter(item)
-        # Déterminer la collection en fonction du type d'item
-        if '_type' in adapter:
-            # Si le champ _type est spécifié, l'utiliser directement
-            collection = adapter['_type'] + 's'  # Ajouter un 's' pour le pluriel (ex: 'freelancer' -> 'freelancers')
-        elif 'reviews_count' in adapter:  # C'est un freelancer
-            collection = 'freelancers'
-        elif 'freelancer_id' in adapter and 'author' in adapter:  # C'est une review
-            collection = 'reviews'
-        elif 'freelancer_id' in adapter and 'price' in adapter:  # C'est un service
-            collection = 'services'
-        else:
-            collection = 'items'
+        collection = collection_for(adapter)
         
         # Ajouter un log pour déboguer la collection utilisée
         spider.logger.debug(f"Collection déterminée pour l'item: {collection}")
         
-        # Conversion en dictionnaire pour MongoDB
-        item_dict = dict(adapter)
+        if adapter.get('_partial') or adapter.get('_tags'):
+            buffer = self.buffers[collection]
+            if adapter.get('_partial'):
+                # Profil encore frais (IncrementalRecrawlMiddleware) ou mode listing seul: seuls les
+                # champs de la carte sont mis à jour; last_seen_at reste celui de la dernière collecte complète
+                fields = {key: value for key, value in adapter.items()
+                          if key not in PARTIAL_EXCLUDED and value is not None}
+                fields['listing_seen_at'] = datetime.utcnow()
+                if adapter.get('_card') is not None:
+                    # Mode listing seul (ListingFastModeMiddleware): la carte crée le document s'il
+                    # n'existe pas; le profil complet le complètera (pas de last_seen_at d'ici là)
+                    buffer[('partial', adapter['url'])] = self._card_operation(collection, adapter, fields)
+                    self._inc_stat(f'mongodb/{collection}/cards')
+                    self._inc_stat(f'mongodb/{collection}/partial')
+                    if len(buffer) >= self.batch_size:
+                        self.flush(collection, spider)
+                    return item
+                buffer[('partial', adapter['url'])] = UpdateOne({"url": adapter['url']}, {"$set": fields})
+                self._inc_stat(f'mongodb/{collection}/partial')
+            # Catégories supplémentaires du profil (ProfileDedupMiddleware)
+            self._buffer_tags(collection, adapter['url'], adapter.get('category_tags') or [], adapter.get('_id'))
+            if len(buffer) >= self.batch_size:
+                self.flush(collection, spider)
+            return item
+        
+        item_dict = self._prepare(collection, dict(adapter))
+        
+        # Un seul upsert par clé et par lot: le dernier item reçu l'emporte
+        buffer = self.buffers[collection]
+        key_field = self._key_field(collection)
+        key = item_dict.get(key_field) or ObjectId()
+        buffer[key] = item_dict
         
+        if len(buffer) >= self.batch_size:
+            self.flush(collection, spider)
+        
+        return item
+    
+    def _prepare(self, collection, item_dict):
+        """Compléter le document avant écriture (source, réseaux sociaux)."""
         # Si c'est un freelancer, associer la source appropriée
-        if collection == 'freelancers' and 'source' in item_dict:
-            source_name = item_dict.get('source')
-            if source_name:
-                # Chercher la source par son nom
-                source = self.db['sources'].find_one({"name": source_name})
-                if source:
-                    # Associer l'ID de la source
-                    item_dict['source_id'] = str(source['_id'])
-                else:
-                    # Créer une nouvelle source si elle n'existe pas
-                    new_source_id = ObjectId()
-                    self.db['sources'].insert_one({
-                        "_id": new_source_id,
-                        "name": source_name,
-                        "url": item_dict.get('url_of_search', None),
-                        "description": f"Source créée automatiquement: {source_name}"
-                    })
-                    item_dict['source_id'] = str(new_source_id)
+        if collection == 'freelancers' and item_dict.get('source'):
+            item_dict['source_id'] = self._source_id(item_dict['source'], item_dict.get('url_of_search'))
         
         # Ajouter les champs de réseaux sociaux s'ils n'existent pas
         if collection == 'freelancers':
-            if 'linkedin_link' not in item_dict:
-                item_dict['linkedin_link'] = None
-            if 'facebook_link' not in item_dict:
-                item_dict['facebook_link'] = None
-            if 'twitter_link' not in item_dict:
-                item_dict['twitter_link'] = None
-            
-            # S'assurer que _id est un ObjectId (généré automatiquement)
-            if '_id' not in item_dict:
-                item_dict['_id'] = ObjectId()
+            for field in ('linkedin_link', 'facebook_link', 'twitter_link'):
+                item_dict.setdefault(field, None)
         
-        # Vérifier si l'item existe déjà
-        if 'url' in item_dict:
-            existing = self.db[collection].find_one({"url": item_dict["url"]})
-            if existing:
-                # Mettre à jour
-                self.db[collection].update_one({"_id": existing["_id"]}, {"$set": item_dict})
-                spider.logger.info(f"Item mis à jour dans MongoDB: {collection} - {item_dict.get('name', 'Anonyme')}")
+        if collection in CONTENT_KEY_FIELDS:
+            item_dict['content_key'] = content_key(collection, item_dict)
+        if item_dict.get('category_tags'):
+            # Ordre stable pour l'empreinte: les tags d'une même URL arrivent dans un ordre variable
+            tags = {json.dumps(tag, sort_keys=True): tag for tag in item_dict['category_tags']}
+            item_dict['category_tags'] = [tags[key] for key in sorted(tags)]
+        item_dict['fingerprint'] = fingerprint(item_dict)
+        return item_dict
+    
+    def _card_operation(self, collection, adapter, fields):
+        """
+        Upsert d'une carte de listing: champs de la carte en $set, reste de la carte à la création
+        seulement, tags dans la même opération (un upsert de tags séparé pourrait créer le document
+        avant la carte). L'_id réservé par FreelancerReferencePipeline est repris s'il existe.
+        """
+        card = self._prepare(collection, {'url': adapter['url'], **adapter['_card']})
+        card.pop('fingerprint', None)
+        on_insert = {key: value for key, value in card.items() if key not in fields and key != 'url'}
+        on_insert['_id'] = adapter.get('_id') or ObjectId()
+        on_insert.setdefault('created_at', datetime.utcnow().isoformat())
+        update = {"$set": fields, "$setOnInsert": on_insert}
+        if adapter.get('category_tags'):
+            update["$addToSet"] = {"category_tags": {"$each": list(adapter['category_tags'])}}
+        return UpdateOne({"url": adapter['url']}, update, upsert=True)
+
+    def _buffer_tags(self, collection, url, tags, ref=None):
+        """Ajoute des tags de catégorie à un profil: dans son document s'il est encore en tampon,
+        sinon par un $addToSet avec upsert sur l'url (le profil peut ne jamais être collecté:
+        téléchargement en échec, budget d'enrichissement épuisé). `ref`: _id déjà réservé
+        pour ce profil (FreelancerReferencePipeline), utilisé si le document est créé ici."""
+        buffer = self.buffers[collection]
+        document = buffer.get(url)
+        if isinstance(document, dict):
+            merged = {json.dumps(tag, sort_keys=True): tag for tag in (document.get('category_tags') or []) + tags}
+            document['category_tags'] = [merged[key] for key in sorted(merged)]
+            document['fingerprint'] = fingerprint(document)
+            return
+        for tag in tags:
+            key = ('tags', url, json.dumps(tag, sort_keys=True))
+            update = {"$addToSet": {"category_tags": tag}}
+            if ref is not None:
+                update["$setOnInsert"] = {"_id": ref}
+            buffer[key] = UpdateOne({"url": url}, update, upsert=True)
+    
+    @staticmethod
+    def _key_field(collection):
+        return 'content_key' if collection in CONTENT_KEY_FIELDS else 'url'
+    
+    def _source_id(self, source_name, url=None):
+        """
+        ID de la source (cache préchargé à l'ouverture). Une source inconnue est créée
+        par un upsert sur son nom, écrit avec le prochain lot.
+        """
+        if source_name not in self.sources_cache:
+            source_id = ObjectId()
+            self.buffers['sources'][source_name] = UpdateOne(
+                {"name": source_name},
+                {"$setOnInsert": {
+                    "_id": source_id,
+                    "url": url,
+                    "description": f"Source créée automatiquement: {source_name}"
+                }},
+                upsert=True
+            )
+            self.sources_cache[source_name] = str(source_id)
+        return self.sources_cache[source_name]
+    
+    def _build_operation(self, item_dict, key_field='url'):
+        """Upsert sur la clé (url ou content_key) si l'item en a une, insertion simple sinon."""
+        if item_dict.get(key_field):
+            # L'_id n'est fixé qu'à la création: un $set sur _id serait refusé par MongoDB
+            on_insert = {"_id": item_dict.get('_id') or ObjectId()}
+            if key_field == 'content_key' and 'created_at' in item_dict:
+                # Une review revue au crawl suivant garde sa date de première collecte
+                on_insert['created_at'] = item_dict['created_at']
+            document = {key: value for key, value in item_dict.items() if key not in on_insert}
+            update = {"$set": document, "$setOnInsert": on_insert}
+            tags = document.pop('category_tags', None)
+            if tags:
+                # Les catégories s'accumulent d'un crawl à l'autre au lieu d'être remplacées
+                update["$addToSet"] = {"category_tags": {"$each": tags}}
+            return UpdateOne({key_field: item_dict[key_field]}, update, upsert=True)
+        return InsertOne(item_dict)
+    
+    def flush_all(self, spider):
+        for collection in list(self.buffers):
+            self.flush(collection, spider)
+    
+    def flush(self, collection, spider):
+        """Confier le lot en attente d'une collection au thread d'écriture."""
+        entries = list(self.buffers.pop(collection, {}).values())
+        if entries:
+            self.backlog.append((collection, entries))
+        self._drain_backlog(spider)
+    
+    def _drain_backlog(self, spider):
+        while self.backlog and not self.writer.full:
+            collection, entries = self.backlog.popleft()
+            d = self.writer.submit(self._write_batch, collection, entries)
+            d.addCallbacks(self._batch_written(collection, spider), self._batch_failed,
+                           errbackArgs=(collection, entries, spider))
+        
+        # Contre-pression: suspendre les téléchargements tant que la file déborde
+        if self.backlog and not self.paused:
+            self.paused = True
+            self._inc_stat('mongodb/backpressure_pauses')
+            spider.logger.warning(f"File d'écriture MongoDB pleine, moteur en pause ({len(self.backlog)} lots en attente)")
+            self.crawler.engine.pause()
+        elif self.paused and not self.backlog and self.writer.qsize() <= self.writer_queue_size // 2:
+            self.paused = False
+            spider.logger.info("File d'écriture MongoDB résorbée, reprise du moteur")
+            self.crawler.engine.unpause()
+    
+    def _write_batch(self, collection, entries):
+        """
+        Exécuté sur le thread d'écriture: compare les empreintes du lot à celles stockées
+        (une lecture projetée) puis écrit les seuls documents nouveaux ou modifiés.
+        """
+        now = datetime.utcnow()
+        key_field = self._key_field(collection)
+        documents = [entry for entry in entries if isinstance(entry, dict)]
+        operations = [entry for entry in entries if not isinstance(entry, dict)]
+        
+        keys = [document[key_field] for document in documents if document.get(key_field)]
+        stored = {}
+        if keys:
+            for existing in self.db[collection].find({key_field: {"$in": keys}},
+                                                     {key_field: 1, "fingerprint": 1, "_id": 0}):
+                stored[existing[key_field]] = existing.get('fingerprint')
+        
+        counts = {'nNew': 0, 'nChanged': 0, 'nUnchanged': 0}
+        unchanged = []
+        for document in documents:
+            key = document.get(key_field)
+            if key and key in stored:
+                if stored[key] == document['fingerprint']:
+                    counts['nUnchanged'] += 1
+                    unchanged.append(key)
+                    continue
+                counts['nChanged'] += 1
             else:
-                # Insérer
-                self.db[collection].insert_one(item_dict)
-                spider.logger.info(f"Nouvel item ajouté à MongoDB: {collection} - {item_dict.get('name', 'Anonyme')}")
-        else:
-            # Pas d'URL, on insère directement
-            self.db[collection].insert_one(item_dict)
-            spider.logger.info(f"Item ajouté à MongoDB: {collection}")
+                counts['nNew'] += 1
+            document['last_seen_at'] = now
+            operations.append(self._build_operation(document, key_field))
         
-        return item
+        details = {}
+        if operations:
+            try:
+                details = self.db[collection].bulk_write(operations, ordered=False).bulk_api_result
+            except BulkWriteError as e:
+                # Non ordonné: les autres documents du lot ont bien été écrits
+                details = e.details
+        if unchanged:
+            # Documents inchangés: seule la date de dernière vue, si elle est trop ancienne
+            self.db[collection].update_many(
+                {key_field: {"$in": unchanged}, "last_seen_at": {"$not": {"$gte": now - self.last_seen_resolution}}},
+                {"$set": {"last_seen_at": now}}
+            )
+        return {**details, **counts}
+    
+    def _batch_written(self, collection, spider):
+        def _written(details):
+            for error in details.get('writeErrors', []):
+                spider.logger.error(f"Erreur d'écriture MongoDB ({collection}, op {error.get('index')}): {error.get('errmsg')}")
+            inserted = details.get('nInserted', 0) + details.get('nUpserted', 0)
+            self._inc_stat('mongodb/batches')
+            self._inc_stat(f'mongodb/{collection}/inserted', inserted)
+            self._inc_stat(f'mongodb/{collection}/updated', details.get('nModified', 0))
+            self._inc_stat(f'mongodb/{collection}/new', details.get('nNew', 0))
+            self._inc_stat(f'mongodb/{collection}/changed', details.get('nChanged', 0))
+            self._inc_stat(f'mongodb/{collection}/unchanged', details.get('nUnchanged', 0))
+            self._inc_stat('mongodb/write_errors', len(details.get('writeErrors', [])))
+            spider.logger.info(f"Lot écrit dans MongoDB: {collection} - {inserted} nouveaux, "
+                               f"{details.get('nModified', 0)} mis à jour, "
+                               f"{details.get('nUnchanged', 0)} inchangés (non réécrits)")
+            self._drain_backlog(spider)
+        return _written
+    
+    def _batch_failed(self, failure, collection, entries, spider):
+        spider.logger.error(f"Lot MongoDB perdu ({collection}, {len(entries)} documents): {failure.value!r}")
+        self._inc_stat('mongodb/failed_batches')
+        self._inc_stat('mongodb/failed_operations', len(entries))
+        self._drain_backlog(spider)
+    
+    def _inc_stat(self, key, count=1):
+        if self.stats is not None and count:
+            self.stats.inc_value(key, count)
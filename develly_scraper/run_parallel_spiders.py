@@ -1,96 +1,284 @@
 #!/usr/bin/env python
 """
-Script pour lancer les trois spiders en parallèle.
-Usage: python run_parallel_spiders.py [--country COUNTRY_CODE] [--category CATEGORY]
+Script pour lancer les spiders en parallèle, sur plusieurs processus.
+Usage: python run_parallel_spiders.py [--workers N] [--spiders freelancer,truelancer,peopleperhour]
+                                      [--country COUNTRY_CODE] [--category CATEGORY]
+                                      [--distributed] [--max-restarts N]
+
+Chaque worker est un processus avec son propre reactor Twisted (parsing, encodage JSON et
+écritures MongoDB ne partagent plus un seul cœur). Pour chaque spider, --workers processus
+se répartissent les pays de common/countries.json (argument de spider `countries`); avec
+--distributed, ils se partagent le plan complet par baux MongoDB (voir leases.py).
+
+- Logs: un fichier par worker dans output/runs/<horodatage>/, plus run.log pour le superviseur.
+- Résumé: les stats de chaque worker sont agrégées par spider dans summary.json.
+- Ctrl+C / SIGTERM: arrêt propre des workers (requêtes en cours terminées, baux rendus);
+  un second signal les arrête immédiatement, --shutdown-timeout secondes plus tard ils sont tués.
+- Un worker mort (code de sortie non nul) est relancé sur le même shard, au plus
+  --max-restarts fois; sa frontière (frontier.py) le fait repartir où il s'était arrêté.
 """
 
 import argparse
+import json
 import logging
+import multiprocessing
 import os
+import signal
 import sys
-from twisted.internet import reactor
-from scrapy.crawler import CrawlerRunner
-from scrapy.utils.log import configure_logging
-from scrapy.utils.project import get_project_settings
+import time
+from datetime import datetime
 
 # Ajouter le répertoire parent au chemin de recherche des modules
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-
-# Importer les spiders
-from develly_scraper.spiders.freelancer_spider import FreelancerSpider
-from develly_scraper.spiders.truelancer_spider import TrueLancerSpider
-from develly_scraper.spiders.peopleperhouer_spider import PeoplePerHourSpider
-
-# Configurer le logger
-configure_logging()
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    handlers=[
-        logging.FileHandler("scrapy_parallel.log"),
-        logging.StreamHandler()
-    ]
-)
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_ROOT)
+os.environ.setdefault('SCRAPY_SETTINGS_MODULE', 'develly_scraper.settings')
+
+SPIDER_NAMES = ('freelancer', 'truelancer', 'peopleperhour')
+
+# Stats dont on garde le maximum plutôt que la somme dans le résumé
+MAX_STATS = {'elapsed_time_seconds', 'memusage/startup', 'memusage/max'}
 
 logger = logging.getLogger(__name__)
 
-def run_spiders(country=None, category=None):
-    """
-    Fonction pour exécuter tous les spiders en parallèle en utilisant twisted.internet.reactor.
-    """
-    # Obtenir les paramètres de configuration de Scrapy
+
+def load_country_codes():
+    with open(os.path.join(PROJECT_ROOT, 'common', 'countries.json'), 'r', encoding='utf-8') as f:
+        return [country['code'] for country in json.load(f)]
+
+
+def shard_countries(codes, count):
+    """Répartition circulaire des pays entre `count` workers (shards vides écartés)."""
+    return [shard for shard in (codes[i::count] for i in range(count)) if shard]
+
+
+def run_worker(spider_name, spider_kwargs, log_file, stats_file):
+    """Point d'entrée d'un processus worker: un crawl, puis ses stats écrites en JSON."""
+    if hasattr(os, 'setpgrp'):
+        # Ctrl+C n'atteint que le superviseur, qui relaie un seul signal par worker
+        os.setpgrp()
+
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+
+    from develly_scraper.spiders.freelancer_spider import FreelancerSpider
+    from develly_scraper.spiders.peopleperhouer_spider import PeoplePerHourSpider
+    from develly_scraper.spiders.truelancer_spider import TruelancerSpider
+
+    spiders = {cls.name: cls for cls in (FreelancerSpider, TruelancerSpider, PeoplePerHourSpider)}
     settings = get_project_settings()
-    
-    # Créer un runner de crawler avec les settings
-    runner = CrawlerRunner(settings)
-    
-    # Configurer les paramètres communs pour tous les spiders
-    kwargs = {}
-    if country:
-        kwargs['country'] = country
-    if category:
-        kwargs['category'] = category
-    
-    # Liste pour stocker les deferred des spiders
-    deferreds = []
-    
-    # Ajouter chaque spider au runner
-    for spider_class in [FreelancerSpider, TrueLancerSpider, PeoplePerHourSpider]:
-        logger.info(f"Démarrage du spider {spider_class.name} avec paramètres : pays={country}, catégorie={category}")
-        deferred = runner.crawl(spider_class, **kwargs)
-        deferreds.append(deferred)
-    
-    # Après l'exécution de tous les spiders, arrêter le reactor
-    from twisted.internet.defer import DeferredList
-    dl = DeferredList(deferreds)
-    dl.addBoth(lambda _: reactor.stop())
-    
-    # Démarrer le reactor
-    reactor.run()
+    settings.set('LOG_FILE', log_file)
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(spiders[spider_name])
+    process.crawl(crawler, **spider_kwargs)
+    process.start()
+
+    with open(stats_file, 'w', encoding='utf-8') as f:
+        json.dump(crawler.stats.get_stats(), f, default=str, indent=2)
+
+
+class Worker:
+    """Un processus worker supervisé (relancé sur le même shard en cas de crash)."""
+
+    def __init__(self, spider_name, index, spider_kwargs, run_dir):
+        self.spider_name = spider_name
+        self.index = index
+        self.spider_kwargs = spider_kwargs
+        self.run_dir = run_dir
+        self.process = None
+        self.attempt = 0
+        self.exitcodes = []
+
+    @property
+    def label(self):
+        return f"{self.spider_name}-{self.index}"
+
+    def stats_file(self, attempt):
+        return os.path.join(self.run_dir, f"{self.label}.{attempt}.stats.json")
+
+    def start(self, context):
+        self.attempt += 1
+        log_file = os.path.join(self.run_dir, f"{self.label}.log")
+        self.process = context.Process(
+            target=run_worker, name=self.label,
+            args=(self.spider_name, self.spider_kwargs, log_file, self.stats_file(self.attempt)),
+        )
+        self.process.start()
+        logger.info(f"Worker {self.label} démarré (pid {self.process.pid}, tentative {self.attempt}): "
+                    f"{self.spider_kwargs}")
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+
+class Supervisor:
+    """Démarre les workers, relance ceux qui meurent et relaie l'arrêt."""
+
+    def __init__(self, workers, max_restarts=3, shutdown_timeout=120):
+        self.workers = workers
+        self.max_restarts = max_restarts
+        self.shutdown_timeout = shutdown_timeout
+        self.context = multiprocessing.get_context('spawn')
+        self.stopping_since = None
+        self.signals = 0
+
+    def _on_signal(self, signum, frame):
+        self.signals += 1
+        if self.stopping_since is None:
+            self.stopping_since = time.monotonic()
+        action = "arrêt propre" if self.signals == 1 else "arrêt immédiat"
+        logger.warning(f"Signal {signum} reçu: {action} des workers")
+        for worker in self.workers:
+            if worker.alive:
+                # Scrapy: premier SIGTERM = arrêt propre, second = arrêt forcé
+                worker.process.terminate()
+
+    def run(self):
+        signal.signal(signal.SIGINT, self._on_signal)
+        signal.signal(signal.SIGTERM, self._on_signal)
+        for worker in self.workers:
+            worker.start(self.context)
+
+        running = set(self.workers)
+        while running:
+            time.sleep(1)
+            for worker in list(running):
+                if worker.alive:
+                    continue
+                worker.process.join()
+                code = worker.process.exitcode
+                worker.exitcodes.append(code)
+                if code != 0 and self.stopping_since is None and worker.attempt <= self.max_restarts:
+                    logger.warning(f"Worker {worker.label} mort (code {code}), relance")
+                    worker.start(self.context)
+                    continue
+                running.discard(worker)
+                logger.info(f"Worker {worker.label} terminé (code {code})")
+
+            if self.stopping_since is not None and time.monotonic() - self.stopping_since > self.shutdown_timeout:
+                for worker in running:
+                    if worker.alive:
+                        logger.error(f"Worker {worker.label} toujours actif après {self.shutdown_timeout}s, arrêt forcé")
+                        worker.process.kill()
+
+
+def aggregate_stats(workers):
+    """Stats de toutes les tentatives des workers, additionnées par spider."""
+    summary = {}
+    for worker in workers:
+        spider = summary.setdefault(worker.spider_name, {
+            "workers": 0, "restarts": 0, "failed_workers": 0, "finish_reasons": {}, "stats": {},
+        })
+        spider["workers"] += 1
+        spider["restarts"] += max(worker.attempt - 1, 0)
+        if worker.exitcodes and worker.exitcodes[-1] != 0:
+            spider["failed_workers"] += 1
+
+        for attempt in range(1, worker.attempt + 1):
+            try:
+                with open(worker.stats_file(attempt), 'r', encoding='utf-8') as f:
+                    stats = json.load(f)
+            except (OSError, ValueError):
+                # Tentative morte avant d'écrire ses stats
+                continue
+            reason = stats.get('finish_reason', 'unknown')
+            spider["finish_reasons"][reason] = spider["finish_reasons"].get(reason, 0) + 1
+            totals = spider["stats"]
+            for key, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                if key in MAX_STATS:
+                    totals[key] = max(totals.get(key, 0), value)
+                else:
+                    totals[key] = totals.get(key, 0) + value
+    for spider in summary.values():
+        # Un ratio ne s'additionne pas: recalculé sur les totaux
+        totals = spider["stats"]
+        totals.pop('yield/items_per_browser_minute', None)
+        if totals.get('yield/browser_seconds'):
+            totals['yield/items_per_browser_minute'] = round(
+                totals.get('yield/items', 0) / (totals['yield/browser_seconds'] / 60), 2)
+    return summary
+
+
+def build_workers(spider_names, workers_per_spider, run_dir, country=None, category=None, distributed=False):
+    codes = [country.upper()] if country else load_country_codes()
+    run_id = os.path.basename(run_dir)
+    workers = []
+    for spider_name in spider_names:
+        if distributed:
+            # Tous les workers partagent le plan complet, réservé par baux
+            assignments = [{"countries": ",".join(codes), "distributed": "1",
+                            "worker_id": f"{run_id}-{spider_name}-{i + 1}", "shard": f"w{i + 1}"}
+                           for i in range(workers_per_spider)]
+        else:
+            shards = shard_countries(codes, workers_per_spider)
+            assignments = [{"countries": ",".join(shard), "shard": f"{i + 1}of{len(shards)}"}
+                           for i, shard in enumerate(shards)]
+        for index, spider_kwargs in enumerate(assignments, start=1):
+            if category:
+                spider_kwargs["category"] = category
+            workers.append(Worker(spider_name, index, spider_kwargs, run_dir))
+    return workers
+
 
 def main():
     """Fonction principale pour lancer les spiders en parallèle."""
-    # Analyser les arguments de la ligne de commande
-    parser = argparse.ArgumentParser(description="Lancer les spiders en parallèle")
+    parser = argparse.ArgumentParser(description="Lancer les spiders en parallèle sur plusieurs processus")
+    parser.add_argument('--spiders', type=str, default=",".join(SPIDER_NAMES),
+                        help='Spiders à lancer, séparés par des virgules')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Processus par spider (défaut: nombre de cœurs / nombre de spiders)')
     parser.add_argument('--country', type=str, help='Code du pays (ex: FR, US, GB)')
     parser.add_argument('--category', type=str, help='Catégorie à scraper')
+    parser.add_argument('--distributed', action='store_true',
+                        help='Partager le plan complet entre les workers par baux MongoDB au lieu de répartir les pays')
+    parser.add_argument('--max-restarts', type=int, default=3, help='Relances maximales par worker')
+    parser.add_argument('--shutdown-timeout', type=int, default=120,
+                        help="Délai (s) avant de tuer les workers après une demande d'arrêt")
+    parser.add_argument('--output-dir', type=str, default='output/runs', help='Répertoire des logs et résumés')
     args = parser.parse_args()
-    
-    # Avertissement si aucun filtre n'est spécifié
+
+    spider_names = [name.strip() for name in args.spiders.split(',') if name.strip()]
+    unknown = [name for name in spider_names if name not in SPIDER_NAMES]
+    if unknown:
+        parser.error(f"Spiders inconnus: {', '.join(unknown)}")
+    workers_per_spider = args.workers or max(1, (os.cpu_count() or 1) // len(spider_names))
+
+    run_dir = os.path.join(args.output_dir, datetime.utcnow().strftime('%Y%m%dT%H%M%S'))
+    os.makedirs(run_dir, exist_ok=True)
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        handlers=[
+            logging.FileHandler(os.path.join(run_dir, "run.log")),
+            logging.StreamHandler()
+        ]
+    )
+
     if not args.country and not args.category:
-        logger.warning("Aucun pays ou catégorie spécifié. Les spiders vont utiliser leurs valeurs par défaut et scraper TOUTES les données disponibles.")
-        
-    if args.country:
-        logger.info(f"Filtrage par pays: {args.country}")
-    if args.category:
-        logger.info(f"Filtrage par catégorie: {args.category}")
-    
-    logger.info("Démarrage des spiders en parallèle...")
-    
-    # Exécuter tous les spiders en parallèle
-    run_spiders(country=args.country, category=args.category)
-    
-    logger.info("Tous les spiders ont terminé leur exécution.")
+        logger.warning("Aucun pays ou catégorie spécifié. Les spiders vont scraper TOUS les pays de countries.json.")
+
+    workers = build_workers(spider_names, workers_per_spider, run_dir,
+                            country=args.country, category=args.category, distributed=args.distributed)
+    logger.info(f"Démarrage de {len(workers)} workers ({workers_per_spider} par spider), logs dans {run_dir}")
+
+    started = time.monotonic()
+    Supervisor(workers, max_restarts=args.max_restarts, shutdown_timeout=args.shutdown_timeout).run()
+
+    summary = aggregate_stats(workers)
+    with open(os.path.join(run_dir, "summary.json"), 'w', encoding='utf-8') as f:
+        json.dump({"elapsed_seconds": round(time.monotonic() - started), "spiders": summary}, f, indent=2)
+
+    for spider_name, spider in summary.items():
+        stats = spider["stats"]
+        logger.info(f"{spider_name}: {spider['workers']} workers, {spider['restarts']} relances, "
+                    f"{spider['failed_workers']} en échec - {stats.get('item_scraped_count', 0)} items, "
+                    f"{stats.get('response_received_count', 0)} réponses, "
+                    f"{stats.get('log_count/ERROR', 0)} erreurs, fins: {spider['finish_reasons']}")
+    logger.info(f"Tous les spiders ont terminé leur exécution. Résumé: {os.path.join(run_dir, 'summary.json')}")
+
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,243 @@
+"""
+Ensemble persistant des URLs déjà vues, compact et probabiliste.
+
+Un SeenSet est un filtre de Bloom extensible (scalable Bloom filter) par namespace (une
+source, ex. le nom du spider), stocké dans des fichiers projetés en mémoire (mmap): il
+survit aux crawls et peut être partagé par plusieurs processus (run_parallel_spiders.py).
+
+- Extensible: quand un étage atteint sa capacité, un nouvel étage plus grand et plus strict
+  est ajouté, ce qui borne le taux de faux positifs global sans connaître le volume à l'avance.
+- Vieillissement: les entrées sont rangées par génération (une par `period` secondes); seules
+  les `generations` dernières sont consultées et les plus anciennes sont supprimées du disque.
+
+Fichiers: <directory>/<namespace>/<génération>-<étage>.bloom. Sous accès concurrent, les bits
+sont partagés immédiatement; les compteurs d'entrées (utilisés pour les estimations) sont
+approximatifs.
+"""
+
+import hashlib
+import math
+import mmap
+import os
+import re
+import struct
+import time
+
+MAGIC = b'SEENBLM1'
+# magic, nombre de bits, nombre de hachages, capacité, taux d'erreur, entrées
+HEADER = struct.Struct('<8sQQQdQ')
+HEADER_SIZE = 64
+COUNT_OFFSET = HEADER.size - 8
+STAGE_FILE = re.compile(r'^(\d+)-(\d+)\.bloom$')
+
+
+def _hashes(key):
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+    # Double hachage (Kirsch-Mitzenmacher): h1 + i*h2, h2 impair
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+
+class BloomStage:
+    """Un étage du filtre: tableau de bits de taille fixe dans un fichier projeté en mémoire."""
+
+    def __init__(self, path, handle, mm):
+        self.path = path
+        self.handle = handle
+        self.mm = mm
+        _, self.num_bits, self.num_hashes, self.capacity, self.error_rate, _ = HEADER.unpack_from(mm, 0)
+
+    @classmethod
+    def create(cls, path, capacity, error_rate):
+        """Crée l'étage de façon atomique; si un autre processus l'a créé entre-temps, l'ouvre."""
+        num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            header = HEADER.pack(MAGIC, num_bits, num_hashes, capacity, error_rate, 0)
+            f.write(header.ljust(HEADER_SIZE, b'\0'))
+            f.truncate(HEADER_SIZE + (num_bits + 7) // 8)
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+        return cls.open(path)
+
+    @classmethod
+    def open(cls, path):
+        handle = open(path, 'r+b')
+        mm = mmap.mmap(handle.fileno(), 0)
+        if mm[:len(MAGIC)] != MAGIC:
+            mm.close()
+            handle.close()
+            raise ValueError(f"Fichier de filtre invalide: {path}")
+        return cls(path, handle, mm)
+
+    @property
+    def count(self):
+        return struct.unpack_from('<Q', self.mm, COUNT_OFFSET)[0]
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    @property
+    def nbytes(self):
+        return len(self.mm)
+
+    def _positions(self, hashes):
+        h1, h2 = hashes
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def contains(self, hashes):
+        mm = self.mm
+        return all(mm[HEADER_SIZE + (bit >> 3)] & (1 << (bit & 7)) for bit in self._positions(hashes))
+
+    def add(self, hashes):
+        """Ajoute une entrée; retourne False si elle était (probablement) déjà présente."""
+        mm = self.mm
+        added = False
+        for bit in self._positions(hashes):
+            offset = HEADER_SIZE + (bit >> 3)
+            mask = 1 << (bit & 7)
+            if not mm[offset] & mask:
+                mm[offset] |= mask
+                added = True
+        if added:
+            struct.pack_into('<Q', mm, COUNT_OFFSET, self.count + 1)
+        return added
+
+    def false_positive_rate(self):
+        """Taux de faux positifs estimé d'après le nombre d'entrées."""
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        self.mm.flush()
+        self.mm.close()
+        self.handle.close()
+
+
+class SeenSet:
+    """Filtre de Bloom extensible et vieillissant pour un namespace."""
+
+    def __init__(self, directory, namespace, capacity=100000, error_rate=0.001,
+                 period=86400, generations=7, growth=2, tightening=0.8):
+        self.directory = os.path.join(directory, namespace)
+        self.namespace = namespace
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.period = period
+        self.generations = max(1, generations)
+        self.growth = growth
+        self.tightening = tightening
+        # génération -> étages ouverts (du plus ancien au plus récent)
+        self.stages = {}
+        self.current = None
+        os.makedirs(self.directory, exist_ok=True)
+        self._refresh()
+
+    @classmethod
+    def from_settings(cls, settings, namespace, max_age=None):
+        period = settings.getint('SEEN_SET_PERIOD', 86400)
+        generations = settings.getint('SEEN_SET_GENERATIONS', 7)
+        if max_age:
+            # Assez de générations pour couvrir l'âge maximal demandé
+            generations = math.ceil(max_age / period)
+        return cls(
+            settings.get('SEEN_SET_DIR', 'output/seen'),
+            namespace,
+            capacity=settings.getint('SEEN_SET_CAPACITY', 100000),
+            error_rate=settings.getfloat('SEEN_SET_ERROR_RATE', 0.001),
+            period=period,
+            generations=generations,
+        )
+
+    def __contains__(self, url):
+        self._refresh()
+        hashes = _hashes(url)
+        return any(stage.contains(hashes) for stages in self.stages.values() for stage in stages)
+
+    def add(self, url):
+        """Ajoute l'URL à la génération courante; retourne False si elle y était déjà."""
+        self._refresh()
+        hashes = _hashes(url)
+        stages = self.stages[self.current]
+        if any(stage.contains(hashes) for stage in stages):
+            return False
+        if stages[-1].full:
+            self._rescan(self.current)
+            if stages[-1].full:
+                stages.append(self._create_stage(self.current, len(stages)))
+        return stages[-1].add(hashes)
+
+    def _generation(self):
+        return int(time.time() // self.period)
+
+    def _refresh(self):
+        """Changement de génération: ouvre la nouvelle, ferme et supprime les expirées."""
+        generation = self._generation()
+        if generation == self.current:
+            return
+        self.current = generation
+        oldest = generation - self.generations + 1
+        for name in os.listdir(self.directory):
+            match = STAGE_FILE.match(name)
+            if match and int(match.group(1)) < oldest:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass  # encore projeté par un autre processus (Windows)
+        for expired in [g for g in self.stages if g < oldest]:
+            for stage in self.stages.pop(expired):
+                stage.close()
+        for g in range(oldest, generation + 1):
+            self._rescan(g)
+        if not self.stages.get(generation):
+            self.stages[generation] = [self._create_stage(generation, 0)]
+
+    def _rescan(self, generation):
+        """Ouvre les étages de la génération créés depuis (éventuellement par un autre processus)."""
+        stages = self.stages.setdefault(generation, [])
+        index = len(stages)
+        while os.path.exists(self._stage_path(generation, index)):
+            stages.append(BloomStage.open(self._stage_path(generation, index)))
+            index += 1
+        if not stages:
+            del self.stages[generation]
+
+    def _create_stage(self, generation, index):
+        capacity = int(self.capacity * self.growth ** index)
+        error_rate = self.error_rate * self.tightening ** index
+        return BloomStage.create(self._stage_path(generation, index), capacity, error_rate)
+
+    def _stage_path(self, generation, index):
+        return os.path.join(self.directory, f'{generation}-{index:02d}.bloom')
+
+    def stats(self):
+        """Entrées, empreinte mémoire (octets) et taux de faux positifs estimé."""
+        all_stages = [stage for stages in self.stages.values() for stage in stages]
+        miss_probability = 1.0
+        for stage in all_stages:
+            miss_probability *= 1 - stage.false_positive_rate()
+        return {
+            'entries': sum(stage.count for stage in all_stages),
+            'stages': len(all_stages),
+            'memory_bytes': sum(stage.nbytes for stage in all_stages),
+            'false_positive_rate': 1 - miss_probability,
+        }
+
+    def flush(self):
+        for stages in self.stages.values():
+            for stage in stages:
+                stage.flush()
+
+    def close(self):
+        for stages in self.stages.values():
+            for stage in stages:
+                stage.close()
+        self.stages = {}
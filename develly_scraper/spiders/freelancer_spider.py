@@ -4,13 +4,14 @@ from datetime import datetime
 from scrapy.http import HtmlResponse
 import json
 import os
-import random
+from develly_scraper.crawl_plan import CrawlPlan, last_page_number, listing_pages
+from develly_scraper.feeds import FeedWriter
 
 class FreelancerSpider(scrapy.Spider):
     name = 'freelancer'
     allowed_domains = ['freelancer.com']
 
-    def __init__(self, country=None, category=None, *args, **kwargs):
+    def __init__(self, country=None, category=None, countries=None, shard=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         
         # Define root path
@@ -47,8 +48,11 @@ class FreelancerSpider(scrapy.Spider):
                 'country_name': country_data['name']
             }
             
-        # If specific country provided, use only that one
-        if country:
+        # A list of countries (shard of run_parallel_spiders.py) or a single country
+        if countries:
+            codes = [code.strip().upper() for code in countries.split(',') if code.strip()]
+            self.location_codes = [code for code in codes if code in self.location_info]
+        elif country:
             if country.upper() in self.location_codes:
                 self.location_codes = [country.upper()]
             else:
@@ -56,9 +60,6 @@ class FreelancerSpider(scrapy.Spider):
         else:
             # Default to top countries for development
             self.location_codes = ['FR', 'GB', 'US', 'DE', 'IN']
-            # Shuffle the location codes for random starting point
-            random.shuffle(self.location_codes)
-            self.logger.info(f"Shuffled location codes, starting with: {self.location_codes[0]}")
         
         # Set up country slug mapping for URLs
         self.country_map = {}
@@ -103,10 +104,7 @@ class FreelancerSpider(scrapy.Spider):
                     'subcategory': category.replace('-', ' ').title(),
                     'category_id': '999'
                 }
-        else:
-            # Shuffle the categories for random starting point
-            random.shuffle(self.categories)
-            self.logger.info(f"Shuffled categories, starting with: {self.categories[0]}")
+        # The crawl plan orders categories and countries from its seed (see CrawlPlan)
         
         self.logger.info(f"Initialized with {len(self.categories)} categories and {len(self.location_codes)} countries")
         self.logger.info(f"Categories: {self.categories}")
@@ -114,46 +112,81 @@ class FreelancerSpider(scrapy.Spider):
         
         # Set up output directory
         os.makedirs("output", exist_ok=True)
-        self.output_file = f"output/freelancer_all.json"
+        self.output_file = f"output/freelancer_{shard or 'all'}.json"
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        # One buffered, rotating feed per spider instead of reopening output_file per item
+        spider.feed = FeedWriter.from_settings(crawler.settings, spider.output_file)
+        return spider
+
+    def closed(self, reason):
+        self.feed.close()
+        self.logger.info(f"Feed closed: {self.feed.items_written} items written ({reason})")
 
     def start_requests(self):
-        """Start with the first category and location"""
-        if self.categories and self.location_codes:
-            first_category = self.categories[0]
-            first_location = self.location_codes[0]
-            
-            category_data = self.category_info.get(first_category, {})
-            location_data = self.location_info.get(first_location, {})
-            
-            # Determine URL based on country and category
-            country_slug = self.country_map.get(first_location)
-            
-            if country_slug:
-                url = f"https://www.freelancer.com/freelancers/{country_slug}/{first_category}"
-            else:
-                url = f"https://www.freelancer.com/freelancers/skills/{first_category}"
-                
-            self.logger.info(f"Starting with URL: {url}")
-            self.logger.info(f"Category: {first_category} ({category_data.get('main_category', '')}: {category_data.get('subcategory', '')})")
-            self.logger.info(f"Location: {first_location} ({location_data.get('country_name', '')})")
-            
-            yield scrapy.Request(
-                url=url,
-                callback=self.parse,
-                meta={
-                    "playwright": True,
-                    "playwright_page_methods": [{"method": "wait_for_timeout", "args": [3000]}],
-                    "category": first_category,
-                    "category_data": category_data,
-                    "location": first_location,
-                    "location_data": location_data,
-                    "page": 1
-                }
-            )
+        """Seed the crawl plan: one listing chain per active (category, location) combination"""
+        self.crawl_plan = CrawlPlan.from_spider(self, self.categories, self.location_codes)
+        self.logger.info(f"Crawl plan: {len(self.crawl_plan)} combinations, "
+                         f"max concurrent: {self.crawl_plan.max_concurrent or 'all'}, seed: {self.crawl_plan.order_seed}")
+
+        for category, location in self.crawl_plan.seed():
+            category_data = self.category_info.get(category, {})
+            location_data = self.location_info.get(location, {})
+            self.logger.info(f"Starting category: {category} ({category_data.get('main_category', '')}: {category_data.get('subcategory', '')}), "
+                             f"location: {location} ({location_data.get('country_name', '')})")
+            yield self._listing_request(category, location, self.crawl_plan.start_page(category, location))
+
+    def _listing_url(self, category, location, page=1):
+        """Build the listing URL for a category, a country and a page"""
+        country_slug = self.country_map.get(location)
+
+        if country_slug:
+            url = f"https://www.freelancer.com/freelancers/{country_slug}/{category}"
+        else:
+            url = f"https://www.freelancer.com/freelancers/skills/{category}"
+
+        if page > 1:
+            url = f"{url}/{page}"
+        return url
+
+    def _listing_request(self, category, location, page=1, lead=True):
+        """Build the listing request of a (category, location) chain (lead pages schedule the next ones)"""
+        return scrapy.Request(
+            url=self._listing_url(category, location, page),
+            callback=self.parse,
+            errback=self._listing_failed,
+            # Productive chains first (see CrawlPlan.priority)
+            priority=self.crawl_plan.priority(category, location),
+            meta={
+                "playwright": True,
+                "page_type": "listing",
+                "category": category,
+                "category_data": self.category_info.get(category, {}),
+                "location": location,
+                "location_data": self.location_info.get(location, {}),
+                "page": page,
+                "lead": lead,
+                # Chain of the page, for its yield (see yields.py)
+                "category_tag": {"category": category, "location": location},
+            }
+        )
+
+    def _listing_failed(self, failure):
+        """A failed listing page schedules nothing: its chain ends once its other pages are done"""
+        request = failure.request
+        self.logger.warning(f"Listing request failed: {request.url} ({failure.value!r})")
+        if self.crawl_plan.page_done(request.meta.get("category"), request.meta.get("location"),
+                                     request.meta.get("page", 1)):
+            yield from self._move_to_next_location_or_category(request)
 
     def parse(self, response):
         if not isinstance(response, HtmlResponse):
             self.logger.error("❌ La réponse n'est pas de type HtmlResponse.")
+            if self.crawl_plan.page_done(response.meta.get("category"), response.meta.get("location"),
+                                         response.meta.get("page", 1)):
+                yield from self._move_to_next_location_or_category(response)
             return
 
         # Get current category, location and page from meta
@@ -211,119 +244,60 @@ class FreelancerSpider(scrapy.Spider):
                 meta={
                     "item": item, 
                     "playwright": True,
-                    "playwright_page_methods": [{"method": "wait_for_timeout", "args": [3000]}]
+                    "page_type": "profile",
+                    "category_tag": {"category": current_category, "location": current_location},
+                    # Listing-level fields, written alone when the profile is still fresh
+                    "listing_fields": {
+                        "url": profile_url,
+                        "rating": item["rating"],
+                        "reviews_count": item["reviews_count"],
+                        "hourly_rate": item["hourly_rate"],
+                    },
+                    # Card-level fields, written straight away in listing-only fast mode
+                    "listing_card": {key: item[key] for key in (
+                        "name", "title", "description", "thumbnail", "skills", "country_id", "country_name",
+                        "url_of_search", "source", "source_id", "main_skill", "category_id",
+                        "main_category", "subcategory")},
                 }
             )
 
-        # Check for next page in the current category and location
-        if freelancers:
-            # Move to the next page for the current category and location
-            next_page = current_page + 1
-            
-            # Determine URL based on country and category 
-            country_slug = self.country_map.get(current_location)
-            
-            if country_slug:
-                next_url = f"https://www.freelancer.com/freelancers/{country_slug}/{current_category}/{next_page}"
-            else:
-                next_url = f"https://www.freelancer.com/freelancers/skills/{current_category}/{next_page}"
-            
-            self.logger.info(f"Moving to next page: {next_url}")
-            yield scrapy.Request(
-                url=next_url,
-                callback=self.parse,
-                meta={
-                    "playwright": True,
-                    "playwright_page_methods": [{"method": "wait_for_timeout", "args": [3000]}],
-                    "category": current_category,
-                    "category_data": category_data,
-                    "location": current_location,
-                    "location_data": location_data,
-                    "page": next_page
-                }
-            )
-        else:
-            # No freelancers found, move to next location or category
-            self.logger.info(f"No freelancers found for {current_category}/{current_location}, moving to next")
+        # Lead pages schedule the next ones: every remaining page at once when the
+        # pagination gives the last page, otherwise the next page while results keep coming
+        next_pages, lead_page = [], None
+        if freelancers and response.meta.get("lead", True):
+            last_page = last_page_number(
+                response, '//*[contains(@class, "Pagination") or contains(@class, "pagination")]//a/@href',
+                r'/(\d+)/?$')
+            next_pages, lead_page = listing_pages(current_page, last_page, True,
+                                                  self.settings.getint('LISTING_FANOUT_MAX_PAGES', 20))
+        if not freelancers:
+            self.logger.info(f"No freelancers found for {current_category}/{current_location} on page {current_page}")
+
+        if self.crawl_plan.page_done(current_category, current_location, current_page, next_pages):
+            # No page left for this chain (or it now belongs to another worker): next combination
             yield from self._move_to_next_location_or_category(response)
+            return
+        if next_pages:
+            self.logger.info(f"Scheduling listing pages {next_pages[0]}-{next_pages[-1]} "
+                             f"for {current_category}/{current_location}")
+        for next_page in next_pages:
+            yield self._listing_request(current_category, current_location, next_page, lead=next_page == lead_page)
                 
     def _move_to_next_location_or_category(self, response):
-        """Helper method to move to the next location or category"""
+        """Helper method to close the current chain and start the next combinations of the plan"""
         current_category = response.meta.get("category")
-        category_data = response.meta.get("category_data", {})
         current_location = response.meta.get("location")
-        location_data = response.meta.get("location_data", {})
-        
-        # Find indices of current category and location
-        try:
-            category_index = self.categories.index(current_category)
-            location_index = self.location_codes.index(current_location)
-            
-            # Try moving to the next location first
-            if location_index < len(self.location_codes) - 1:
-                # Move to next location with the same category
-                next_location = self.location_codes[location_index + 1]
-                next_location_data = self.location_info.get(next_location, {})
-                
-                self.logger.info(f"Moving to next location: {next_location} ({next_location_data.get('country_name', '')}) for category {current_category}")
-                
-                # Determine URL based on country and category
-                country_slug = self.country_map.get(next_location)
-                
-                if country_slug:
-                    next_url = f"https://www.freelancer.com/freelancers/{country_slug}/{current_category}"
-                else:
-                    next_url = f"https://www.freelancer.com/freelancers/skills/{current_category}"
-                
-                yield scrapy.Request(
-                    url=next_url,
-                    callback=self.parse,
-                    meta={
-                        "playwright": True,
-                        "playwright_page_methods": [{"method": "wait_for_timeout", "args": [3000]}],
-                        "category": current_category,
-                        "category_data": category_data,
-                        "location": next_location,
-                        "location_data": next_location_data,
-                        "page": 1
-                    }
-                )
-            # If we've gone through all locations, move to the next category
-            elif category_index < len(self.categories) - 1:
-                next_category = self.categories[category_index + 1]
-                next_category_data = self.category_info.get(next_category, {})
-                
-                # Reset location to the first one
-                first_location = self.location_codes[0]
-                first_location_data = self.location_info.get(first_location, {})
-                
-                self.logger.info(f"Moving to next category: {next_category} ({next_category_data.get('main_category', '')}: {next_category_data.get('subcategory', '')}) with location {first_location}")
-                
-                # Determine URL based on country and category
-                country_slug = self.country_map.get(first_location)
-                
-                if country_slug:
-                    next_url = f"https://www.freelancer.com/freelancers/{country_slug}/{next_category}"
-                else:
-                    next_url = f"https://www.freelancer.com/freelancers/skills/{next_category}"
-                
-                yield scrapy.Request(
-                    url=next_url,
-                    callback=self.parse,
-                    meta={
-                        "playwright": True,
-                        "playwright_page_methods": [{"method": "wait_for_timeout", "args": [3000]}],
-                        "category": next_category,
-                        "category_data": next_category_data,
-                        "location": first_location,
-                        "location_data": first_location_data,
-                        "page": 1
-                    }
-                )
-            else:
-                self.logger.info("All categories and locations have been processed")
-        except ValueError:
-            self.logger.warning(f"Category {current_category} or location {current_location} not found in the lists")
+
+        for next_category, next_location in self.crawl_plan.complete(current_category, current_location):
+            next_category_data = self.category_info.get(next_category, {})
+            next_location_data = self.location_info.get(next_location, {})
+            self.logger.info(f"Moving to next combination: {next_category} ({next_category_data.get('main_category', '')}: {next_category_data.get('subcategory', '')}) "
+                             f"with location {next_location} ({next_location_data.get('country_name', '')})")
+            yield self._listing_request(next_category, next_location,
+                                        self.crawl_plan.start_page(next_category, next_location))
+
+        if self.crawl_plan.finished:
+            self.logger.info("All categories and locations have been processed")
 
     def parse_profile(self, response):
         item = response.meta["item"]
@@ -383,8 +357,7 @@ class FreelancerSpider(scrapy.Spider):
         }
 
         # Enregistrement du freelancer
-        with open(self.output_file, 'a', encoding='utf-8') as f:
-            f.write(json.dumps(freelancer_item, ensure_ascii=False) + "\n")
+        self.feed.write(freelancer_item)
 
         # Extraire et traiter les reviews comme des entités distinctes
         review_blocks = response.xpath('//fl-review-card')
@@ -413,8 +386,7 @@ class FreelancerSpider(scrapy.Spider):
             }
 
             # Enregistrement de la review
-            with open(self.output_file, 'a', encoding='utf-8') as f:
-                f.write(json.dumps(review_item, ensure_ascii=False) + "\n")
+            self.feed.write(review_item)
             
             yield review_item
 
@@ -3,14 +3,15 @@ from urllib.parse import urlencode, urlparse, parse_qs
 from datetime import datetime
 import json
 import os
-import random
+from develly_scraper.crawl_plan import CrawlPlan, last_page_number, listing_pages
+from develly_scraper.feeds import FeedWriter
 
 
 class PeoplePerHourSpider(scrapy.Spider):
     name = "peopleperhour"
     allowed_domains = ["peopleperhour.com"]
 
-    def __init__(self, location=None, category=None, *args, **kwargs):
+    def __init__(self, location=None, category=None, countries=None, shard=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         
         # Define root path
@@ -61,10 +62,6 @@ class PeoplePerHourSpider(scrapy.Spider):
                 self.categories = matching_keys
             else:
                 self.logger.warning(f"Category {category} not found in filter_mapping.json. Using default categories.")
-        else:
-            # Shuffle the categories for random starting point
-            random.shuffle(self.categories)
-            self.logger.info(f"Shuffled categories, starting with: {self.categories[0]}")
 
         # Get countries and build location mapping
         self.location_codes = []
@@ -77,8 +74,11 @@ class PeoplePerHourSpider(scrapy.Spider):
                 'country_name': country['name']
             }
             
-        # If specific location provided, use only that one
-        if location:
+        # A list of locations (shard of run_parallel_spiders.py) or a single location
+        if countries:
+            codes = [code.strip().upper() for code in countries.split(',') if code.strip()]
+            self.location_codes = [code for code in codes if code in self.location_info]
+        elif location:
             if location.upper() in self.location_codes:
                 self.location_codes = [location.upper()]
             else:
@@ -86,46 +86,79 @@ class PeoplePerHourSpider(scrapy.Spider):
         else:
             # Default to top countries for development
             self.location_codes = ['FR', 'GB', 'US', 'DE', 'IN']
-            # Shuffle the location codes for random starting point
-            random.shuffle(self.location_codes)
-            self.logger.info(f"Shuffled location codes, starting with: {self.location_codes[0]}")
+        # The crawl plan orders categories and locations from its seed (see CrawlPlan)
             
         self.logger.info(f"Initialized with {len(self.categories)} categories and {len(self.location_codes)} locations")
         
         # Set up output file
         os.makedirs("output", exist_ok=True)
-        self.output_file = f"output/peopleperhour_{self.location_codes[0] if self.location_codes else 'ALL'}.json"
+        self.output_file = f"output/peopleperhour_{shard or (self.location_codes[0] if self.location_codes else 'ALL')}.json"
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        # One buffered, rotating feed per spider instead of reopening output_file per item
+        spider.feed = FeedWriter.from_settings(crawler.settings, spider.output_file)
+        return spider
+
+    def closed(self, reason):
+        self.feed.close()
+        self.logger.info(f"Feed closed: {self.feed.items_written} items written ({reason})")
 
     def start_requests(self):
-        """Start with the first category and location"""
-        if self.categories and self.location_codes:
-            first_category_key = self.categories[0]
-            first_location = self.location_codes[0]
-            
-            # Extraire le category_id depuis les infos de catégorie
-            category_data = self.category_info.get(first_category_key, {})
-            category_id = category_data.get('category_id')
-            
-            # Utiliser le category_id numérique dans l'URL
-            url = f"https://www.peopleperhour.com/hire-freelancers?{urlencode({'location': first_location, 'industries': str(category_id)})}"
-            
-            location_data = self.location_info.get(first_location, {})
-            
-            self.logger.info(f"Starting with URL: {url}")
-            self.logger.info(f"Category: {category_data.get('subcategory', '')} ({category_data.get('main_category', '')}, ID: {category_id})")
-            self.logger.info(f"Location: {first_location} ({location_data.get('country_name', '')})")
-            
-            yield scrapy.Request(
-                url=url,
-                callback=self.parse,
-                meta={
-                    "category_key": first_category_key,
-                    "category_data": category_data,
-                    "location": first_location,
-                    "location_data": location_data,
-                    "page": 1
-                }
-            )
+        """Seed the crawl plan: one listing chain per active (category, location) combination"""
+        self.crawl_plan = CrawlPlan.from_spider(self, self.categories, self.location_codes)
+        self.logger.info(f"Crawl plan: {len(self.crawl_plan)} combinations, "
+                         f"max concurrent: {self.crawl_plan.max_concurrent or 'all'}, seed: {self.crawl_plan.order_seed}")
+
+        for category_key, location in self.crawl_plan.seed():
+            category_data = self.category_info.get(category_key, {})
+            location_data = self.location_info.get(location, {})
+            self.logger.info(f"Starting category: {category_data.get('subcategory', '')} ({category_data.get('main_category', '')}, ID: {category_data.get('category_id')}), "
+                             f"location: {location} ({location_data.get('country_name', '')})")
+            yield self._listing_request(category_key, location, self.crawl_plan.start_page(category_key, location))
+
+    def _listing_url(self, category_key, location, page=1):
+        """Build the listing URL for a category, a location and a page"""
+        category_id = self.category_info.get(category_key, {}).get('category_id')
+
+        # Utiliser le category_id numérique dans l'URL
+        params = {'location': location}
+        if page > 1:
+            params['page'] = page
+        if category_id is not None:
+            params['industries'] = str(category_id)
+
+        return f"https://www.peopleperhour.com/hire-freelancers?{urlencode(params)}"
+
+    def _listing_request(self, category_key, location, page=1, lead=True):
+        """Build the listing request of a (category, location) chain (lead pages schedule the next ones)"""
+        return scrapy.Request(
+            url=self._listing_url(category_key, location, page),
+            callback=self.parse,
+            errback=self._listing_failed,
+            # Productive chains first (see CrawlPlan.priority)
+            priority=self.crawl_plan.priority(category_key, location),
+            meta={
+                "page_type": "listing",
+                "category_key": category_key,
+                "category_data": self.category_info.get(category_key, {}),
+                "location": location,
+                "location_data": self.location_info.get(location, {}),
+                "page": page,
+                "lead": lead,
+                # Chain of the page, for its yield (see yields.py)
+                "category_tag": {"category": category_key, "location": location},
+            }
+        )
+
+    def _listing_failed(self, failure):
+        """A failed listing page schedules nothing: its chain ends once its other pages are done"""
+        request = failure.request
+        self.logger.warning(f"Listing request failed: {request.url} ({failure.value!r})")
+        if self.crawl_plan.page_done(request.meta.get("category_key"), request.meta.get("location"),
+                                     request.meta.get("page", 1)):
+            yield from self._move_to_next_location_or_category(request)
 
     def parse(self, response):
         # Get current category, location and page from meta
@@ -139,7 +172,9 @@ class PeoplePerHourSpider(scrapy.Spider):
         # Si on rencontre une page 404, passer à la catégorie/location suivante
         if response.status == 404:
             self.logger.warning(f"Page 404 pour la catégorie {category_data.get('subcategory', '')} (ID: {category_id}) et location {current_location}. Passage à la suivante.")
-            return self._move_to_next_location_or_category(response)
+            if self.crawl_plan.page_done(current_category_key, current_location, current_page):
+                yield from self._move_to_next_location_or_category(response)
+            return
         
         self.logger.info(f"Processing category: {category_data.get('subcategory', '')} ({category_data.get('main_category', '')}, ID: {category_id}), "
                        f"location: {current_location} ({location_data.get('country_name', '')}), page: {current_page}")
@@ -203,144 +238,79 @@ class PeoplePerHourSpider(scrapy.Spider):
 
             # Suivre l'URL du profil pour obtenir plus de détails
             if profile_url:
-                yield response.follow(profile_url, callback=self.parse_detail, meta={"card_data": card_data})
+                # Listing-level fields, written alone when the profile is still fresh
+                listing_fields = {
+                    "url": profile_url,
+                    "rating": self._number(rating),
+                    "reviews_count": self._number(reviews_count, int),
+                    "hourly_rate": self._number(hourly_rate),
+                }
+                # Card-level fields, written straight away in listing-only fast mode
+                listing_card = {
+                    "name": name,
+                    "title": job_title,
+                    "thumbnail": avatar,
+                    "skills": [skill.strip() for skill in skills if skill.strip()],
+                    "country_name": displayed_country,
+                    "url_of_search": response.url,
+                    "source": "PeoplePerHour",
+                    "source_id": self.source_id,
+                    "category": current_category_key,
+                    "main_category": category_data.get('main_category'),
+                    "subcategory": category_data.get('subcategory'),
+                    "category_id": category_data.get('category_id'),
+                }
+                yield response.follow(profile_url, callback=self.parse_detail,
+                                      meta={"card_data": card_data, "page_type": "profile",
+                                            "listing_fields": listing_fields, "listing_card": listing_card,
+                                            "category_tag": {"category": current_category_key,
+                                                             "location": current_location}})
 
-        # Check for more results on the page
-        if cards:
-            # Handle pagination - check if there's a next page button
+        # Lead pages schedule the next ones: every remaining page at once when the
+        # pagination gives the last page, otherwise the next page behind the "Next" button
+        next_pages, lead_page = [], None
+        if cards and response.meta.get("lead", True):
             next_page_btn = response.xpath('//a[contains(@class, "pagination-next") or contains(@class, "next") or contains(text(), "Next")]')
-            
-            if next_page_btn:
-                # Construct next page URL with the updated structure
-                next_page = current_page + 1
-                params = {'location': current_location, 'page': next_page}
-                if category_id is not None:
-                    params['industries'] = str(category_id)
-                
-                next_url = f"https://www.peopleperhour.com/hire-freelancers?{urlencode(params)}"
-                
-                self.logger.info(f"Moving to next page: {next_url}")
-                yield scrapy.Request(
-                    url=next_url,
-                    callback=self.parse,
-                    meta={
-                        "category_key": current_category_key,
-                        "category_data": category_data,
-                        "location": current_location,
-                        "location_data": location_data,
-                        "page": next_page
-                    }
-                )
-            else:
-                # No more pages for this category/location combination
-                # Move to the next location or category
-                self.logger.info(f"No next page button for {current_category_key}/{current_location}, moving to next")
-                yield from self._move_to_next_location_or_category(response)
-        else:
-            # No results on this page, move to next location or category
-            self.logger.info(f"No freelancer cards for {current_category_key}/{current_location}, moving to next")
+            last_page = last_page_number(
+                response, '//*[contains(@class, "pagination")]//a/@href', r'[?&]page=(\d+)')
+            next_pages, lead_page = listing_pages(current_page, last_page, bool(next_page_btn),
+                                                  self.settings.getint('LISTING_FANOUT_MAX_PAGES', 20))
+        if not cards:
+            self.logger.info(f"No freelancer cards for {current_category_key}/{current_location} on page {current_page}")
+
+        if self.crawl_plan.page_done(current_category_key, current_location, current_page, next_pages):
+            # No page left for this chain (or it now belongs to another worker): next combination
             yield from self._move_to_next_location_or_category(response)
+            return
+        if next_pages:
+            self.logger.info(f"Scheduling listing pages {next_pages[0]}-{next_pages[-1]} "
+                             f"for {current_category_key}/{current_location}")
+        for next_page in next_pages:
+            yield self._listing_request(current_category_key, current_location, next_page, lead=next_page == lead_page)
+
+    @staticmethod
+    def _number(value, cast=float):
+        """Parse a number scraped from a card, None when missing or malformed"""
+        try:
+            return cast(value) if value else None
+        except (TypeError, ValueError):
+            return None
 
     def _move_to_next_location_or_category(self, response):
-        """Helper method to move to the next location or category"""
+        """Helper method to close the current chain and start the next combinations of the plan"""
         current_category_key = response.meta.get("category_key")
-        category_data = response.meta.get("category_data", {})
-        category_id = category_data.get('category_id')
         current_location = response.meta.get("location")
-        location_data = response.meta.get("location_data", {})
-        
-        # Find indices of current category and location
-        try:
-            category_index = self.categories.index(current_category_key)
-            location_index = self.location_codes.index(current_location)
-            
-            # Try moving to the next location first
-            if location_index < len(self.location_codes) - 1:
-                # Move to next location with the same category
-                next_location = self.location_codes[location_index + 1]
-                next_location_data = self.location_info.get(next_location, {})
-                
-                self.logger.info(f"Moving to next location: {next_location} ({next_location_data.get('country_name', '')}) for category {category_data.get('subcategory', '')}")
-                
-                # Mise à jour de l'URL vers la structure correcte
-                params = {'location': next_location}
-                if category_id is not None:
-                    params['industries'] = str(category_id)
-                    
-                next_url = f"https://www.peopleperhour.com/hire-freelancers?{urlencode(params)}"
-                
-                yield scrapy.Request(
-                    url=next_url,
-                    callback=self.parse,
-                    meta={
-                        "category_key": current_category_key,
-                        "category_data": category_data,
-                        "location": next_location,
-                        "location_data": next_location_data,
-                        "page": 1
-                    }
-                )
-            # If we've gone through all locations, move to the next category
-            elif category_index < len(self.categories) - 1:
-                next_category_key = self.categories[category_index + 1]
-                next_category_data = self.category_info.get(next_category_key, {})
-                next_category_id = next_category_data.get('category_id')
-                
-                # Reset location to the first one
-                first_location = self.location_codes[0]
-                first_location_data = self.location_info.get(first_location, {})
-                
-                self.logger.info(f"Moving to next category: {next_category_data.get('subcategory', '')} ({next_category_data.get('main_category', '')}, ID: {next_category_id}) with location {first_location}")
-                
-                # Mise à jour de l'URL vers la structure correcte
-                params = {'location': first_location}
-                if next_category_id is not None:
-                    params['industries'] = str(next_category_id)
-                    
-                next_url = f"https://www.peopleperhour.com/hire-freelancers?{urlencode(params)}"
-                
-                yield scrapy.Request(
-                    url=next_url,
-                    callback=self.parse,
-                    meta={
-                        "category_key": next_category_key,
-                        "category_data": next_category_data,
-                        "location": first_location,
-                        "location_data": first_location_data,
-                        "page": 1
-                    }
-                )
-            else:
-                self.logger.info("All categories and locations have been processed.")
-        except ValueError as e:
-            self.logger.error(f"Error finding category or location index: {e}")
-            
-            # Try to recover by starting with the first category and location
-            if self.categories and self.location_codes:
-                first_category_key = self.categories[0]
-                first_location = self.location_codes[0]
-                first_category_data = self.category_info.get(first_category_key, {})
-                first_category_id = first_category_data.get('category_id')
-                
-                self.logger.info(f"Recovering by starting with first category and location: {first_category_key}, {first_location}")
-                
-                params = {'location': first_location}
-                if first_category_id is not None:
-                    params['industries'] = str(first_category_id)
-                    
-                next_url = f"https://www.peopleperhour.com/hire-freelancers?{urlencode(params)}"
-                
-                yield scrapy.Request(
-                    url=next_url,
-                    callback=self.parse,
-                    meta={
-                        "category_key": first_category_key,
-                        "category_data": first_category_data,
-                        "location": first_location,
-                        "location_data": self.location_info.get(first_location, {}),
-                        "page": 1
-                    }
-                )
+
+        for next_category_key, next_location in self.crawl_plan.complete(current_category_key, current_location):
+            next_category_data = self.category_info.get(next_category_key, {})
+            next_location_data = self.location_info.get(next_location, {})
+            self.logger.info(f"Moving to next combination: {next_category_data.get('subcategory', '')} ({next_category_data.get('main_category', '')}, ID: {next_category_data.get('category_id')}) "
+                             f"with location {next_location} ({next_location_data.get('country_name', '')})")
+            yield self._listing_request(next_category_key, next_location,
+                                        self.crawl_plan.start_page(next_category_key, next_location))
+
+        if self.crawl_plan.finished:
+            self.logger.info("All categories and locations have been processed.")
 
     def parse_detail(self, response):
         card_data = response.meta["card_data"]
@@ -487,6 +457,7 @@ class PeoplePerHourSpider(scrapy.Spider):
                 'text': text,
                 'title': None,
                 'created_at': date,
+                'review_date': date,
                 'location': location,
                 'source': 'PeoplePerHour',
                 'source_id': card_data.get('source_id'),
@@ -497,8 +468,7 @@ class PeoplePerHourSpider(scrapy.Spider):
             }
             
             # Write to the file
-            with open(self.output_file, 'a', encoding='utf-8') as f:
-                f.write(json.dumps(review_item, ensure_ascii=False) + "\n")
+            self.feed.write(review_item)
             
             yield review_item
 
@@ -540,13 +510,11 @@ class PeoplePerHourSpider(scrapy.Spider):
                 }
 
                 # Write to the file
-                with open(self.output_file, 'a', encoding='utf-8') as f:
-                    f.write(json.dumps(service_item, ensure_ascii=False) + "\n")
+                self.feed.write(service_item)
                 
                 yield service_item
 
         # Write freelancer data to file
-        with open(self.output_file, 'a', encoding='utf-8') as f:
-            f.write(json.dumps(freelancer_item, ensure_ascii=False) + "\n")
+        self.feed.write(freelancer_item)
         
         yield freelancer_item 
\ No newline at end of file
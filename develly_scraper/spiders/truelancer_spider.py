@@ -4,7 +4,7 @@ from datetime import datetime
 from scrapy.http import HtmlResponse
 import json
 import os
-import random
+from develly_scraper.crawl_plan import CrawlPlan, last_page_number, listing_pages
 from develly_scraper.items import FreelancerItem, ReviewItem
 
 class TruelancerSpider(scrapy.Spider):
@@ -49,22 +49,19 @@ class TruelancerSpider(scrapy.Spider):
                 'country_name': country_data['name']
             }
             
-        # If specific country provided, use only that one
-        if self.country_code != 'ALL':
+        # A list of countries (shard of run_parallel_spiders.py) or a single country
+        if kwargs.get('countries'):
+            codes = [code.strip().upper() for code in kwargs['countries'].split(',') if code.strip()]
+            self.location_codes = [code for code in codes if code in self.location_info]
+        elif self.country_code != 'ALL':
             if self.country_code in self.location_codes:
                 self.location_codes = [self.country_code]
             else:
                 self.logger.warning(f"Country code {self.country_code} not found in countries.json. Using all countries.")
                 self.location_codes = ['FR', 'GB', 'US', 'DE', 'IN']  # Default to top countries for development
-                # Shuffle the location codes for random starting point
-                random.shuffle(self.location_codes)
-                self.logger.info(f"Shuffled location codes, starting with: {self.location_codes[0]}")
         else:
             # Default to top countries for development
             self.location_codes = ['FR', 'GB', 'US', 'DE', 'IN']
-            # Shuffle the location codes for random starting point
-            random.shuffle(self.location_codes)
-            self.logger.info(f"Shuffled location codes, starting with: {self.location_codes[0]}")
         
         # Get categories from filter mapping
         self.categories = []
@@ -78,9 +75,7 @@ class TruelancerSpider(scrapy.Spider):
                     'subcategory': subcategory_name
                 }
         
-        # Shuffle the categories for random starting point
-        random.shuffle(self.categories)
-        self.logger.info(f"Shuffled categories, starting with: {self.categories[0]}")
+        # The crawl plan orders categories and countries from its seed (see CrawlPlan)
                 
         self.logger.info(f"Loaded {len(self.categories)} categories from filter mapping")
         self.logger.info(f"Categories: {self.category_names}")
@@ -97,36 +92,63 @@ class TruelancerSpider(scrapy.Spider):
         self.logger.info(f"Item Pipelines: {settings.get('ITEM_PIPELINES')}")
         
     def start_requests(self):
-        """Start with the first category and location"""
-        if self.categories and self.location_codes:
-            # Start with the first category and first location
-            first_category = self.categories[0]
-            first_location = self.location_codes[0]
-            
-            url = f'https://www.truelancer.com/freelancers?page=1&slist={first_category}'
-            if first_location != 'ALL':
-                url = f"{url}&clist={first_location}"
-                
-            self.logger.info(f"Starting with URL: {url}")
-            self.logger.info(f"Category: {first_category} ({self.category_names.get(first_category, {}).get('main_category', '')}: {self.category_names.get(first_category, {}).get('subcategory', '')})")
-            self.logger.info(f"Location: {first_location} ({self.location_info.get(first_location, {}).get('country_name', '')})")
-            
-            yield scrapy.Request(
-                url=url,
-                callback=self.parse,
-                meta={
-                    "playwright": True,
-                    "playwright_page_methods": [{"method": "wait_for_timeout", "args": [5000]}],
-                    "category_id": first_category,
-                    "category_info": self.category_names.get(first_category, {}),
-                    "location": first_location,
-                    "location_data": self.location_info.get(first_location, {})
-                }
-            )
+        """Seed the crawl plan: one listing chain per active (category, location) combination"""
+        self.crawl_plan = CrawlPlan.from_spider(self, self.categories, self.location_codes)
+        self.logger.info(f"Crawl plan: {len(self.crawl_plan)} combinations, "
+                         f"max concurrent: {self.crawl_plan.max_concurrent or 'all'}, seed: {self.crawl_plan.order_seed}")
+
+        for category, location in self.crawl_plan.seed():
+            self.logger.info(f"Starting category: {category} ({self.category_names.get(category, {}).get('main_category', '')}: {self.category_names.get(category, {}).get('subcategory', '')}), "
+                             f"location: {location} ({self.location_info.get(location, {}).get('country_name', '')})")
+            yield self._listing_request(category, location, self.crawl_plan.start_page(category, location))
+
+    def _listing_url(self, category, location, page=1):
+        """Build the listing URL for a category, a location and a page"""
+        url = f'https://www.truelancer.com/freelancers?page={page}&slist={category}'
+        if location != 'ALL':
+            url = f"{url}&clist={location}"
+        return url
+
+    def _listing_meta(self, category, location, page=1, lead=True):
+        """Meta shared by every listing page of a (category, location) chain (lead pages schedule the next ones)"""
+        return {
+            "playwright": True,
+            "page_type": "listing",
+            "category_id": category,
+            "category_info": self.category_names.get(category, {}),
+            "location": location,
+            "location_data": self.location_info.get(location, {}),
+            "page": page,
+            "lead": lead,
+            # Chain of the page, for its yield (see yields.py)
+            "category_tag": {"category": category, "location": location},
+        }
+
+    def _listing_request(self, category, location, page=1, lead=True):
+        """Build the listing request of a (category, location) chain"""
+        return scrapy.Request(
+            url=self._listing_url(category, location, page),
+            callback=self.parse,
+            errback=self._listing_failed,
+            # Productive chains first (see CrawlPlan.priority)
+            priority=self.crawl_plan.priority(category, location),
+            meta=self._listing_meta(category, location, page, lead)
+        )
+
+    def _listing_failed(self, failure):
+        """A failed listing page schedules nothing: its chain ends once its other pages are done"""
+        request = failure.request
+        self.logger.warning(f"Listing request failed: {request.url} ({failure.value!r})")
+        if self.crawl_plan.page_done(request.meta.get("category_id"), request.meta.get("location"),
+                                     int(request.meta.get("page") or 1)):
+            yield from self._move_to_next_location_or_category(request)
 
     def parse(self, response):
         if not isinstance(response, HtmlResponse):
             self.logger.error("❌ La réponse n'est pas de type HtmlResponse.")
+            if self.crawl_plan.page_done(response.meta.get("category_id"), response.meta.get("location"),
+                                         int(response.meta.get("page") or 1)):
+                yield from self._move_to_next_location_or_category(response)
             return
 
         current_category = response.meta.get("category_id")
@@ -199,122 +221,57 @@ class TruelancerSpider(scrapy.Spider):
                 meta={
                     'item': item,
                     "playwright": True,
-                    "playwright_page_methods": [{"method": "wait_for_timeout", "args": [5000]}]
+                    "page_type": "profile",
+                    "category_tag": {"category": current_category, "location": current_location},
+                    # Listing-level fields, written alone when the profile is still fresh
+                    "listing_fields": {
+                        "url": full_url,
+                        "rating": rating_value,
+                        "reviews_count": reviews_count,
+                        "hourly_rate": hourly_rate,
+                    },
+                    # Card-level fields, written straight away in listing-only fast mode
+                    "listing_card": {key: item[key] for key in (
+                        "name", "title", "description", "thumbnail", "country_id", "country_name",
+                        "url_of_search", "source", "source_id", "category_id", "main_category", "subcategory")},
                 }
             )
 
-        # Check for next page in the current category and location
-        next_page = response.xpath('//a[contains(text(), "Next")]/@href').get()
-        if next_page:
-            self.logger.info(f"Moving to next page in category {current_category}, location {current_location}")
-            yield response.follow(
-                next_page,
-                callback=self.parse,
-                meta={
-                    "playwright": True,
-                    "playwright_page_methods": [{"method": "wait_for_timeout", "args": [5000]}],
-                    "category_id": current_category,
-                    "category_info": category_info,
-                    "location": current_location,
-                    "location_data": location_data
-                }
-            )
-        else:
-            # Move to the next location or category
+        # Lead pages schedule the next ones: every remaining page at once when the
+        # pagination gives the last page, otherwise the page behind the "Next" link
+        current_page = int(response.meta.get("page") or self._get_page_number(response.url))
+        next_pages, lead_page = [], None
+        if response.meta.get("lead", True):
+            has_next = bool(response.xpath('//a[contains(text(), "Next")]/@href').get())
+            last_page = last_page_number(response, '//ul[contains(@class, "pagination")]//a/@href', r'[?&]page=(\d+)')
+            next_pages, lead_page = listing_pages(current_page, last_page if has_next else None, has_next,
+                                                  self.settings.getint('LISTING_FANOUT_MAX_PAGES', 20))
+
+        if self.crawl_plan.page_done(current_category, current_location, current_page, next_pages):
+            # No page left for this chain (or it now belongs to another worker): next combination
             yield from self._move_to_next_location_or_category(response)
+            return
+        if next_pages:
+            self.logger.info(f"Scheduling listing pages {next_pages[0]}-{next_pages[-1]} "
+                             f"in category {current_category}, location {current_location}")
+        for next_page in next_pages:
+            yield self._listing_request(current_category, current_location, next_page, lead=next_page == lead_page)
 
     def _move_to_next_location_or_category(self, response):
-        """Helper method to move to the next location or category"""
+        """Helper method to close the current chain and start the next combinations of the plan"""
         current_category = response.meta.get("category_id")
-        category_info = response.meta.get("category_info", {})
         current_location = response.meta.get("location")
-        location_data = response.meta.get("location_data", {})
-        
-        # Find indices
-        try:
-            category_index = self.categories.index(current_category)
-            location_index = self.location_codes.index(current_location)
-            
-            # Try moving to the next location first
-            if location_index < len(self.location_codes) - 1:
-                next_location = self.location_codes[location_index + 1]
-                next_location_data = self.location_info.get(next_location, {})
-                
-                self.logger.info(f"Moving to next location: {next_location} ({next_location_data.get('country_name', '')}) for category {current_category}")
-                
-                url = f'https://www.truelancer.com/freelancers?page=1&slist={current_category}'
-                if next_location != 'ALL':
-                    url = f"{url}&clist={next_location}"
-                
-                yield scrapy.Request(
-                    url=url,
-                    callback=self.parse,
-                    meta={
-                        "playwright": True,
-                        "playwright_page_methods": [{"method": "wait_for_timeout", "args": [5000]}],
-                        "category_id": current_category,
-                        "category_info": category_info,
-                        "location": next_location,
-                        "location_data": next_location_data
-                    }
-                )
-            # If we've gone through all locations, move to the next category
-            elif category_index < len(self.categories) - 1:
-                next_category = self.categories[category_index + 1]
-                next_category_info = self.category_names.get(next_category, {})
-                
-                # Reset location to the first one
-                first_location = self.location_codes[0]
-                first_location_data = self.location_info.get(first_location, {})
-                
-                self.logger.info(f"Moving to next category: {next_category} ({next_category_info.get('main_category', '')}: {next_category_info.get('subcategory', '')}) with location {first_location}")
-                
-                url = f'https://www.truelancer.com/freelancers?page=1&slist={next_category}'
-                if first_location != 'ALL':
-                    url = f"{url}&clist={first_location}"
-                
-                yield scrapy.Request(
-                    url=url,
-                    callback=self.parse,
-                    meta={
-                        "playwright": True,
-                        "playwright_page_methods": [{"method": "wait_for_timeout", "args": [5000]}],
-                        "category_id": next_category,
-                        "category_info": next_category_info,
-                        "location": first_location,
-                        "location_data": first_location_data
-                    }
-                )
-            else:
-                self.logger.info("All categories and locations have been processed")
-        except ValueError as e:
-            self.logger.warning(f"Error finding category or location index: {e}")
-            
-            # Récupération en cas d'erreur: commencer avec la première catégorie et le premier pays
-            if self.categories and self.location_codes:
-                first_category = self.categories[0]
-                first_location = self.location_codes[0]
-                first_category_info = self.category_names.get(first_category, {})
-                first_location_data = self.location_info.get(first_location, {})
-                
-                self.logger.info(f"Recovering from error - starting with first category: {first_category} and location: {first_location}")
-                
-                url = f'https://www.truelancer.com/freelancers?page=1&slist={first_category}'
-                if first_location != 'ALL':
-                    url = f"{url}&clist={first_location}"
-                
-                yield scrapy.Request(
-                    url=url,
-                    callback=self.parse,
-                    meta={
-                        "playwright": True,
-                        "playwright_page_methods": [{"method": "wait_for_timeout", "args": [5000]}],
-                        "category_id": first_category,
-                        "category_info": first_category_info,
-                        "location": first_location,
-                        "location_data": first_location_data
-                    }
-                )
+
+        for next_category, next_location in self.crawl_plan.complete(current_category, current_location):
+            next_category_info = self.category_names.get(next_category, {})
+            next_location_data = self.location_info.get(next_location, {})
+            self.logger.info(f"Moving to next combination: {next_category} ({next_category_info.get('main_category', '')}: {next_category_info.get('subcategory', '')}) "
+                             f"with location {next_location} ({next_location_data.get('country_name', '')})")
+            yield self._listing_request(next_category, next_location,
+                                        self.crawl_plan.start_page(next_category, next_location))
+
+        if self.crawl_plan.finished:
+            self.logger.info("All categories and locations have been processed")
 
     def _get_page_number(self, url):
         """Extract page number from the URL"""
@@ -511,6 +468,7 @@ class TruelancerSpider(scrapy.Spider):
                         'text': text,
                         'title': title,
                         'created_at': created_at,
+                        'review_date': created_at_text,
                         'source': item.get('source', 'TrueLancer'),
                         'source_id': item.get('source_id')
                     }
@@ -0,0 +1,111 @@
+"""
+Rendement historique des combinaisons (catégorie, localisation) d'un plan de crawl.
+
+La collection `crawl_yields` garde, par spider et par combinaison, les résultats des crawls
+passés: freelancers trouvés (moyenne glissante), items, secondes de navigateur, et une série
+de crawls vides. Elle sert à ordonner le plan (voir CrawlPlan):
+
+- les combinaisons les plus productives passent en premier, avec une priorité de requête
+  plus haute; les combinaisons jamais crawlées reçoivent le rendement moyen connu;
+- une combinaison vide n'est resondée qu'après un délai qui double à chaque crawl vide
+  (CRAWL_YIELD_BACKOFF, plafonné par CRAWL_YIELD_MAX_BACKOFF).
+
+La table est lue à l'ouverture du spider et les résultats d'un crawl sont enregistrés à
+sa fermeture par YieldRecorder (extensions.py), uniquement pour les chaînes terminées.
+"""
+
+import json
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+# Poids du dernier crawl dans la moyenne glissante
+EWMA_ALPHA = 0.5
+MAX_PRIORITY = 100
+
+
+def yield_id(spider_name, key):
+    return f"{spider_name}:{json.dumps(list(key))}"
+
+
+class YieldTable:
+    """Rendements connus des combinaisons d'un spider."""
+
+    def __init__(self, records=None, now=None):
+        # combinaison -> document crawl_yields
+        self.records = records or {}
+        self.now = now or datetime.utcnow()
+
+    @classmethod
+    def fetch(cls, db, spider_name):
+        """Table d'un spider, lue dans crawl_yields (hors du thread du reactor, voir YieldRecorder)."""
+        return cls({tuple(doc['key']): doc for doc in db.crawl_yields.find({"spider": spider_name})
+                    if doc.get('key')})
+
+    def score(self, key, default):
+        record = self.records.get(key)
+        return record.get('avg_freelancers', 0.0) if record else default
+
+    def skipped(self, key):
+        """Combinaison vide encore dans son délai de backoff."""
+        record = self.records.get(key)
+        return bool(record and record.get('next_probe_at') and record['next_probe_at'] > self.now)
+
+    def prioritize(self, combinations):
+        """
+        Ordonne les combinaisons par rendement décroissant (tri stable: à rendement égal,
+        l'ordre de la graine est conservé). Retourne (combinaisons ordonnées, écartées, priorités).
+        """
+        known = [self.records[key].get('avg_freelancers', 0.0) for key in combinations if key in self.records]
+        default = sum(known) / len(known) if known else 0.0
+        skipped = {key for key in combinations if self.skipped(key)}
+        kept = [key for key in combinations if key not in skipped]
+        scores = {key: self.score(key, default) for key in kept}
+        best = max(scores.values(), default=0.0)
+        priorities = {key: int(round(MAX_PRIORITY * score / best)) if best else 0
+                      for key, score in scores.items()}
+        return sorted(kept, key=lambda key: -scores[key]), skipped, priorities
+
+
+def record_yields(db, spider_name, results, backoff, max_backoff, now=None):
+    """
+    Met à jour crawl_yields avec les résultats d'un crawl:
+    {combinaison: {"freelancers", "items", "pages", "browser_seconds"}}.
+    """
+    now = now or datetime.utcnow()
+    existing = {doc['_id']: doc for doc in db.crawl_yields.find(
+        {"_id": {"$in": [yield_id(spider_name, key) for key in results]}})}
+    operations = []
+    for key, result in results.items():
+        _id = yield_id(spider_name, key)
+        previous = existing.get(_id, {})
+        freelancers = result.get('freelancers', 0)
+        avg = freelancers if 'avg_freelancers' not in previous else \
+            EWMA_ALPHA * freelancers + (1 - EWMA_ALPHA) * previous['avg_freelancers']
+        empty_streak = 0 if freelancers else previous.get('empty_streak', 0) + 1
+        next_probe_at = None
+        if empty_streak:
+            delay = min(max_backoff, backoff * 2 ** (empty_streak - 1))
+            next_probe_at = now + timedelta(seconds=delay)
+        browser_minutes = result.get('browser_seconds', 0) / 60
+        operations.append(UpdateOne(
+            {"_id": _id},
+            {"$set": {
+                "spider": spider_name,
+                "key": list(key),
+                "avg_freelancers": round(avg, 3),
+                "last_freelancers": freelancers,
+                "last_items": result.get('items', 0),
+                "last_pages": result.get('pages', 0),
+                "last_browser_seconds": round(result.get('browser_seconds', 0), 1),
+                "last_items_per_browser_minute":
+                    round(result.get('items', 0) / browser_minutes, 2) if browser_minutes else None,
+                "empty_streak": empty_streak,
+                "next_probe_at": next_probe_at,
+                "last_crawled_at": now,
+            }, "$inc": {"runs": 1}},
+            upsert=True
+        ))
+    if operations:
+        db.crawl_yields.bulk_write(operations, ordered=False)
+    return len(operations)
@@ -2,10 +2,12 @@ from flask import Flask, jsonify, request
 from flask_cors import CORS
 from bson.objectid import ObjectId
 import os
-from datetime import datetime
 
 from models import Country, Freelancer, Project, Service, Review
-from db import db, initialize_db, JSONEncoder
+from db import db, initialize_db, JSONEncoder, MongoJSONProvider
+from stats import freelancer_stats
+from pagination import paginate, PaginationError
+from projections import projection_for, ProjectionError
 
 app = Flask(__name__)
 # Allow CORS for all routes and origins
@@ -13,8 +15,19 @@ CORS(app, resources={r"/*": {"origins": "*"}})
 
 # Configuration de l'application
 app.json_encoder = JSONEncoder
+app.json = MongoJSONProvider(app)
 app.config['JSON_SORT_KEYS'] = False
 
+# Champs acceptés par le paramètre `sort` des listes (indexés avec _id, voir initialize_db)
+FREELANCER_SORT_FIELDS = ('rating', 'hourly_rate', 'reviews_count', 'created_at')
+REVIEW_SORT_FIELDS = ('rating', 'created_at')
+SERVICE_SORT_FIELDS = ('price',)
+
+@app.errorhandler(PaginationError)
+@app.errorhandler(ProjectionError)
+def handle_query_error(e):
+    return jsonify({"error": str(e)}), 400
+
 @app.route('/')
 def index():
     return jsonify({"message": "Bienvenue sur l'API de Develly Scraper"})
@@ -38,29 +51,20 @@ def get_freelancers():
         # Pour MongoDB, on peut rechercher dans un tableau avec l'opérateur $in
         filters['skills'] = {"$in": [skill]}
     
-    # Support pour la pagination
-    page = int(request.args.get('page', 1))
-    limit = int(request.args.get('limit', 20))
-    skip = (page - 1) * limit
-    
-    # Récupérer les freelancers avec pagination et filtres
-    freelancers = list(db.freelancers.find(filters).skip(skip).limit(limit))
-    total = db.freelancers.count_documents(filters)
+    # Récupérer les freelancers avec pagination (page ou curseur) et filtres
+    freelancers, meta = paginate(db.freelancers, filters, request.args, sortable=FREELANCER_SORT_FIELDS,
+                                 projection=projection_for('freelancers', request.args))
     
     return jsonify({
         "data": [{**doc, '_id': str(doc['_id'])} for doc in freelancers],
-        "meta": {
-            "total": total,
-            "page": page,
-            "limit": limit,
-            "pages": (total + limit - 1) // limit
-        }
+        "meta": meta
     })
 
 @app.route('/api/freelancers/<freelancer_id>', methods=['GET'])
 def get_freelancer(freelancer_id):
     try:
-        freelancer = db.freelancers.find_one({"_id": ObjectId(freelancer_id)})
+        freelancer = db.freelancers.find_one({"_id": ObjectId(freelancer_id)},
+                                             projection_for('freelancers', request.args))
         if not freelancer:
             return jsonify({"error": "Freelancer non trouvé"}), 404
         
@@ -92,28 +96,18 @@ def get_country(country_id):
 # Routes pour les Projets
 @app.route('/api/projects', methods=['GET'])
 def get_projects():
-    # Support pour la pagination
-    page = int(request.args.get('page', 1))
-    limit = int(request.args.get('limit', 20))
-    skip = (page - 1) * limit
-    
-    projects = list(db.projects.find().skip(skip).limit(limit))
-    total = db.projects.count_documents({})
+    # Support pour la pagination (page ou curseur)
+    projects, meta = paginate(db.projects, {}, request.args, projection=projection_for('projects', request.args))
     
     return jsonify({
         "data": [{**doc, '_id': str(doc['_id'])} for doc in projects],
-        "meta": {
-            "total": total,
-            "page": page,
-            "limit": limit,
-            "pages": (total + limit - 1) // limit
-        }
+        "meta": meta
     })
 
 @app.route('/api/projects/<project_id>', methods=['GET'])
 def get_project(project_id):
     try:
-        project = db.projects.find_one({"_id": ObjectId(project_id)})
+        project = db.projects.find_one({"_id": ObjectId(project_id)}, projection_for('projects', request.args))
         if not project:
             return jsonify({"error": "Projet non trouvé"}), 404
         
@@ -158,28 +152,19 @@ def get_services():
         except Exception as e:
             return jsonify({"error": str(e)}), 400
     
-    # Pagination
-    page = int(request.args.get('page', 1))
-    limit = int(request.args.get('limit', 20))
-    skip = (page - 1) * limit
-    
-    services = list(db.services.find(filters).skip(skip).limit(limit))
-    total = db.services.count_documents(filters)
+    # Pagination (page ou curseur)
+    services, meta = paginate(db.services, filters, request.args, sortable=SERVICE_SORT_FIELDS,
+                              projection=projection_for('services', request.args))
     
     return jsonify({
         "data": [{**doc, '_id': str(doc['_id'])} for doc in services],
-        "meta": {
-            "total": total,
-            "page": page,
-            "limit": limit,
-            "pages": (total + limit - 1) // limit
-        }
+        "meta": meta
     })
 
 @app.route('/api/services/<service_id>', methods=['GET'])
 def get_service(service_id):
     try:
-        service = db.services.find_one({"_id": ObjectId(service_id)})
+        service = db.services.find_one({"_id": ObjectId(service_id)}, projection_for('services', request.args))
         if not service:
             return jsonify({"error": "Service non trouvé"}), 404
         
@@ -231,73 +216,67 @@ def get_reviews():
             print(f"Exception in freelancer_id filter: {str(e)}")
             return jsonify({"error": str(e)}), 400
     
-    # Pagination
-    page = int(request.args.get('page', 1))
-    limit = int(request.args.get('limit', 20))
-    skip = (page - 1) * limit
-    
-    # Récupérer la liste des reviews
+    # Récupérer la liste des reviews (pagination par page ou curseur)
     print(f"Executing find with filters: {filters}")
-    reviews = list(db.reviews.find(filters).skip(skip).limit(limit))
+    reviews, meta = paginate(db.reviews, filters, request.args, sortable=REVIEW_SORT_FIELDS,
+                             projection=projection_for('reviews', request.args))
     print(f"Found {len(reviews)} reviews")
-    total = db.reviews.count_documents(filters)
     
     # Option pour inclure les données des freelancers
     include_freelancers = request.args.get('include_freelancers', 'false').lower() == 'true'
     
     if include_freelancers:
+        # Récupérer en une seule requête les freelancers de toutes les reviews de la page
+        freelancer_ids = set()
+        for review in reviews:
+            if review.get('freelancer_ref'):
+                freelancer_ids.add(review['freelancer_ref'])
+            elif 'freelancer_id' in review:
+                try:
+                    freelancer_ids.add(ObjectId(review['freelancer_id']))
+                except Exception as e:
+                    print(f"Erreur lors de la récupération du freelancer pour la review {review['_id']}: {str(e)}")
+        freelancers = {
+            str(freelancer['_id']): freelancer
+            for freelancer in db.freelancers.find({"_id": {"$in": list(freelancer_ids)}})
+        } if freelancer_ids else {}
+        
+        # Champs nécessaires au frontend, présents même s'ils sont null
+        required_fields = [
+            'name', 'country_id', 'main_skill', 'hourly_rate', 
+            'min_price', 'max_price', 'created_at', 'source', 
+            'rating', 'reviews_count', 'skills'
+        ]
+        
         # Préparer la réponse avec les données des freelancers
         result = []
         for review in reviews:
             review_data = {**review, '_id': str(review['_id'])}
-            try:
-                # Récupérer le freelancer associé à cette review
-                if 'freelancer_id' in review:
-                    freelancer = db.freelancers.find_one({"_id": ObjectId(review['freelancer_id'])})
-                    if freelancer:
-                        # S'assurer que l'ObjectId est converti en chaîne et que tous les champs requis sont présents
-                        freelancer_data = {**freelancer, '_id': str(freelancer['_id'])}
-                        # S'assurer que les champs nécessaires sont présents, même s'ils sont null
-                        required_fields = [
-                            'name', 'country_id', 'main_skill', 'hourly_rate', 
-                            'min_price', 'max_price', 'created_at', 'source', 
-                            'rating', 'reviews_count', 'skills'
-                        ]
-                        for field in required_fields:
-                            if field not in freelancer_data:
-                                freelancer_data[field] = None
-                                
-                        review_data['freelancer'] = freelancer_data
-            except Exception as e:
-                print(f"Erreur lors de la récupération du freelancer pour la review {review['_id']}: {str(e)}")
-                pass
+            freelancer = freelancers.get(str(review.get('freelancer_ref') or review.get('freelancer_id')))
+            if freelancer:
+                # S'assurer que l'ObjectId est converti en chaîne et que tous les champs requis sont présents
+                freelancer_data = {**freelancer, '_id': str(freelancer['_id'])}
+                for field in required_fields:
+                    if field not in freelancer_data:
+                        freelancer_data[field] = None
+                review_data['freelancer'] = freelancer_data
             result.append(review_data)
         
         return jsonify({
             "data": result,
-            "meta": {
-                "total": total,
-                "page": page,
-                "limit": limit,
-                "pages": (total + limit - 1) // limit
-            }
+            "meta": meta
         })
     else:
         # Format de réponse standard
         return jsonify({
             "data": [{**doc, '_id': str(doc['_id'])} for doc in reviews],
-            "meta": {
-                "total": total,
-                "page": page,
-                "limit": limit,
-                "pages": (total + limit - 1) // limit
-            }
+            "meta": meta
         })
 
 @app.route('/api/reviews/<review_id>', methods=['GET'])
 def get_review(review_id):
     try:
-        review = db.reviews.find_one({"_id": ObjectId(review_id)})
+        review = db.reviews.find_one({"_id": ObjectId(review_id)}, projection_for('reviews', request.args))
         if not review:
             return jsonify({"error": "Review non trouvée"}), 404
         
@@ -352,146 +331,18 @@ def get_stats():
         if min_rating and min_rating.replace('.', '', 1).isdigit():
             filters['rating'] = {"$gte": float(min_rating)}
 
-        # Statistiques de base
+        # Analyses des freelancers filtrés: une seule agrégation côté MongoDB
+        analysis = freelancer_stats(db, filters)
+        
+        # Totaux non filtrés lus dans les métadonnées des collections
         stats = {
-            "freelancers_count": db.freelancers.count_documents(filters),
-            "countries_count": db.countries.count_documents({}),
-            "services_count": db.services.count_documents({}),
-            "reviews_count": db.reviews.count_documents({}),
-            "avg_rating": 0,
-            "top_countries": [],
-            "top_skills": [],
-            "hourly_rate_distribution": [],
-            "rating_distribution": [],
-            "source_distribution": [],
-            "signup_by_month": []
+            "freelancers_count": analysis.pop("freelancers_count"),
+            "countries_count": db.countries.estimated_document_count(),
+            "services_count": db.services.estimated_document_count(),
+            "reviews_count": db.reviews.estimated_document_count(),
+            **analysis
         }
         
-        # Freelancers filtrés pour les analyses
-        freelancers = list(db.freelancers.find(filters))
-        
-        # Calculer la note moyenne
-        if freelancers:
-            # Utiliser une list comprehension pour exclure les valeurs None et garantir que ce sont des nombres
-            ratings = [f.get('rating', 0) for f in freelancers if f.get('rating') is not None]
-            if ratings:  # S'assurer qu'il y a au moins une note valide
-                stats["avg_rating"] = round(sum(ratings) / len(ratings), 2)
-            else:
-                stats["avg_rating"] = 0  # Valeur par défaut si aucune note valide
-        
-        # Top des pays par nombre de freelancers
-        country_pipeline = [
-            {"$match": filters} if filters else {"$match": {}},
-            {"$group": {"_id": "$country_id", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}},
-            {"$limit": 10}
-        ]
-        top_countries_result = list(db.freelancers.aggregate(country_pipeline))
-        
-        # Récupérer les noms des pays
-        for country_stat in top_countries_result:
-            try:
-                country_id = country_stat["_id"]
-                if country_id:
-                    country = db.countries.find_one({"_id": ObjectId(country_id)})
-                    if country:
-                        stats["top_countries"].append({
-                            "name": country["name"],
-                            "code": country["code"],
-                            "count": country_stat["count"]
-                        })
-            except Exception:
-                pass
-        
-        # Distribution des compétences principales
-        skill_pipeline = [
-            {"$match": filters} if filters else {"$match": {}},
-            {"$group": {"_id": "$main_skill", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}},
-            {"$limit": 10}
-        ]
-        top_skills_result = list(db.freelancers.aggregate(skill_pipeline))
-        stats["top_skills"] = [{"name": skill["_id"], "count": skill["count"]} for skill in top_skills_result if skill["_id"]]
-        
-        # Distribution des taux horaires
-        rate_ranges = [
-            {"min": 0, "max": 20, "label": "$0-20"},
-            {"min": 20, "max": 40, "label": "$20-40"},
-            {"min": 40, "max": 60, "label": "$40-60"},
-            {"min": 60, "max": 80, "label": "$60-80"},
-            {"min": 80, "max": 100, "label": "$80-100"},
-            {"min": 100, "max": 150, "label": "$100-150"},
-            {"min": 150, "max": float('inf'), "label": "$150+"}
-        ]
-        
-        for rate_range in rate_ranges:
-            # Construire la requête MongoDB correctement
-            query = {**filters}
-            
-            if rate_range["max"] == float('inf'):
-                query["hourly_rate"] = {"$ne": None, "$gte": rate_range["min"]}
-            else:
-                query["hourly_rate"] = {"$ne": None, "$gte": rate_range["min"], "$lt": rate_range["max"]}
-                
-            count = db.freelancers.count_documents(query)
-            
-            if count > 0:
-                stats["hourly_rate_distribution"].append({
-                    "range": rate_range["label"],
-                    "count": count
-                })
-        
-        # Distribution des notes
-        for rating in range(1, 6):
-            # Utiliser un $match qui exclut explicitement les valeurs nulles
-            query = {**filters}
-            query["rating"] = {
-                "$ne": None,  # Exclure les ratings null
-                "$gte": rating - 0.5, 
-                "$lt": rating + 0.5
-            }
-            
-            count = db.freelancers.count_documents(query)
-            stats["rating_distribution"].append({
-                "rating": rating,
-                "count": count
-            })
-        
-        # Distribution des sources
-        source_pipeline = [
-            {"$match": filters} if filters else {"$match": {}},
-            {"$group": {"_id": "$source", "count": {"$sum": 1}}},
-            {"$sort": {"count": -1}}
-        ]
-        source_result = list(db.freelancers.aggregate(source_pipeline))
-        stats["source_distribution"] = [{"source": source["_id"] or "Unknown", "count": source["count"]} for source in source_result]
-        
-        # Inscriptions par mois
-        if freelancers:
-            signups_by_month = {}
-            for freelancer in freelancers:
-                if 'created_at' in freelancer and freelancer['created_at'] is not None:
-                    date = freelancer['created_at']
-                    if isinstance(date, str):
-                        try:
-                            date = datetime.fromisoformat(date.replace('Z', '+00:00'))
-                        except (ValueError, TypeError):
-                            continue  # Ignorer les dates mal formatées
-                    
-                    try:
-                        month_year = f"{date.year}-{date.month:02d}"
-                        if month_year not in signups_by_month:
-                            signups_by_month[month_year] = 0
-                        signups_by_month[month_year] += 1
-                    except (AttributeError, TypeError):
-                        continue  # Ignorer si date n'a pas les attributs year/month
-            
-            # Convertir en liste triée par date
-            stats["signup_by_month"] = [
-                {"month": month, "count": count}
-                for month, count in sorted(signups_by_month.items())
-            ]
-        
         return jsonify(stats)
     except Exception as e:
         return jsonify({"error": str(e)}), 400
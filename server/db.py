@@ -3,6 +3,7 @@ Module de gestion de la connexion à la base de données MongoDB.
 """
 
 from pymongo import MongoClient
+from flask.json.provider import DefaultJSONProvider
 import os
 from bson.objectid import ObjectId
 import json
@@ -36,6 +37,17 @@ class JSONEncoder(json.JSONEncoder):
             return o.isoformat()
         return json.JSONEncoder.default(self, o)
 
+# Équivalent pour Flask >= 2.3 (app.json_encoder n'y est plus pris en compte):
+# les ObjectId, comme freelancer_ref, sont sérialisés en chaîne
+class MongoJSONProvider(DefaultJSONProvider):
+    @staticmethod
+    def default(o):
+        if isinstance(o, ObjectId):
+            return str(o)
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
 def get_collection(collection_name):
     """Récupère une collection MongoDB."""
     return db[collection_name]
@@ -73,6 +85,20 @@ def initialize_db():
     
     db.reviews.create_index("freelancer_id")
     db.services.create_index("freelancer_id")
+    # Référence typée vers le freelancer (renseignée par le scraper, voir maintenance.py pour l'existant)
+    db.reviews.create_index("freelancer_ref")
+    db.services.create_index("freelancer_ref")
+    
+    # Index des tris et filtres paginés par curseur (clé de tri + _id, voir pagination.py)
+    for field in ("rating", "hourly_rate", "reviews_count", "created_at"):
+        db.freelancers.create_index([(field, 1), ("_id", 1)])
+    # Filtre par pays trié par _id; couvre aussi la projection `fields=summary` (voir projections.py)
+    db.freelancers.create_index([("country_id", 1), ("_id", 1), ("name", 1), ("main_skill", 1),
+                                 ("rating", 1), ("hourly_rate", 1)])
+    for field in ("freelancer_id", "rating", "created_at"):
+        db.reviews.create_index([(field, 1), ("_id", 1)])
+    for field in ("freelancer_id", "price"):
+        db.services.create_index([(field, 1), ("_id", 1)])
     
     print("Base de données initialisée avec succès")
 
@@ -0,0 +1,140 @@
+"""
+Pagination des endpoints de liste.
+
+Deux modes, avec la même forme de réponse ({"data": [...], "meta": {...}}):
+- par page (`page`, `limit`): skip/limit classique, conservé pour le frontend;
+- par curseur (`after`): le jeton opaque renvoyé dans `meta.next_after` encode la clé de tri
+  et l'_id du dernier document, la page suivante part de là via l'index (pas de skip).
+
+Le total est optionnel (`total`): `exact` (count_documents), `estimated`
+(estimated_document_count, sans filtre uniquement), `cached` (count_documents mis en cache
+quelques secondes) ou `none`.
+"""
+
+import base64
+import os
+import time
+
+from bson import json_util
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 1000
+TOTAL_MODES = ('exact', 'estimated', 'cached', 'none')
+COUNT_CACHE_TTL = int(os.environ.get('COUNT_CACHE_TTL', 60))
+
+# (collection, filtres sérialisés) -> (total, date de calcul)
+_count_cache = {}
+
+
+class PaginationError(ValueError):
+    """Paramètre de pagination invalide (réponse 400)."""
+
+
+def encode_cursor(sort_field, document):
+    payload = json_util.dumps({"f": sort_field, "v": document.get(sort_field), "id": document['_id']})
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, sort_field):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json_util.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        value, last_id = payload['v'], payload['id']
+    except Exception:
+        raise PaginationError("Curseur 'after' invalide")
+    if payload.get('f') != sort_field:
+        raise PaginationError("Le curseur 'after' a été émis pour un autre tri")
+    return value, last_id
+
+
+def keyset_filter(sort_field, direction, value, last_id):
+    """Documents situés après (value, last_id) dans l'ordre (sort_field, _id)."""
+    after_id = {"$gt" if direction == 1 else "$lt": last_id}
+    if sort_field == '_id':
+        return {"_id": after_id}
+    # MongoDB trie les valeurs nulles/absentes avant toutes les autres
+    if value is None:
+        if direction == 1:
+            return {"$or": [{sort_field: {"$ne": None}}, {sort_field: None, "_id": after_id}]}
+        return {sort_field: None, "_id": after_id}
+    operator = "$gt" if direction == 1 else "$lt"
+    conditions = [{sort_field: {operator: value}}, {sort_field: value, "_id": after_id}]
+    if direction == -1:
+        conditions.append({sort_field: None})
+    return {"$or": conditions}
+
+
+def count_total(collection, filters, mode):
+    if mode == 'none':
+        return None
+    if mode == 'estimated' and not filters:
+        return collection.estimated_document_count()
+    if mode in ('estimated', 'cached'):
+        key = (collection.name, json_util.dumps(filters, sort_keys=True))
+        cached = _count_cache.get(key)
+        if cached and time.monotonic() - cached[1] < COUNT_CACHE_TTL:
+            return cached[0]
+        total = collection.count_documents(filters)
+        _count_cache[key] = (total, time.monotonic())
+        return total
+    return collection.count_documents(filters)
+
+
+def _int_arg(args, name, default):
+    value = args.get(name, default)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise PaginationError(f"Paramètre '{name}' invalide: {value}")
+
+
+def paginate(collection, filters, args, sortable=(), projection=None):
+    """
+    Exécute la requête paginée décrite par les paramètres de la requête HTTP.
+
+    `sortable` liste les champs (indexés avec _id) acceptés pour `sort`; `-champ` trie en
+    ordre décroissant. `projection` restreint les champs renvoyés (voir projections.py).
+    Retourne (documents, meta).
+    """
+    limit = min(max(_int_arg(args, 'limit', DEFAULT_LIMIT), 1), MAX_LIMIT)
+
+    sort_arg = args.get('sort', '_id')
+    direction = -1 if sort_arg.startswith('-') else 1
+    sort_field = sort_arg.lstrip('-')
+    if sort_field != '_id' and sort_field not in sortable:
+        raise PaginationError(f"Tri non supporté: {sort_field}")
+    sort = [(sort_field, direction)] if sort_field == '_id' else [(sort_field, direction), ('_id', direction)]
+
+    after = args.get('after')
+    # Sans curseur, le total exact reste le défaut pour le frontend paginé
+    total_mode = args.get('total', 'none' if after else 'exact')
+    if total_mode not in TOTAL_MODES:
+        raise PaginationError(f"Mode de total invalide: {total_mode} ({', '.join(TOTAL_MODES)})")
+
+    if projection is not None:
+        # Le curseur suivant est construit à partir de la clé de tri du dernier document
+        projection = {**projection, sort_field: 1}
+
+    page = None
+    if after:
+        value, last_id = decode_cursor(after, sort_field)
+        condition = keyset_filter(sort_field, direction, value, last_id)
+        cursor = collection.find({"$and": [filters, condition]} if filters else condition, projection)
+    else:
+        page = max(_int_arg(args, 'page', 1), 1)
+        cursor = collection.find(filters, projection).skip((page - 1) * limit)
+
+    # Un document de plus pour savoir s'il existe une page suivante
+    documents = list(cursor.sort(sort).limit(limit + 1))
+    has_more = len(documents) > limit
+    documents = documents[:limit]
+
+    total = count_total(collection, filters, total_mode)
+    meta = {
+        "total": total,
+        "page": page,
+        "limit": limit,
+        "pages": (total + limit - 1) // limit if total is not None else None,
+        "next_after": encode_cursor(sort_field, documents[-1]) if has_more else None,
+    }
+    return documents, meta
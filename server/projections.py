@@ -0,0 +1,63 @@
+"""
+Projections des endpoints (paramètre `fields`).
+
+`fields` accepte un préréglage (`card`, `summary`, `full`) ou une liste de champs séparés par
+des virgules (`fields=name,rating,skills`). Sans `fields`, les documents complets sont
+renvoyés comme avant. `_id` est toujours inclus.
+"""
+
+import re
+
+FREELANCER_CARD = ['name', 'country_id', 'main_skill', 'hourly_rate', 'min_price', 'max_price',
+                   'created_at', 'source', 'rating', 'reviews_count', 'skills', 'thumbnail', 'url']
+
+# None = document complet
+PRESETS = {
+    'freelancers': {
+        'card': FREELANCER_CARD,
+        # Couvert par l'index (country_id, _id, name, main_skill, rating, hourly_rate), voir initialize_db
+        'summary': ['name', 'country_id', 'main_skill', 'rating', 'hourly_rate'],
+        'full': None,
+    },
+    'reviews': {
+        'card': ['freelancer_id', 'freelancer_ref', 'author', 'rating', 'title', 'text', 'created_at', 'source'],
+        'full': None,
+    },
+    'services': {
+        'card': ['freelancer_id', 'freelancer_ref', 'title', 'price', 'duration', 'url', 'source'],
+        'full': None,
+    },
+    'projects': {
+        'card': ['title', 'main_picture', 'delivery_time', 'pricing'],
+        'full': None,
+    },
+}
+
+
+class ProjectionError(ValueError):
+    """Paramètre `fields` invalide (réponse 400)."""
+
+
+FIELD_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$')
+
+
+def projection_for(resource, args):
+    """Projection MongoDB demandée par `fields`, ou None pour le document complet."""
+    fields = args.get('fields')
+    if not fields:
+        return None
+
+    presets = PRESETS.get(resource, {})
+    if fields in presets:
+        names = presets[fields]
+        if names is None:
+            return None
+    else:
+        names = [name.strip() for name in fields.split(',') if name.strip()]
+        invalid = [name for name in names if not FIELD_NAME.match(name)]
+        if invalid:
+            raise ProjectionError(f"Champs invalides: {', '.join(invalid)}")
+
+    projection = {name: 1 for name in names}
+    projection['_id'] = 1
+    return projection
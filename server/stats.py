@@ -0,0 +1,120 @@
+"""
+Agrégation des statistiques de /api/stats.
+
+Toutes les analyses sur les freelancers filtrés sont calculées par MongoDB en une seule
+passe ($facet): aucun document n'est chargé en Python, quel que soit le volume.
+"""
+
+# Tranches de taux horaire: bornes du $bucket et libellés exposés par l'API
+RATE_BOUNDARIES = [0, 20, 40, 60, 80, 100, 150]
+RATE_LABELS = {0: "$0-20", 20: "$20-40", 40: "$40-60", 60: "$60-80",
+               80: "$80-100", 100: "$100-150", "150+": "$150+"}
+
+# Notes arrondies à l'entier le plus proche: [0.5, 1.5) -> 1, ..., [4.5, 5.5) -> 5
+RATING_BOUNDARIES = [0.5, 1.5, 2.5, 3.5, 4.5, 5.5]
+
+
+def stats_pipeline(filters):
+    """Pipeline unique: un $match puis une branche $facet par statistique."""
+    return [
+        {"$match": filters},
+        {"$facet": {
+            "total": [{"$count": "count"}],
+            "avg_rating": [
+                {"$group": {"_id": None, "avg": {"$avg": "$rating"}}},
+            ],
+            "top_countries": [
+                {"$group": {"_id": "$country_id", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1}},
+                {"$limit": 10},
+                # country_id est stocké sous forme de chaîne
+                {"$lookup": {
+                    "from": "countries",
+                    "let": {"country_id": "$_id"},
+                    "pipeline": [
+                        {"$match": {"$expr": {"$eq": [{"$toString": "$_id"}, "$$country_id"]}}},
+                        {"$project": {"_id": 0, "name": 1, "code": 1}},
+                    ],
+                    "as": "country",
+                }},
+                {"$unwind": "$country"},
+            ],
+            "top_skills": [
+                {"$group": {"_id": "$main_skill", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1}},
+                {"$limit": 10},
+            ],
+            "hourly_rate_distribution": [
+                {"$match": {"hourly_rate": {"$type": "number", "$gte": RATE_BOUNDARIES[0]}}},
+                {"$bucket": {
+                    "groupBy": "$hourly_rate",
+                    "boundaries": RATE_BOUNDARIES,
+                    "default": "150+",
+                    "output": {"count": {"$sum": 1}},
+                }},
+            ],
+            "rating_distribution": [
+                {"$match": {"rating": {"$type": "number", "$gte": RATING_BOUNDARIES[0],
+                                       "$lt": RATING_BOUNDARIES[-1]}}},
+                {"$bucket": {
+                    "groupBy": "$rating",
+                    "boundaries": RATING_BOUNDARIES,
+                    "output": {"count": {"$sum": 1}},
+                }},
+            ],
+            "source_distribution": [
+                {"$group": {"_id": "$source", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1}},
+            ],
+            "signup_by_month": [
+                # created_at peut être une date ou une chaîne ISO; les valeurs illisibles sont ignorées
+                {"$project": {"month": {"$dateToString": {
+                    "format": "%Y-%m",
+                    "date": {"$convert": {"input": "$created_at", "to": "date",
+                                          "onError": None, "onNull": None}},
+                    "onNull": None,
+                }}}},
+                {"$match": {"month": {"$ne": None}}},
+                {"$group": {"_id": "$month", "count": {"$sum": 1}}},
+                {"$sort": {"_id": 1}},
+            ],
+        }},
+    ]
+
+
+def freelancer_stats(db, filters):
+    """Statistiques des freelancers filtrés, au format de réponse de /api/stats."""
+    facets = next(db.freelancers.aggregate(stats_pipeline(filters)))
+
+    avg_rating = facets["avg_rating"][0]["avg"] if facets["avg_rating"] else None
+    rate_counts = {bucket["_id"]: bucket["count"] for bucket in facets["hourly_rate_distribution"]}
+    rating_counts = {int(bucket["_id"] + 0.5): bucket["count"] for bucket in facets["rating_distribution"]}
+
+    return {
+        "freelancers_count": facets["total"][0]["count"] if facets["total"] else 0,
+        "avg_rating": round(avg_rating, 2) if avg_rating is not None else 0,
+        "top_countries": [
+            {"name": stat["country"]["name"], "code": stat["country"]["code"], "count": stat["count"]}
+            for stat in facets["top_countries"]
+        ],
+        "top_skills": [
+            {"name": skill["_id"], "count": skill["count"]}
+            for skill in facets["top_skills"] if skill["_id"]
+        ],
+        "hourly_rate_distribution": [
+            {"range": label, "count": rate_counts[key]}
+            for key, label in RATE_LABELS.items() if rate_counts.get(key)
+        ],
+        "rating_distribution": [
+            {"rating": rating, "count": rating_counts.get(rating, 0)}
+            for rating in range(1, 6)
+        ],
+        "source_distribution": [
+            {"source": source["_id"] or "Unknown", "count": source["count"]}
+            for source in facets["source_distribution"]
+        ],
+        "signup_by_month": [
+            {"month": month["_id"], "count": month["count"]}
+            for month in facets["signup_by_month"]
+        ],
+    }